@@ -0,0 +1,300 @@
+import hashlib
+import html
+import os
+import re
+import shutil
+import struct
+import urllib.parse
+import zipfile
+
+IMAGE_EXTENSIONS = (
+    ".bmp",
+    ".gif",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".svg",
+    ".tif",
+    ".tiff",
+    ".webp",
+)
+
+
+class DirectoryArchive:
+    """Read-only stand-in for ZipFile over an unpacked module or world folder.
+
+    Member names are paths relative to the folder with "/" separators, so the
+    folder is treated like a flat archive of the module.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def namelist(self):
+        names = []
+        for root, dirs, files in os.walk(self.path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            rel = os.path.relpath(root, self.path).replace(os.sep, "/")
+            for f in sorted(files):
+                names.append(f if rel == "." else rel + "/" + f)
+        return names
+
+    def filePath(self, name):
+        return os.path.join(self.path, *name.split("/"))
+
+    def open(self, name, mode="r"):
+        return open(self.filePath(name), "rb")
+
+    def read(self, name):
+        with self.open(name) as f:
+            return f.read()
+
+    def link(self, name, local):
+        """Hardlinks a member into the temporary tree. Images are copied since
+        converters resize and re-encode them in place."""
+        src = self.filePath(name)
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            try:
+                os.link(src, local)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(src, local)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def openArchive(path):
+    if os.path.isdir(path):
+        return DirectoryArchive(path)
+    return zipfile.ZipFile(path)
+
+
+class ModuleArchive:
+    """Extracts members of a Foundry archive on demand.
+
+    Members are mapped to the paths extractall() used to give them under the
+    temporary directory, but nothing is written until a converter asks for a
+    path with need(), so assets that nothing references are never extracted.
+    """
+
+    def __init__(self, srcfile, root, dirpath=None, name=None):
+        self.zip = openArchive(srcfile)
+        self.root = os.path.abspath(root)
+        self.members = {}
+        self.locals = {}
+        self.extracted = set()
+        self.pristine = {}
+        self.referenced = set()
+        self.fingerprints = {}
+        self.removed = set()
+        self.log = None
+        for member in self.zip.namelist():
+            if member.endswith("/"):
+                continue
+            if dirpath and member.startswith(dirpath + "/"):
+                local = os.path.join(self.root, name, member[len(dirpath) + 1:])
+            else:
+                local = os.path.join(self.root, member)
+            self.members[os.path.normpath(local)] = member
+            self.locals[member] = os.path.normpath(local)
+
+    def localPath(self, path):
+        path = urllib.parse.unquote(path).split("?")[0]
+        return os.path.normpath(os.path.abspath(path))
+
+    def member(self, path):
+        if not path or urllib.parse.urlparse(path).scheme in ("http", "https"):
+            return None
+        local = self.localPath(path)
+        if local in self.members:
+            return local
+        local = os.path.normpath(os.path.abspath(path))
+        if local in self.members:
+            return local
+        return None
+
+    def extract(self, local):
+        if local in self.extracted:
+            return
+        self.extracted.add(local)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        if type(self.zip) == DirectoryArchive:
+            self.zip.link(self.members[local], local)
+        else:
+            with self.zip.open(self.members[local]) as src, open(local, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        self.remember(local, self.members[local])
+
+    def remember(self, path, member):
+        st = os.stat(path)
+        self.pristine[os.path.normpath(os.path.abspath(path))] = (
+            member,
+            st.st_size,
+            st.st_mtime_ns,
+        )
+
+    def unchanged(self, path):
+        entry = self.pristine.get(os.path.normpath(os.path.abspath(path)))
+        if not entry or not os.path.exists(path):
+            return None
+        st = os.stat(path)
+        if (st.st_size, st.st_mtime_ns) != entry[1:]:
+            return None
+        return entry[0]
+
+    def copy(self, src, dst):
+        shutil.copy(src, dst)
+        member = self.unchanged(src)
+        if member:
+            if os.path.isdir(dst):
+                dst = os.path.join(dst, os.path.basename(src))
+            self.remember(dst, member)
+
+    def open(self, local):
+        """Opens a member by its local path without extracting it."""
+        if local in self.members and local not in self.extracted:
+            return self.zip.open(self.members[local])
+        return open(local, "rb")
+
+    def remove(self, path):
+        os.remove(path)
+        self.removed.add(os.path.normpath(os.path.abspath(path)))
+
+    def write(self, zipObj, path, arcname):
+        """Adds path to zipObj, copying the compressed bytes of the source
+        member when the extracted file was not modified."""
+        member = self.unchanged(path)
+        if member and type(self.zip) == zipfile.ZipFile:
+            info = self.zip.getinfo(member)
+            if (
+                info.compress_type in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+                and not info.flag_bits & 0x01
+                and copyRawMember(self.zip, info, zipObj, arcname)
+            ):
+                return True
+        zipObj.write(path, arcname)
+        return False
+
+    def fingerprint(self, path):
+        """Identifies the content of the member at path without extracting
+        it, or returns None when there is no such member."""
+        local = self.member(path)
+        if not local:
+            return None
+        if local not in self.fingerprints:
+            if type(self.zip) == DirectoryArchive:
+                digest = hashlib.sha256()
+                with self.zip.open(self.members[local]) as f:
+                    data = f.read(1024 * 1024)
+                    while data:
+                        digest.update(data)
+                        data = f.read(1024 * 1024)
+                self.fingerprints[local] = digest.hexdigest()
+            else:
+                info = self.zip.getinfo(self.members[local])
+                self.fingerprints[local] = "{:08x}:{}".format(info.CRC, info.file_size)
+        return self.fingerprints[local]
+
+    def need(self, path):
+        if self.log is not None:
+            self.log.append(path)
+        local = self.member(path)
+        if local:
+            self.extract(local)
+        return local is not None
+
+    def needTree(self, path):
+        prefix = os.path.normpath(os.path.abspath(path)) + os.sep
+        for local in self.members:
+            if local.startswith(prefix):
+                self.extract(local)
+
+    def reference(self, path):
+        local = self.member(path)
+        if local:
+            self.referenced.add(local)
+        return local
+
+    def referenceMember(self, member):
+        if member in self.locals:
+            self.referenced.add(self.locals[member])
+
+    def scan(self, docs):
+        stack = list(docs)
+        while stack:
+            doc = stack.pop()
+            if type(doc) == dict:
+                stack.extend(doc.values())
+            elif type(doc) == list:
+                stack.extend(doc)
+            elif type(doc) == str and doc:
+                if "<" in doc:
+                    for m in re.finditer(r'(?:src|href)=["\']?([^"\'\s>]+)', doc):
+                        self.reference(html.unescape(m.group(1)))
+                elif len(doc) < 1024:
+                    self.reference(doc)
+        return len(self.referenced)
+
+    def extractReferenced(self):
+        for local in self.referenced:
+            self.extract(local)
+
+    def close(self):
+        self.zip.close()
+
+
+# copyRawMember appends to the output through ZipFile internals, which are
+# the same in CPython 3.7 to 3.13. Other versions fall back to ZipFile.write.
+RAW_ATTRIBUTES = ("fp", "_lock", "start_dir", "_didModify", "filelist", "NameToInfo")
+
+
+def copyRawMember(src, info, dst, arcname):
+    """Appends the compressed bytes of info in src to dst as arcname.
+    Returns False without writing anything when the ZipFile internals it
+    relies on are missing."""
+    if (
+        not all(hasattr(dst, a) for a in RAW_ATTRIBUTES)
+        or getattr(dst, "_writing", False)
+        or not getattr(src, "fp", None)
+    ):
+        return False
+    src.fp.seek(info.header_offset)
+    header = src.fp.read(zipfile.sizeFileHeader)
+    (namelength, extralength) = struct.unpack("<HH", header[26:30])
+    src.fp.seek(info.header_offset + zipfile.sizeFileHeader + namelength + extralength)
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.flag_bits = info.flag_bits & ~0x08
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    with dst._lock:
+        dst.fp.seek(dst.start_dir)
+        zinfo.header_offset = dst.fp.tell()
+        dst.fp.write(
+            zinfo.FileHeader(
+                zinfo.file_size > zipfile.ZIP64_LIMIT
+                or zinfo.compress_size > zipfile.ZIP64_LIMIT
+            )
+        )
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = src.fp.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise zipfile.BadZipFile("Truncated member " + info.filename)
+            dst.fp.write(chunk)
+            remaining -= len(chunk)
+        dst.start_dir = dst.fp.tell()
+        dst.filelist.append(zinfo)
+        dst.NameToInfo[zinfo.filename] = zinfo
+        dst._didModify = True
+    return True
@@ -0,0 +1,202 @@
+import os
+import re
+import urllib.parse
+
+import magic
+
+AUDIO_TYPES = ["audio/mp3", "audio/mpeg", "audio/wav", "audio/mp4", "video/mp4"]
+
+
+class AssetAudit:
+    """Checks the assets a conversion would use without converting them.
+
+    Paths are resolved the same way the converters resolve them, but
+    nothing is extracted: image sizes come from index, an ImageIndex of the
+    archive, and sounds are identified from their first bytes. Missing
+    files, conversions, oversized images, videos and an estimate of the work
+    are collected for report().
+    """
+
+    def __init__(self, resolver, index, jpeg=".webp", spritesheets=False, p512=False):
+        self.resolver = resolver
+        self.index = index
+        self.archive = resolver.archive
+        self.jpeg = jpeg
+        self.spritesheets = spritesheets
+        self.p512 = p512
+        self.counts = {}
+        self.missing = []
+        self.conversions = {}
+        self.oversized = {}
+        self.videos = {}
+        self.remote = 0
+        self.transcodes = 0
+        self.pixels = 0
+        self.unreadable = []
+
+    def count(self, table, key, n=1):
+        table[key] = table.get(key, 0) + n
+
+    def locate(self, path, category, owner, fallbacks=()):
+        self.count(self.counts, category)
+        if path and path.startswith(("http:", "https:")):
+            self.remote += 1
+            return None
+        local = self.resolver.locate(path, fallbacks) if path else None
+        if not local:
+            self.missing.append((category, urllib.parse.unquote(path or ""), owner))
+        return local
+
+    def size(self, local, owner):
+        info = self.index.get(local)
+        if not info:
+            self.unreadable.append((os.path.relpath(local), owner))
+            return None
+        return (info.width, info.height)
+
+    def image(self, path, category, owner, limit, convert=None, fallbacks=(), shape=None):
+        """Checks an image that is converted to convert when it is a WebP and
+        -j is given, scaled down when larger than limit and resized when its
+        aspect ratio differs from shape."""
+        local = self.locate(path, category, owner, fallbacks)
+        if not local:
+            return None
+        ext = os.path.splitext(local)[1].lower()
+        size = self.size(local, owner)
+        if not size:
+            return None
+        decode = False
+        if ext == ".webp" and convert and self.jpeg != ".webp":
+            self.count(self.conversions, "{} .webp to {}".format(category, convert))
+            decode = True
+        if limit and (size[0] > limit or size[1] > limit):
+            self.count(self.oversized, "{} over {}px".format(category, limit))
+            decode = True
+        if shape and shape[0] / shape[1] != size[0] / size[1]:
+            self.count(self.conversions, "{} resized to scene dimensions".format(category))
+            decode = True
+        if decode:
+            self.pixels += size[0] * size[1]
+        return size
+
+    def video(self, path, category, owner, transcodes):
+        local = self.locate(path, category, owner)
+        if local:
+            self.count(self.videos, "{} {}".format(os.path.splitext(local)[1], category))
+            self.transcodes += transcodes
+        return local
+
+    def sound(self, path, owner):
+        local = self.locate(path, "sound", owner, (".mp4",))
+        if not local:
+            return
+        try:
+            with self.archive.open(local) as f:
+                mime = magic.from_buffer(f.read(2048), mime=True)
+        except Exception:
+            self.unreadable.append((os.path.relpath(local), owner))
+            return
+        if mime not in AUDIO_TYPES:
+            self.count(self.conversions, "sound {} to .mp4".format(mime))
+            self.transcodes += 1
+
+    def scene(self, map):
+        owner = "Scene: " + map.get("name", "")
+        img = map.get("img") or (map.get("background") or {}).get("src")
+        if img:
+            ext = os.path.splitext(urllib.parse.urlparse(img).path)[1].lower()
+            if ext == ".webm":
+                self.video(img, "map", owner, 2)
+            elif ext == ".mp4":
+                self.video(img, "map", owner, 1)
+            else:
+                shape = (map.get("width"), map.get("height"))
+                self.image(img, "map", owner, 8192, self.jpeg, shape=shape if all(shape) else None)
+        if map.get("thumb"):
+            self.image(map["thumb"], "thumbnail", owner, None, self.jpeg)
+        for tile in map.get("tiles") or []:
+            path = tile.get("img") or (tile.get("texture") or {}).get("src")
+            if path and os.path.splitext(urllib.parse.urlparse(path).path)[1].lower() == ".webm":
+                self.video(path, "tile", owner, 1)
+            else:
+                self.image(path, "tile", owner, 4096, ".png", (".png",))
+        for token in map.get("tokens") or []:
+            if token.get("img"):
+                self.locate(token["img"], "token", owner)
+        for sound in map.get("sounds") or []:
+            self.sound(sound.get("path"), owner)
+
+    def journal(self, j):
+        owner = "Journal: " + str(j.get("name", ""))
+        texts = [j.get("content") or ""]
+        for page in j.get("pages") or []:
+            if page.get("src"):
+                self.locate(page["src"], "journal image", owner)
+            text = page.get("text")
+            texts.append((text.get("content") if type(text) == dict else None) or "")
+        for text in texts:
+            for m in re.finditer(r'src=["\']?([^"\'\s>]+)', text):
+                if not m.group(1).startswith(("data:", "http:", "https:")):
+                    self.locate(m.group(1), "journal image", owner)
+
+    def playlist(self, p):
+        for sound in p.get("sounds") or []:
+            self.sound(sound.get("path"), "Playlist: " + str(p.get("name", "")))
+
+    def document(self, doc, kind):
+        owner = "{}: {}".format(kind, doc.get("name", ""))
+        if doc.get("img") and not doc["img"].startswith("icons/"):
+            self.image(doc["img"], kind.lower() + " image", owner, None, self.jpeg)
+        token = doc.get("token") or doc.get("prototypeToken")
+        if type(token) == dict and token.get("img"):
+            self.image(token["img"], "token", owner, None, ".png")
+
+    def pack(self, path):
+        prefix = os.path.normpath(os.path.abspath(path)) + os.sep
+        for local in sorted(self.archive.members):
+            if not local.startswith(prefix):
+                continue
+            owner = "Pack: " + os.path.relpath(os.path.dirname(local), path)
+            ext = os.path.splitext(local)[1].lower()
+            if ext == ".webm":
+                self.video(local, "pack asset", owner, 1)
+            elif ext in (".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"):
+                size = self.image(local, "pack asset", owner, 4096, ".png")
+                if size and self.p512 and (size[0] > 512 or size[1] > 512):
+                    self.count(self.conversions, "pack asset scaled to 512px")
+                    self.pixels += size[0] * size[1]
+
+    def report(self, ffmpeg=True):
+        lines = [
+            "Checked "
+            + ", ".join(
+                "{} {}".format(n, category) for (category, n) in sorted(self.counts.items())
+            )
+        ]
+        if self.missing:
+            lines.append("Missing ({}):".format(len(self.missing)))
+            for (category, path, owner) in self.missing:
+                lines.append("  {:<14} {}  [{}]".format(category, path, owner))
+        if self.unreadable:
+            lines.append("Unreadable ({}):".format(len(self.unreadable)))
+            for (path, owner) in self.unreadable:
+                lines.append("  {}  [{}]".format(path, owner))
+        for (title, table) in (
+            ("Conversions", self.conversions),
+            ("Oversized", self.oversized),
+            ("Videos", self.videos),
+        ):
+            if table:
+                lines.append("{}:".format(title))
+                for (key, n) in sorted(table.items()):
+                    lines.append("  {} {}".format(n, key))
+        if self.remote:
+            lines.append("Remote assets to download: {}".format(self.remote))
+        lines.append(
+            "Estimated work: {} ffmpeg jobs, {:.1f} megapixels to decode".format(
+                self.transcodes, self.pixels / 1000000
+            )
+        )
+        if self.transcodes and not ffmpeg:
+            lines.append("ffmpeg was not found, so videos and sounds will not be converted")
+        return "\n".join(lines)
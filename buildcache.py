@@ -0,0 +1,320 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import sys
+import time
+import xml.etree.cElementTree as ET
+
+from downloadcache import sha256
+
+FORMAT = 1
+
+
+def codeDigest(modules):
+    """Hashes the source of the named modules, so results built by another
+    version of the converter are not reused. Optional modules that are not
+    imported yet are found without importing them."""
+    digest = hashlib.sha256()
+    if getattr(sys, "frozen", False):
+        st = os.stat(sys.executable)
+        digest.update("{}:{}".format(st.st_size, st.st_mtime_ns).encode("utf8"))
+    for name in modules:
+        path = getattr(sys.modules.get(name), "__file__", None)
+        if not path and name not in sys.modules:
+            try:
+                spec = importlib.util.find_spec(name)
+            except (ImportError, ValueError):
+                spec = None
+            path = spec.origin if spec else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """Persistent cache of converted scenes and assets for incremental builds.
+
+    Each unit of work is keyed by a hash of its source document, the
+    conversion options and anything else it depends on. A unit records the
+    archive members it needed, the files it wrote or removed under the work
+    directory and the XML elements it added. A later run with the same key
+    replays those, but only if the members still have the same contents.
+    Output files are stored once under objects/ by their sha256, and the
+    least recently used units are dropped when the objects exceed maxSize
+    bytes. With no root nothing is cached and every unit is rebuilt.
+    """
+
+    def __init__(self, root, workdir, options, maxSize=2 * 1024 * 1024 * 1024):
+        self.root = root
+        self.workdir = os.path.abspath(workdir)
+        self.options = options
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        self.recording = None
+        if not root:
+            return
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "units"), exist_ok=True)
+
+    def key(self, kind, *parts):
+        return hashlib.sha256(
+            json.dumps(
+                [FORMAT, kind, self.options, parts], sort_keys=True, default=str
+            ).encode("utf8")
+        ).hexdigest()
+
+    def unitPath(self, key):
+        return os.path.join(self.root, "units", key + ".json")
+
+    def objectPath(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def load(self, key):
+        try:
+            with open(self.unitPath(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, entry):
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.join(self.root, "units"), suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self.unitPath(key))
+
+    def storeFile(self, path):
+        digest = sha256(path)
+        if not os.path.exists(self.objectPath(digest)):
+            (fd, tmp) = tempfile.mkstemp(dir=os.path.join(self.root, "objects"))
+            os.close(fd)
+            shutil.copyfile(path, tmp)
+            os.replace(tmp, self.objectPath(digest))
+        return digest
+
+    def unit(self, key, archive, watch, parent=None, prefix=None):
+        """Returns a BuildUnit for key. watch lists the directories the work
+        writes to. They are walked recursively unless prefix is given, in
+        which case only their files whose lowercased names start with prefix
+        are compared. With watch None nothing is walked, and the outputs are
+        only the files announced with wrote()."""
+        return BuildUnit(self, key, archive, watch, parent, prefix)
+
+    def wrote(self, path):
+        """Announces a file written by the unit being recorded, if any."""
+        if self.recording:
+            self.recording.written.add(os.path.normpath(os.path.abspath(path)))
+        return path
+
+    def evict(self):
+        if not self.root:
+            return
+        objects = os.path.join(self.root, "objects")
+        sizes = {n: os.path.getsize(os.path.join(objects, n)) for n in os.listdir(objects)}
+        total = sum(sizes.values())
+        if total <= self.maxSize:
+            return
+        units = {}
+        for name in os.listdir(os.path.join(self.root, "units")):
+            if name.endswith(".json"):
+                entry = self.load(name[:-5])
+                if entry:
+                    units[name[:-5]] = entry
+        for key in sorted(units, key=lambda k: units[k]["used"]):
+            if total <= self.maxSize:
+                break
+            os.remove(self.unitPath(key))
+            entry = units.pop(key)
+            live = {d for e in units.values() for d in e["files"].values()}
+            for digest in set(entry["files"].values()) - live:
+                if digest in sizes:
+                    os.remove(self.objectPath(digest))
+                    total -= sizes.pop(digest)
+
+    def close(self):
+        self.evict()
+
+    def report(self):
+        return "Build cache: {} reused, {} rebuilt".format(self.hits, self.misses)
+
+
+class BuildUnit:
+    """One cached piece of work.
+
+    restore() either replays a stored result and returns its data, or
+    returns None and starts recording. The work is then done inside a with
+    block on the unit, which saves the result along with whatever was put
+    in data, unless the block raised. Work that finishes after the block,
+    like images rendered in another process, is announced with defer() and
+    handed over with placed(); the result is then saved by complete().
+    """
+
+    def __init__(self, cache, key, archive, watch, parent=None, prefix=None):
+        self.cache = cache
+        self.key = key
+        self.archive = archive
+        self.watch = watch
+        self.parent = parent
+        self.prefix = prefix
+        self.before = None
+        self.children = 0
+        self.data = {}
+        self.deferred = 0
+        self.entry = None
+        self.outputs = {}
+        self.removals = []
+        self.written = set()
+
+    def relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.cache.workdir)
+
+    def snapshot(self):
+        files = {}
+        if self.watch is None:
+            for path in self.written:
+                if os.path.isfile(path):
+                    st = os.stat(path)
+                    files[path] = (st.st_size, st.st_mtime_ns)
+            return files
+        for d in self.watch:
+            if not os.path.isdir(d):
+                continue
+            if self.prefix is None:
+                for root, dirs, names in os.walk(d):
+                    for name in names:
+                        path = os.path.join(root, name)
+                        st = os.stat(path)
+                        files[path] = (st.st_size, st.st_mtime_ns)
+                continue
+            with os.scandir(d) as it:
+                for e in it:
+                    if e.name.lower().startswith(self.prefix) and e.is_file():
+                        st = e.stat()
+                        files[e.path] = (st.st_size, st.st_mtime_ns)
+        return files
+
+    def valid(self, entry):
+        if any(m not in self.archive.locals for m in entry["copies"].values()):
+            return False
+        for (path, fingerprint) in entry["needs"]:
+            if self.archive.fingerprint(path) != fingerprint:
+                return False
+        return all(
+            os.path.exists(self.cache.objectPath(d)) for d in entry["files"].values()
+        )
+
+    def restore(self):
+        if not self.cache.root:
+            return None
+        entry = self.cache.load(self.key)
+        if not entry or not self.valid(entry):
+            self.cache.misses += 1
+            self.before = self.snapshot()
+            self.children = len(self.parent) if self.parent is not None else 0
+            self.archive.log = []
+            self.cache.recording = self
+            return None
+        for (path, fingerprint) in entry["needs"]:
+            self.archive.need(path)
+        for (path, digest) in entry["files"].items():
+            path = os.path.join(self.cache.workdir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(path)
+            shutil.copyfile(self.cache.objectPath(digest), path)
+        for (path, member) in entry["copies"].items():
+            local = self.archive.locals[member]
+            self.archive.extract(local)
+            self.archive.copy(local, os.path.join(self.cache.workdir, path))
+        for path in entry["removed"]:
+            path = os.path.join(self.cache.workdir, path)
+            if os.path.exists(path):
+                self.archive.remove(path)
+        for xml in entry["xml"]:
+            self.parent.append(ET.fromstring(xml))
+        entry["used"] = time.time()
+        self.cache.save(self.key, entry)
+        self.cache.hits += 1
+        self.data = entry["data"]
+        return self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.before is None:
+            return
+        if exc[0] is None:
+            self.entry = self.record()
+            if not self.deferred:
+                self.cache.save(self.key, self.entry)
+        self.archive.log = None
+        self.before = None
+        self.cache.recording = None
+
+    def defer(self):
+        self.deferred += 1
+
+    def placed(self, path, removed=None):
+        """Stores a deferred output file once it is in place, along with the
+        file it replaced."""
+        self.outputs[self.relative(path)] = self.cache.storeFile(path)
+        if removed:
+            self.removals.append(self.relative(removed))
+        self.deferred -= 1
+
+    def complete(self):
+        if self.entry is None or self.deferred:
+            return
+        self.entry["files"].update(self.outputs)
+        self.entry["removed"] = sorted(set(self.entry["removed"]) | set(self.removals))
+        self.cache.save(self.key, self.entry)
+
+    def record(self):
+        needs = []
+        seen = set()
+        for path in self.archive.log:
+            if os.path.isabs(path):
+                path = self.relative(path)
+            if path not in seen:
+                seen.add(path)
+                needs.append((path, self.archive.fingerprint(path)))
+        self.archive.log = None
+        after = self.snapshot()
+        removed = {p for p in self.before if p not in after}
+        for (path, fingerprint) in needs:
+            local = self.archive.member(path)
+            if local and not os.path.exists(local):
+                removed.add(local)
+        files = {}
+        copies = {}
+        for path in sorted(after):
+            if self.before.get(path) == after[path]:
+                continue
+            member = self.archive.unchanged(path)
+            if not member:
+                files[self.relative(path)] = self.cache.storeFile(path)
+            elif os.path.normpath(os.path.abspath(path)) not in self.archive.members:
+                copies[self.relative(path)] = member
+                source = self.relative(self.archive.locals[member])
+                if source not in seen:
+                    seen.add(source)
+                    needs.append((source, self.archive.fingerprint(source)))
+        return {
+            "needs": needs,
+            "files": files,
+            "copies": copies,
+            "removed": sorted(self.relative(p) for p in removed),
+            "xml": [
+                ET.tostring(e, encoding="unicode")
+                for e in list(self.parent)[self.children:]
+            ]
+            if self.parent is not None
+            else [],
+            "data": self.data,
+            "used": time.time(),
+        }
@@ -0,0 +1,326 @@
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def defaultCacheDir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "FoundryToEncounter", "Cache")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Caches/FoundryToEncounter")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "foundrytoencounter")
+
+
+def download(response, f, progress=None, blockSize=1024 * 1024):
+    """Copies an open response to f, calling progress like urlretrieve's
+    reporthook, and returns the sha256 of the body."""
+    total = int(response.headers.get("Content-Length") or -1)
+    digest = hashlib.sha256()
+    block = 0
+    if progress:
+        progress(block, blockSize, total)
+    data = response.read(blockSize)
+    while data:
+        f.write(data)
+        digest.update(data)
+        block += 1
+        if progress:
+            progress(block, blockSize, total)
+        data = response.read(blockSize)
+    return digest.hexdigest()
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        data = f.read(1024 * 1024)
+        while data:
+            digest.update(data)
+            data = f.read(1024 * 1024)
+    return digest.hexdigest()
+
+
+class RangedDownload:
+    """Downloads url to path with parallel HTTP Range requests.
+
+    The file is preallocated and split into chunks that are fetched by
+    several connections, each retried on failure. Finished chunks are
+    recorded in path + ".parts" so an interrupted download resumes where it
+    stopped as long as the server still reports the same size and ETag.
+    Each request goes to the original url and follows its redirects again,
+    since release downloads often redirect to signed URLs that expire
+    before a large archive is done. Servers that ignore Range get a single
+    plain download instead.
+    """
+
+    def __init__(self, url, path, connections=4, chunkSize=CHUNK_SIZE, retries=5):
+        self.url = url
+        self.path = path
+        self.connections = max(1, connections)
+        self.chunkSize = chunkSize
+        self.retries = retries
+        self.size = None
+        self.etag = None
+        self.ranges = False
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def statePath(self):
+        return self.path + ".parts"
+
+    def probe(self):
+        request = urllib.request.Request(self.url, headers={"Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=60) as response:
+            self.etag = response.headers.get("ETag")
+            m = re.match(
+                r"bytes\s+\d+-\d+/(\d+)", response.headers.get("Content-Range") or ""
+            )
+            if response.status == 206 and m:
+                self.size = int(m.group(1))
+                self.ranges = True
+            elif response.headers.get("Content-Length"):
+                self.size = int(response.headers.get("Content-Length"))
+        return (self.size, self.etag)
+
+    def loadState(self):
+        if not os.path.exists(self.statePath()) or not os.path.exists(self.path):
+            return set()
+        try:
+            with open(self.statePath()) as f:
+                state = json.load(f)
+        except ValueError:
+            return set()
+        if (
+            state.get("size") != self.size
+            or state.get("etag") != self.etag
+            or state.get("chunkSize") != self.chunkSize
+        ):
+            return set()
+        return set(state["chunks"])
+
+    def saveState(self, chunks):
+        with open(self.statePath(), "w") as f:
+            json.dump(
+                {
+                    "size": self.size,
+                    "etag": self.etag,
+                    "chunkSize": self.chunkSize,
+                    "chunks": sorted(chunks),
+                },
+                f,
+            )
+
+    def advance(self, count, progress):
+        with self.lock:
+            self.done += count
+            if progress:
+                progress(self.done, 1, self.size if self.size is not None else -1)
+
+    def fetchChunk(self, index, progress):
+        start = index * self.chunkSize
+        end = min(start + self.chunkSize, self.size) - 1
+        written = 0
+        failures = 0
+        while written <= end - start:
+            headers = {"Range": "bytes={}-{}".format(start + written, end)}
+            if self.etag:
+                headers["If-Range"] = self.etag
+            before = written
+            try:
+                request = urllib.request.Request(self.url, headers=headers)
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    if response.status != 206:
+                        raise IOError("Server ignored range request")
+                    with open(self.path, "r+b") as f:
+                        f.seek(start + written)
+                        while written <= end - start:
+                            data = response.read(min(256 * 1024, end + 1 - start - written))
+                            if not data:
+                                raise IOError("Short read")
+                            f.write(data)
+                            written += len(data)
+                            self.advance(len(data), progress)
+            except (OSError, http.client.HTTPException):
+                failures = 0 if written > before else failures + 1
+                if failures > self.retries:
+                    raise
+                time.sleep(min(30, 2 ** failures) / 4)
+        return index
+
+    def run(self, progress=None):
+        if self.size is None:
+            self.probe()
+        if not self.ranges or not self.size:
+            with urllib.request.urlopen(self.url, timeout=60) as response, open(
+                self.path, "wb"
+            ) as f:
+                download(response, f, progress)
+            return self.path
+        count = (self.size + self.chunkSize - 1) // self.chunkSize
+        finished = self.loadState()
+        if not finished:
+            with open(self.path, "wb") as f:
+                f.truncate(self.size)
+            self.saveState(finished)
+        self.done = sum(
+            min(self.chunkSize, self.size - i * self.chunkSize) for i in finished
+        )
+        self.advance(0, progress)
+        with concurrent.futures.ThreadPoolExecutor(self.connections) as pool:
+            futures = [
+                pool.submit(self.fetchChunk, i, progress)
+                for i in range(count)
+                if i not in finished
+            ]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    finished.add(future.result())
+                    self.saveState(finished)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        os.remove(self.statePath())
+        return self.path
+
+
+def place(src, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+class DownloadCache:
+    """Content-addressed cache of module archives downloaded from manifests.
+
+    Archives are stored once under objects/ by their sha256. index.json maps
+    a key made of the manifest URL, the manifest version and the archive's
+    Content-Length and ETag to an object, so a module is fetched again only
+    when one of those changes. When the objects exceed maxSize bytes the
+    least recently used keys are dropped, along with any object no remaining
+    key refers to.
+    """
+
+    def __init__(self, root=None, maxSize=2 * 1024 * 1024 * 1024):
+        self.root = root or defaultCacheDir()
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self.entries = {}
+        if os.path.exists(self.indexPath()):
+            try:
+                with open(self.indexPath()) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def indexPath(self):
+        return os.path.join(self.root, "index.json")
+
+    def objectPath(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def key(self, manifestUrl, version, size, etag):
+        return hashlib.sha256(
+            json.dumps([manifestUrl, str(version), size, etag]).encode("utf8")
+        ).hexdigest()
+
+    def save(self):
+        (fd, tmp) = tempfile.mkstemp(dir=self.root, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp, self.indexPath())
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if not entry or not os.path.exists(self.objectPath(entry["sha256"])):
+            return None
+        entry["used"] = time.time()
+        self.save()
+        return self.objectPath(entry["sha256"])
+
+    def store(self, key, tmp, digest, **info):
+        if os.path.exists(self.objectPath(digest)):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, self.objectPath(digest))
+        info.update(
+            sha256=digest, size=os.path.getsize(self.objectPath(digest)), used=time.time()
+        )
+        self.entries[key] = info
+        self.evict(keep=key)
+        self.save()
+        return self.objectPath(digest)
+
+    def evict(self, keep=None):
+        sizes = {e["sha256"]: e["size"] for e in self.entries.values()}
+        total = sum(sizes.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["used"]):
+            if total <= self.maxSize:
+                break
+            if key == keep:
+                continue
+            digest = self.entries.pop(key)["sha256"]
+            if not any(e["sha256"] == digest for e in self.entries.values()):
+                if os.path.exists(self.objectPath(digest)):
+                    os.remove(self.objectPath(digest))
+                total -= sizes[digest]
+
+    def fetch(self, manifestUrl, manifest, dest, progress=None, connections=4):
+        """Places the archive for manifest at dest, downloading it only if the
+        cache has no copy for the same version, size and ETag. Returns True on
+        a cache hit."""
+        url = manifest["download"]
+        downloader = RangedDownload(url, None, connections)
+        (size, etag) = downloader.probe()
+        key = self.key(
+            manifestUrl, manifest.get("version"), None if size is None else str(size), etag
+        )
+        cached = self.lookup(key)
+        if cached:
+            self.hits += 1
+            place(cached, dest)
+            return True
+        self.misses += 1
+        downloader.path = os.path.join(self.root, key + ".part")
+        downloader.run(progress)
+        place(
+            self.store(
+                key,
+                downloader.path,
+                sha256(downloader.path),
+                manifest=manifestUrl,
+                version=str(manifest.get("version")),
+                url=url,
+                etag=etag,
+            ),
+            dest,
+        )
+        return False
+
+    def report(self):
+        return "Download cache: {} hits, {} misses, {} archives ({:.1f} MB)".format(
+            self.hits,
+            self.misses,
+            len({e["sha256"] for e in self.entries.values()}),
+            sum({e["sha256"]: e["size"] for e in self.entries.values()}.values())
+            / 1024
+            / 1024,
+        )
@@ -0,0 +1,81 @@
+import hashlib
+import json
+
+
+class EntityIndex:
+    """Lookup tables for Foundry documents by _id, name and token name.
+
+    The first document loaded for a given key wins, matching the order the
+    old linear scans over the document lists returned.
+    """
+
+    def __init__(self):
+        self.byId = {}
+        self.byName = {}
+        self.byTokenName = {}
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, kind, docs):
+        byId = self.byId.setdefault(kind, {})
+        byName = self.byName.setdefault(kind, {})
+        byTokenName = self.byTokenName.setdefault(kind, {})
+        for doc in docs:
+            if "_id" in doc:
+                byId.setdefault(doc["_id"], doc)
+            if type(doc.get("name")) == str:
+                byName.setdefault(doc["name"], doc)
+            token = doc.get("token") or doc.get("prototypeToken")
+            if type(token) == dict and type(token.get("name")) == str:
+                byTokenName.setdefault(token["name"], doc)
+
+    def count(self, doc):
+        if doc is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return doc
+
+    def get(self, kind, key):
+        return self.count(self.byId.get(kind, {}).get(key))
+
+    def getByName(self, kind, name):
+        if type(name) != str:
+            return self.count(None)
+        return self.count(self.byName.get(kind, {}).get(name))
+
+    def getByTokenName(self, kind, name):
+        if type(name) != str:
+            return self.count(None)
+        return self.count(self.byTokenName.get(kind, {}).get(name))
+
+    def find(self, kind, key):
+        doc = self.byId.get(kind, {}).get(key)
+        if doc is None and type(key) == str:
+            doc = self.byName.get(kind, {}).get(key)
+        return self.count(doc)
+
+    def fingerprint(self, kind, ids=(), names=(), tokenNames=()):
+        """Hashes the ids and names of the documents of kind found by the
+        given ids, names and token names, which is all a converted scene
+        takes from the documents it links to."""
+        digest = hashlib.sha256()
+        for (table, keys) in (
+            (self.byId, ids),
+            (self.byName, names),
+            (self.byTokenName, tokenNames),
+        ):
+            for key in keys:
+                doc = table.get(kind, {}).get(key) if type(key) == str else None
+                digest.update(
+                    json.dumps(
+                        [key, doc.get("_id"), doc.get("name")] if doc else [key],
+                        default=str,
+                    ).encode("utf8")
+                )
+        return digest.hexdigest()
+
+    def report(self):
+        return "Resolved {} references ({} hits, {} misses)".format(
+            self.hits + self.misses, self.hits, self.misses
+        )
@@ -21,9 +21,25 @@ import random
 import html
 import magic
 import subprocess
+import time
 from google.protobuf import text_format
 import fonts_public_pb2
 from spritesheet import spritesheet
+from entityindex import EntityIndex
+import nedb
+from walls import WallStitcher, removeOverlaps
+from transform import SceneTransform, rounded
+from archive import ModuleArchive, openArchive
+from zipindex import ZipIndex
+from leveldb import LevelDB
+from downloadcache import DownloadCache, RangedDownload, defaultCacheDir, sha256
+from prefetch import RemoteFetcher
+from buildcache import BuildCache, codeDigest
+from watcher import SourceWatcher
+from resolver import AssetResolver
+from audit import AssetAudit
+from mapimages import ImagePipeline, MapPlan, draft, fit, render
+from imageindex import ImageIndex
 
 VERSION = "1.13.18"
 
@@ -182,13 +198,89 @@ parser.add_argument(
     const=True,
     help="use spritesheets instead of animated webp",
 )
+parser.add_argument(
+    "--simplify-walls",
+    dest="simplifywalls",
+    action="store",
+    type=float,
+    default=None,
+    metavar="TOLERANCE",
+    help="merge collinear wall vertices that are within TOLERANCE pixels of a straight run",
+)
+parser.add_argument(
+    "--jobs",
+    dest="jobs",
+    action="store",
+    type=int,
+    default=1,
+    metavar="N",
+    help="decode compendium and data files and render map images with N worker processes",
+)
+parser.add_argument(
+    "--memory",
+    dest="memory",
+    action="store",
+    type=int,
+    default=1024,
+    metavar="MB",
+    help="start map image workers only while their images fit in about MB megabytes (default 1024)",
+)
+parser.add_argument(
+    "--cache-dir",
+    dest="cachedir",
+    action="store",
+    default=None,
+    help="directory for cached manifest downloads",
+)
+parser.add_argument(
+    "--cache-size",
+    dest="cachesize",
+    action="store",
+    type=int,
+    default=2048,
+    metavar="MB",
+    help="evict least recently used downloads and build results above this size (default 2048)",
+)
+parser.add_argument(
+    "--connections",
+    dest="connections",
+    action="store",
+    type=int,
+    default=4,
+    metavar="N",
+    help="download module archives over N parallel connections (default 4)",
+)
+parser.add_argument(
+    "--no-cache",
+    dest="nocache",
+    action="store_const",
+    const=True,
+    default=False,
+    help="always download the module archive from the manifest and rebuild every scene and asset. Interrupted downloads only resume through the cache",
+)
+parser.add_argument(
+    "--watch",
+    dest="watch",
+    action="store_const",
+    const=True,
+    default=False,
+    help="convert a module or world folder again whenever its files change",
+)
+parser.add_argument(
+    "--audit",
+    dest="audit",
+    action="store_const",
+    const=True,
+    default=False,
+    help="only check the assets the conversion would use and report missing files, conversions and oversized images",
+)
 parserg = parser.add_mutually_exclusive_group()
 parserg.add_argument(
     dest="srcfile",
     action="store",
     default=False,
     nargs="?",
-    help="foundry file to convert",
+    help="foundry file, or module or world folder, to convert",
 )
 parserg.add_argument(
     "-gui",
@@ -220,6 +312,8 @@ else:
     ]
 if args.noconv and args.jpeg == ".png":
     args.jpeg = ".webp"
+if args.watch and not (args.srcfile and os.path.isdir(args.srcfile)):
+    parser.error("--watch needs a module or world folder")
 if not args.srcfile and not args.gui:
     if sys.platform in ["darwin", "win32"]:
         args.gui = True
@@ -227,6 +321,14 @@ if not args.srcfile and not args.gui:
         parser.print_help()
         exit()
 numbers = ["zero", "one", "two", "three", "four"]
+solberafonts = {
+    "bookmania": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Bookinsanity/Bookinsanity.otf",
+    "scala sans caps": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Scaly%20Sans%20Caps/Scaly%20Sans%20Caps.otf",
+    "modesto condensed": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Nodesto%20Caps%20Condensed/Nodesto%20Caps%20Condensed.otf",
+    "mrs eaves small caps": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Mr%20Eaves/Mr%20Eaves%20Small%20Caps.otf",
+    "dai vernon misdirect": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Zatanna%20Misdirection/Zatanna%20Misdirection.otf",
+    "scala sans": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Scaly%20Sans/Scaly%20Sans.otf",
+}
 stats = {
     "str": "Strength",
     "dex": "Dexterity",
@@ -343,51 +445,52 @@ def convert(args=args, worker=None):
             map["width"] = round(map["width"]*map["rescale"])
             map["height"] = round(map["height"]*map["rescale"])
         if not map["img"]:
-            with PIL.Image.new(
-                "RGB", (map["width"], map["height"]), color="gray"
-            ) as img:
-                if map["tiles"][0]["width"] >= (map["width"] * 0.9) and map["tiles"][0][
-                    "height"
-                ] >= (map["height"] * 0.9):
-                    bg = map["tiles"].pop(0)
-                    bg["img"] = urllib.parse.unquote(bg["img"])
-                    imgext = os.path.splitext(
-                        os.path.basename(urllib.parse.urlparse(bg["img"]).path)
-                    )[1]
-                    bgimg = PIL.Image.open(bg["img"])
-                    bg["x"] = round(bg["x"] - map["offsetX"])
-                    bg["y"] = round(bg["y"] - map["offsetY"])
-                    if bgimg.width != bg["width"] or bgimg.height != bg["height"]:
-                        print(bg["img"])
-                        bgimg = bgimg.resize((bg["width"], bg["height"]))
-                    if "scale" in bg and bg["scale"] != 1:
-                        bgimg = bgimg.resize(
-                            (
-                                round(bgimg.width * bg["scale"]),
-                                round(bgimg.height * bg["scale"]),
-                            )
-                        )
-                    if bg["x"] > 0 and (bgimg.width + bg["x"]) > img.width:
-                        bgimg = bgimg.crop((0, 0, bgimg.width - bg["x"], bgimg.height))
-                    elif bg["x"] < 0:
-                        bgimg = bgimg.crop(
-                            (bg["x"] * -1, 0, bgimg.width + bg["x"], bgimg.height)
-                        )
-                        bg["x"] = 0
-                    if bg["y"] > 0 and (bgimg.width + bg["y"]) > img.width:
-                        bgimg = bgimg.crop((0, 0, bgimg.width, bgimg.height - bg["y"]))
-                    elif bg["y"] < 0:
-                        bgimg = bgimg.crop(
-                            (0, bg["y"] * -1, bgimg.width, bgimg.height + bg["y"])
-                        )
-                        bg["y"] = 0
-                    img.paste(bgimg, (bg["x"], bg["y"]))
-                if args.jpeg == ".webp":
-                    img.save(os.path.join(tempdir, mapslug + "_bg.webp"))
-                    map["img"] = mapslug + "_bg.webp"
-                else:
-                    img.save(os.path.join(tempdir, mapslug + "_bg.jpg"))
-                    map["img"] = mapslug + "_bg.jpg"
+            job = {"mode": "RGB", "size": (map["width"], map["height"]), "color": "gray"}
+            if map["tiles"][0]["width"] >= (map["width"] * 0.9) and map["tiles"][0][
+                "height"
+            ] >= (map["height"] * 0.9):
+                bg = map["tiles"].pop(0)
+                bg["img"] = resolver.resolve(bg["img"], "tile") or urllib.parse.unquote(
+                    bg["img"]
+                )
+                imgext = os.path.splitext(
+                    os.path.basename(urllib.parse.urlparse(bg["img"]).path)
+                )[1]
+                bgjob = {"src": bg["img"], "steps": []}
+                (bgw, bgh) = images.size(bg["img"])
+                # Scenes over 8192 were fitted above, so the tile is
+                # resampled straight to the fitted scale in the same job
+                bg["x"] = round((bg["x"] - map["offsetX"]) * map["rescale"])
+                bg["y"] = round((bg["y"] - map["offsetY"]) * map["rescale"])
+                if bgw != bg["width"] or bgh != bg["height"]:
+                    print(bg["img"])
+                scale = map["rescale"]
+                if "scale" in bg and bg["scale"] != 1:
+                    scale *= bg["scale"]
+                size = (round(bg["width"] * scale), round(bg["height"] * scale))
+                if size != (bgw, bgh):
+                    (bgw, bgh) = size
+                    bgjob["steps"].append(("resize", size))
+                if bg["x"] > 0 and (bgw + bg["x"]) > map["width"]:
+                    bgjob["steps"].append(("crop", (0, 0, bgw - bg["x"], bgh)))
+                    bgw -= bg["x"]
+                elif bg["x"] < 0:
+                    bgjob["steps"].append(("crop", (bg["x"] * -1, 0, bgw + bg["x"], bgh)))
+                    bgw += bg["x"] * 2
+                    bg["x"] = 0
+                if bg["y"] > 0 and (bgw + bg["y"]) > map["width"]:
+                    bgjob["steps"].append(("crop", (0, 0, bgw, bgh - bg["y"])))
+                    bgh -= bg["y"]
+                elif bg["y"] < 0:
+                    bgjob["steps"].append(("crop", (0, bg["y"] * -1, bgw, bgh + bg["y"])))
+                    bgh += bg["y"] * 2
+                    bg["y"] = 0
+                job["layers"] = [(bgjob, (bg["x"], bg["y"]))]
+            if args.jpeg == ".webp":
+                map["img"] = mapslug + "_bg.webp"
+            else:
+                map["img"] = mapslug + "_bg.jpg"
+            images.submit(job, os.path.join(tempdir, map["img"]), job["size"])
         #            if not imgext:
         #                imgext = args.jpeg
         #            if imgext == ".webp" and args.jpeg != ".webp":
@@ -412,8 +515,12 @@ def convert(args=args, worker=None):
             mapentry.set("parent", str(uuid.uuid5(moduuid, map["folder"])))
         ET.SubElement(mapentry, "name").text = map["name"]
         ET.SubElement(mapentry, "slug").text = mapslug
-        if map["img"] and os.path.exists(urllib.parse.unquote(map["img"])):
-            map["img"] = urllib.parse.unquote(map["img"])
+        if images.pending(map["img"]):
+            mapimg = map["img"]
+        else:
+            mapimg = resolver.resolve(map["img"], "map")
+        if mapimg:
+            map["img"] = mapimg
             imgext = os.path.splitext(os.path.basename(map["img"]))[1]
             if imgext == ".webm" or imgext == ".mp4":
                 try:
@@ -436,7 +543,7 @@ def convert(args=args, worker=None):
                                 "aac",
                                 "-progress",
                                 "ffmpeg.log",
-                                os.path.splitext(map["img"])[0] + ".mp4",
+                                buildcache.wrote(os.path.splitext(map["img"])[0] + ".mp4"),
                             ],
                             startupinfo=startupinfo,
                             stdout=subprocess.DEVNULL,
@@ -484,7 +591,7 @@ def convert(args=args, worker=None):
                             "pad='width=ceil(iw/2)*2:height=ceil(ih/2)*2'",
                             "-vframes",
                             "1",
-                            os.path.splitext(map["img"])[0] + ".jpg",
+                            buildcache.wrote(os.path.splitext(map["img"])[0] + ".jpg"),
                         ],
                         startupinfo=startupinfo,
                         stdout=subprocess.DEVNULL,
@@ -496,7 +603,7 @@ def convert(args=args, worker=None):
                     sys.stderr.flush()
                     ffp.wait()
                     if imgext == ".webm":
-                        os.remove(map["img"])
+                        archive.remove(map["img"])
                     map["img"] = os.path.splitext(map["img"])[0] + ".jpg"
                     ET.SubElement(mapentry, "video").text = (
                         os.path.splitext(map["img"])[0] + ".mp4"
@@ -529,138 +636,88 @@ def convert(args=args, worker=None):
                 )
             else:
                 ET.SubElement(mapentry, "image").text = map["img"]
-            with PIL.Image.open(map["img"]) as img:
-                if (map["width"] / map["height"]) != (img.width / img.height):
-                    neww = map["width"]
-                    newh = map["height"]
-                    if newh != img.height or neww != img.width:
-                        print(
-                            map["name"],
-                            "Resizing {}x{} to {}x{} ({}!={})".format(
-                                img.width,
-                                img.height,
-                                neww,
-                                newh,
-                                (img.width / img.height),(map["width"] / map["height"]),
-                            ),
-                        )
-                        img = img.resize((neww, newh))
-                        img.save(os.path.join(tempdir, map["img"]))
-                if img.width > 8192 or img.height > 8192:
-                    scale = (
-                        8192 / img.width
-                        if img.width >= img.height
-                        else 8192 / img.height
-                    )
-                    print("Rescaling {}x{} ".format(img.width, img.height), end="")
-                    if args.gui:
-                        worker.outputLog(
-                            " - Resizing map from {}x{} to {}x{}".format(
-                                img.width,
-                                img.height,
-                                round(img.width * scale),
-                                round(img.height * scale)
-                            )
-                        )
-                    img = img.resize(
-                        (round(img.width * scale), round(img.height * scale))
-                    )
-                    print("to {}x{} {}x".format(img.width, img.height,scale))
-                    if imgext == ".webp" and args.jpeg != ".webp":
-                        if args.gui:
-                            worker.outputLog(
-                                " - Converting map from .webp to " + args.jpeg
-                            )
-                        img.save(
-                            os.path.join(
-                                tempdir, os.path.splitext(map["img"])[0] + args.jpeg
-                            )
-                        )
-                        os.remove(map["img"])
-                    else:
-                        img.save(os.path.join(tempdir, map["img"]))
-                elif imgext == ".webp" and args.jpeg != ".webp":
-                    if args.gui:
-                        worker.outputLog(" - Converting map from .webp to " + args.jpeg)
-                    img.save(
-                        os.path.join(
-                            tempdir, os.path.splitext(map["img"])[0] + args.jpeg
+            plan = MapPlan(
+                images.size(map["img"]), map["width"], map["height"], map["rescale"]
+            )
+            if plan.stretched:
+                print(
+                    map["name"],
+                    "Resizing {}x{} to {}x{} ({}!={})".format(
+                        plan.source[0],
+                        plan.source[1],
+                        map["width"],
+                        map["height"],
+                        (plan.source[0] / plan.source[1]),(map["width"] / map["height"]),
+                    ),
+                )
+            if plan.fitted:
+                print("Rescaling to {}x{}".format(plan.size[0], plan.size[1]))
+                if args.gui:
+                    worker.outputLog(
+                        " - Resizing map from {}x{} to {}x{}".format(
+                            plan.source[0],
+                            plan.source[1],
+                            plan.size[0],
+                            plan.size[1],
                         )
                     )
-                    os.remove(map["img"])
-                if map["height"] != img.height or map["width"] != img.width:
-                    map["scale"] = (
-                        map["width"] / img.width
-                        if map["width"] / img.width >= map["height"] / img.height
-                        else map["height"] / img.height
-                    )
-                    if map["scale"] > 1.25:
-                        map["scale"] = 1.0
-                        map["rescale"] = (
-                            img.width / map["width"]
-                            if img.width / map["width"] >= img.height / map["height"]
-                            else img.height / map["height"]
-                        )
-                else:
-                    map["scale"] = 1.0
+            job = {"src": map["img"], "steps": plan.steps()}
+            if imgext == ".webp" and args.jpeg != ".webp":
+                if args.gui:
+                    worker.outputLog(" - Converting map from .webp to " + args.jpeg)
+                images.submit(
+                    job,
+                    os.path.join(tempdir, os.path.splitext(map["img"])[0] + args.jpeg),
+                    plan.size,
+                    map["img"],
+                )
+            elif job["steps"]:
+                images.submit(job, os.path.join(tempdir, map["img"]), plan.size)
+            map["scale"] = plan.scale
+            map["rescale"] = plan.rescale
         else:
             print(
                 " |> Map Error NO BG FOR: {}".format(map["name"]),
                 file=sys.stderr,
                 end="",
             )
-            map["scale"] = 1.0
-            with PIL.Image.new(
-                "1", (map["width"], map["height"]), color="black"
-            ) as img:
-                if img.width > 8192 or img.height > 8192:
-                    scale = (
-                        8192 / img.width
-                        if img.width >= img.height
-                        else 8192 / img.height
-                    )
-                    if args.gui:
-                        worker.outputLog(
-                            " - Resizing map from {}x{} to {}x{}".format(
-                                img.width,
-                                img.height,
-                                round(img.width * scale),
-                                round(img.height * scale),
-                            )
-                        )
-                    img = img.resize(
-                        (round(img.width * scale), round(img.height * scale))
-                    )
-                img.save(os.path.join(tempdir, mapslug + "_bg.png"))
-                if map["height"] != img.height or map["width"] != img.width:
-                    map["scale"] = (
-                        map["width"] / img.width
-                        if map["width"] / img.width >= map["height"] / img.height
-                        else map["height"] / img.height
+            plan = MapPlan(
+                (map["width"], map["height"]), map["width"], map["height"], map["rescale"]
+            )
+            if plan.fitted and args.gui:
+                worker.outputLog(
+                    " - Resizing map from {}x{} to {}x{}".format(
+                        plan.source[0],
+                        plan.source[1],
+                        plan.size[0],
+                        plan.size[1],
                     )
-                    if map["scale"] > 1.25:
-                        map["scale"] = 1.0
-                        map["rescale"] = (
-                            img.width / map["width"]
-                            if img.width / map["width"] >= img.height / map["height"]
-                            else img.height / map["height"]
-                        )
-                else:
-                    map["scale"] = 1.0
+                )
+            images.submit(
+                {"mode": "1", "size": plan.size, "color": "black"},
+                os.path.join(tempdir, mapslug + "_bg.png"),
+                plan.size,
+            )
+            map["scale"] = plan.scale
+            map["rescale"] = plan.rescale
 
-                ET.SubElement(mapentry, "image").text = mapslug + "_bg" + args.jpeg
-            if "thumb" in map and map["thumb"] and os.path.exists(map["thumb"]):
+            ET.SubElement(mapentry, "image").text = mapslug + "_bg" + args.jpeg
+            thumb = resolver.resolve(map.get("thumb"), "thumb")
+            if thumb:
+                map["thumb"] = thumb
                 imgext = os.path.splitext(os.path.basename(map["img"]))[1]
                 if imgext == ".webp" and args.jpeg != ".webp":
                     ET.SubElement(mapentry, "snapshot").text = (
                         os.path.splitext(map["thumb"])[0] + args.jpeg
                     )
-                    PIL.Image.open(map["thumb"]).save(
+                    images.submit(
+                        {"src": map["thumb"]},
                         os.path.join(
                             tempdir, os.path.splitext(map["thumb"])[0] + args.jpeg
-                        )
+                        ),
+                        images.size(map["thumb"]),
+                        map["thumb"],
                     )
-                    os.remove(map["thumb"])
                 else:
                     ET.SubElement(mapentry, "snapshot").text = map["thumb"]
         mapgrid["size"] *= map["rescale"]
@@ -713,169 +770,125 @@ def convert(args=args, worker=None):
             ET.SubElement(mapentry, "fogExploration").text = "YES"
         if "globalLight" in map and map["globalLight"]:
             ET.SubElement(mapentry, "losDaylight").text = str(1.0-map["darkness"])
+        transform = SceneTransform(map["offsetX"], map["offsetY"], map["rescale"])
         if "walls" in map and len(map["walls"]) > 0:
+            segments = []
+            paths = transform.walls(map["walls"])
             for i in range(len(map["walls"])):
                 p = map["walls"][i]
                 if "sight" in p:
                     p["sense"] = 1 if p["sight"] == 20 else 2 if p["sight"] == 10 else 0
                     p["move"] = 1 if p["move"] == 20 else 0
                 print("\rwall {}".format(i), file=sys.stderr, end="")
-                pathlist = [
-                    (p["c"][0] - map["offsetX"]) * map["rescale"],
-                    (p["c"][1] - map["offsetY"]) * map["rescale"],
-                    (p["c"][2] - map["offsetX"]) * map["rescale"],
-                    (p["c"][3] - map["offsetY"]) * map["rescale"],
-                ]
-                isConnected = False
-                for pWall in mapentry.iter("wall"):
-                    lastpath = pWall.find("data")
-                    pWallID = pWall.get("id")
-                    if lastpath is not None and lastpath.text.endswith(
-                        ",{:.1f},{:.1f}".format(pathlist[0], pathlist[1])
-                    ):
-                        wType = pWall.find("type")
-                        if p["door"] > 0:
-                            if p["door"] == 1 and wType.text != "door":
-                                continue
-                            if p["door"] == 2 and wType.text != "secretDoor":
-                                continue
-                            if p["ds"] > 0:
-                                door = pWall.find("door")
-                                if door is None:
-                                    continue
-                                elif p["ds"] == 1 and door.text != "open":
-                                    continue
-                                elif p["ds"] == 2 and door.text != "locked":
-                                    continue
-                        elif wType.text in ["door", "secretDoor"]:
-                            continue
-                        elif (
-                            p["move"] == 0
-                            and p["sense"] == 1
-                            and wType.text != "ethereal"
-                        ):
-                            continue
-                        elif (
-                            p["move"] == 1
-                            and p["sense"] == 0
-                            and wType.text != "invisible"
-                        ):
-                            continue
-                        elif (
-                            p["move"] == 1
-                            and p["sense"] == 2
-                            and wType.text != "terrain"
-                        ):
-                            continue
-                        elif (
-                            p["move"] == 1
-                            and p["sense"] == 1
-                            and wType.text != "normal"
-                        ):
-                            continue
-                        if "dir" in p:
-                            wSide = pWall.find("side")
-                            if wSide is None and p["dir"] > 0:
-                                continue
-                            if p["dir"] == 1 and wSide.text != "left":
-                                continue
-                            if p["dir"] == 2 and wSide.text != "right":
-                                continue
-                        isConnected = True
-                        # pWall.set('id',pWallID+' '+p['_id'])
-                        lastpath.text += "," + ",".join(
-                            "{:.1f}".format(x) for x in pathlist
-                        )
-                        break
-                if not isConnected:
-                    wall = ET.SubElement(
-                        mapentry, "wall", {"id": str(uuid.uuid5(moduuid, p["_id"]))}
+                pathlist = paths[i]
+                if "door" in p and p["door"] == 1:
+                    wType = ("door", "#00ffff")
+                elif p["door"] == 2:
+                    wType = ("secretDoor", "#00ffff")
+                elif p["move"] == 0 and p["sense"] == 1:
+                    wType = ("ethereal", "#7f007f")
+                elif p["move"] == 1 and p["sense"] == 0:
+                    wType = ("invisible", "#ff00ff")
+                elif p["move"] == 1 and p["sense"] == 2:
+                    wType = ("terrain", "#ffff00")
+                else:
+                    wType = ("normal", "#ff7f00")
+                door = None
+                if p["door"] > 0 and p["ds"] > 0:
+                    door = "locked" if p["ds"] == 2 else "open"
+                side = None
+                if "dir" in p and p["dir"] > 0:
+                    side = "left" if p["dir"] == 1 else "right"
+                segments.append(
+                    [
+                        str(uuid.uuid5(moduuid, p["_id"])),
+                        (wType, door, side),
+                        pathlist,
+                        p,
+                        side is None,
+                    ]
+                )
+            (segments, removed) = removeOverlaps(
+                segments,
+                extendable=lambda key: key[0][0] not in ["door", "secretDoor"],
+            )
+            if removed:
+                print(
+                    "\r - Removed {} duplicate or overlapping walls".format(removed),
+                    file=sys.stderr,
+                    end="",
+                )
+                if args.gui:
+                    worker.outputLog(
+                        " - Removed {} duplicate or overlapping walls".format(removed)
                     )
-                    lastpath = ET.SubElement(wall, "data")
-                    lastpath.text = ",".join("{:.1f}".format(x) for x in pathlist)
-                if not isConnected:
-                    if "door" in p and p["door"] == 1:
-                        ET.SubElement(wall, "type").text = "door"
-                        ET.SubElement(wall, "color").text = "#00ffff"
-                        if p["ds"] > 0:
-                            ET.SubElement(wall, "door").text = (
-                                "locked" if p["ds"] == 2 else "open"
-                            )
-                    elif p["door"] == 2:
-                        ET.SubElement(wall, "type").text = "secretDoor"
-                        ET.SubElement(wall, "color").text = "#00ffff"
-                        if p["ds"] > 0:
-                            ET.SubElement(wall, "door").text = (
-                                "locked" if p["ds"] == 2 else "open"
-                            )
-                    elif p["move"] == 0 and p["sense"] == 1:
-                        ET.SubElement(wall, "type").text = "ethereal"
-                        ET.SubElement(wall, "color").text = "#7f007f"
-                    elif p["move"] == 1 and p["sense"] == 0:
-                        ET.SubElement(wall, "type").text = "invisible"
-                        ET.SubElement(wall, "color").text = "#ff00ff"
-                    elif p["move"] == 1 and p["sense"] == 2:
-                        ET.SubElement(wall, "type").text = "terrain"
-                        ET.SubElement(wall, "color").text = "#ffff00"
-                    else:
-                        ET.SubElement(wall, "type").text = "normal"
-                        ET.SubElement(wall, "color").text = "#ff7f00"
-                    if "dir" in p and p["dir"] > 0:
-                        ET.SubElement(wall, "side").text = (
-                            "left" if p["dir"] == 1 else "right"
-                        )
+            stitcher = WallStitcher()
+            for segment in segments:
+                stitcher.add(*segment)
+            if args.simplifywalls is not None:
+                (before, after) = stitcher.simplify(args.simplifywalls)
+                print(
+                    "\r - Simplified walls from {} to {} vertices".format(before, after),
+                    file=sys.stderr,
+                    end="",
+                )
+                if args.gui:
+                    worker.outputLog(
+                        " - Simplified walls from {} to {} vertices".format(before, after)
+                    )
+            for chain in stitcher:
+                ((wType, color), door, side) = chain.key
+                wall = ET.SubElement(mapentry, "wall", {"id": chain.id})
+                ET.SubElement(wall, "data").text = chain.data()
+                ET.SubElement(wall, "type").text = wType
+                ET.SubElement(wall, "color").text = color
+                if door:
+                    ET.SubElement(wall, "door").text = door
+                if side:
+                    ET.SubElement(wall, "side").text = side
 
-                    if "door" in p and p["door"] > 0:
-                        p["stroke"] = "#00ffff"
-                    else:
-                        p["stroke"] = "#ff7f00"
-                    p["stroke_width"] = 5
-                    p["layer"] = "walls"
+                p = chain.wall
+                if "door" in p and p["door"] > 0:
+                    p["stroke"] = "#00ffff"
+                else:
+                    p["stroke"] = "#ff7f00"
+                p["stroke_width"] = 5
+                p["layer"] = "walls"
 
-                    ET.SubElement(wall, "generated").text = "YES"
+                ET.SubElement(wall, "generated").text = "YES"
 
         if "tiles" in map:
+            for image in map["tiles"]:
+                if "scale" not in image:
+                    image["scale"] = 1
+            widths = transform.column(map["tiles"], lambda t: t["width"] * t["scale"])
+            heights = transform.column(map["tiles"], lambda t: t["height"] * t["scale"])
+            (tileX, tileY) = transform.points(map["tiles"], widths / 2, heights / 2)
+            tileX = rounded(tileX)
+            tileY = rounded(tileY)
+            widths = rounded(widths * map["rescale"])
+            heights = rounded(heights * map["rescale"])
             for i in range(len(map["tiles"])):
                 image = map["tiles"][i]
                 if "img" not in image and "texture" in image:
                     texture = image["texture"]
                     image["img"] = texture["src"]
-                if "scale" not in image:
-                    image["scale"] = 1
-                image["img"] = urllib.parse.unquote(image["img"])
+                image["img"] = resolver.resolve(
+                    image["img"],
+                    "tile",
+                    () if image["img"].endswith(".webm") else (".png",),
+                ) or urllib.parse.unquote(image["img"])
                 print(
                     "\rtiles [{}/{}]".format(i, len(map["tiles"])),
                     file=sys.stderr,
                     end="",
                 )
                 tile = ET.SubElement(mapentry, "tile")
-                ET.SubElement(tile, "x").text = str(
-                    round(
-                        (
-                            image["x"]
-                            - map["offsetX"]
-                            + (image["width"] * image["scale"] / 2)
-                        )
-                        * map["rescale"]
-                    )
-                )
-                ET.SubElement(tile, "y").text = str(
-                    round(
-                        (
-                            image["y"]
-                            - map["offsetY"]
-                            + (image["height"] * image["scale"] / 2)
-                        )
-                        * map["rescale"]
-                    )
-                )
+                ET.SubElement(tile, "x").text = tileX[i]
+                ET.SubElement(tile, "y").text = tileY[i]
                 ET.SubElement(tile, "zIndex").text = str(image["z"])
-                ET.SubElement(tile, "width").text = str(
-                    round(image["width"] * image["scale"] * map["rescale"])
-                )
-                ET.SubElement(tile, "height").text = str(
-                    round(image["height"] * image["scale"] * map["rescale"])
-                )
+                ET.SubElement(tile, "width").text = widths[i]
+                ET.SubElement(tile, "height").text = heights[i]
                 ET.SubElement(tile, "opacity").text = "1.0"
                 ET.SubElement(tile, "rotation").text = str(image["rotation"])
                 ET.SubElement(tile, "locked").text = "YES" if image["locked"] else "NO"
@@ -889,7 +902,7 @@ def convert(args=args, worker=None):
                 imgext = os.path.splitext(os.path.basename(image["img"]))[1]
                 if imgext == ".webm":
                     try:
-                        if os.path.exists(image["img"]):
+                        if resolver.exists(image["img"]):
                             probe = ffprobe(image["img"])
                             if args.spritesheets:
                                 if args.gui:
@@ -897,6 +910,7 @@ def convert(args=args, worker=None):
                                         " - Converting webm tile to spritesheet"
                                     )
                                 (sprites, duration, framewidth, frameheight) = spritesheet(ffmpeg_path, probe, image["img"], worker)
+                                buildcache.wrote(sprites)
                                 ET.SubElement(asset, 'type').text = "spriteSheet"
                                 ET.SubElement(asset, 'frameWidth').text = str(framewidth)
                                 ET.SubElement(asset, 'frameHeight').text = str(frameheight)
@@ -922,7 +936,7 @@ def convert(args=args, worker=None):
                                             image["img"],
                                             "-loop",
                                             "0",
-                                            image["img"] + ".webp",
+                                            buildcache.wrote(image["img"] + ".webp"),
                                         ],
                                         startupinfo=startupinfo,
                                         stdout=subprocess.DEVNULL,
@@ -943,7 +957,7 @@ def convert(args=args, worker=None):
                                             image["img"],
                                             "-loop",
                                             "0",
-                                            image["img"] + ".webp",
+                                            buildcache.wrote(image["img"] + ".webp"),
                                         ],
                                         startupinfo=startupinfo,
                                         stdout=subprocess.DEVNULL,
@@ -1005,71 +1019,62 @@ def convert(args=args, worker=None):
                 else:
                     ET.SubElement(asset, "type").text = "image"
                 if image["img"].startswith("http"):
-                    urllib.request.urlretrieve(
-                        image["img"], os.path.basename(image["img"])
+                    buildcache.wrote(
+                        fetcher.place(image["img"], os.path.basename(image["img"]))
                     )
                     image["img"] = os.path.basename(image["img"])
-                if not os.path.exists(image["img"]):
-                    if os.path.exists(os.path.splitext(image["img"])[0] + ".png"):
-                        image["img"] = os.path.splitext(image["img"])[0] + ".png"
-                        imgext = ".png"
-                    else:
-                        if args.gui:
-                            worker.outputLog(" - MISSING RESOURCE: " + image["img"])
-                        print(
-                            " - MISSING RESOURCE:",
-                            image["img"],
-                            file=sys.stderr,
-                            end="",
-                        )
-                        continue
-                img = PIL.Image.open(image["img"])
+                if not resolver.exists(image["img"]):
+                    if args.gui:
+                        worker.outputLog(" - MISSING RESOURCE: " + image["img"])
+                    print(
+                        " - MISSING RESOURCE:",
+                        image["img"],
+                        file=sys.stderr,
+                        end="",
+                    )
+                    continue
+                (width, height) = imageinfo.size(image["img"])
                 if (
-                    img.width <= 300
-                    and img.height <= 300
-                    and 0.9 <= img.width / img.height <= 1.1
+                    width <= 300
+                    and height <= 300
+                    and 0.9 <= width / height <= 1.1
                 ):
                     if "journal" in map and map["journal"]:
                         try:
                             from markerocr import placeMarker
 
-                            placeMarker(img, map, image, mapentry, module, moduuid)
+                            placeMarker(
+                                PIL.Image.open(image["img"]), map, image, mapentry, module, moduuid
+                            )
                         except:
                             pass
+                size = (width, height)
+                if width > 4096 or height > 4096:
+                    size = fit(width, height, 4095)
                 if imgext == ".webp" and args.jpeg != ".webp":
                     ET.SubElement(asset, "resource").text = (
                         os.path.splitext(image["img"])[0] + ".png"
                     )
-                    if img.width > 4096 or img.height > 4096:
-                        scale = (
-                            4095 / img.width
-                            if img.width >= img.height
-                            else 4095 / img.height
-                        )
-                        img = img.resize(
-                            (round(img.width * scale), round(img.height * scale))
-                        )
                     if args.gui:
                         worker.outputLog(" - Converting tile from webp to png")
-                    img.save(
-                        os.path.join(
-                            tempdir, os.path.splitext(image["img"])[0] + ".png"
-                        )
+                    render(
+                        {"src": image["img"], "steps": [("resize", size)]},
+                        buildcache.wrote(
+                            os.path.join(tempdir, os.path.splitext(image["img"])[0] + ".png")
+                        ),
                     )
-                    os.remove(image["img"])
+                    archive.remove(image["img"])
                 else:
                     ET.SubElement(asset, "resource").text = image["img"]
-                    if img.width > 4096 or img.height > 4096:
-                        scale = (
-                            4095 / img.width
-                            if img.width >= img.height
-                            else 4095 / img.height
-                        )
-                        img = img.resize(
-                            (round(img.width * scale), round(img.height * scale))
+                    if size != (width, height):
+                        render(
+                            {"src": image["img"], "steps": [("resize", size)]},
+                            buildcache.wrote(os.path.join(tempdir, image["img"])),
                         )
-                        img.save(os.path.join(tempdir, image["img"]))
         if "lights" in map:
+            (lightX, lightY) = transform.points(map["lights"])
+            lightX = rounded(lightX)
+            lightY = rounded(lightY)
             for i in range(len(map["lights"])):
                 print(
                     "\rlights [{}/{}]".format(i, len(map["lights"])),
@@ -1109,18 +1114,24 @@ def convert(args=args, worker=None):
                 ET.SubElement(lightel, "alwaysVisible").text = (
                     "YES" if "t" in light and light["t"] == "u" else "NO"
                 )
-                ET.SubElement(lightel, "x").text = str(
-                    round((light["x"] - map["offsetX"]) * map["rescale"])
-                )
-                ET.SubElement(lightel, "y").text = str(
-                    round((light["y"] - map["offsetY"]) * map["rescale"])
-                )
+                ET.SubElement(lightel, "x").text = lightX[i]
+                ET.SubElement(lightel, "y").text = lightY[i]
 
         if "tokens" in map and len(map["tokens"]) > 0:
             # encentry = ET.SubElement(module,'encounter',{'id': str(uuid.uuid5(moduuid,mapslug+"/encounter")),'parent': str(uuid.uuid5(moduuid,map['_id']+map['name'])), 'sort': '1'})
             # ET.SubElement(encentry,'name').text = map['name'] + " Encounter"
             # ET.SubElement(encentry,'slug').text = slugify(map['name'] + " Encounter")
-            for token in map["tokens"]:
+            (tokenOffsetX, tokenOffsetY) = transform.tokenOffsets(
+                [t["width"] for t in map["tokens"]],
+                [t["height"] for t in map["tokens"]],
+                mapgrid["size"],
+                mapgrid["type"],
+            )
+            (tokenX, tokenY) = transform.points(map["tokens"])
+            tokenX = rounded(tokenX, tokenOffsetX)
+            tokenY = rounded(tokenY, tokenOffsetY)
+            for i in range(len(map["tokens"])):
+                token = map["tokens"][i]
                 if "name" not in token:
                     token["name"] = "Unknown"
                 if "dimLight" not in token:
@@ -1130,29 +1141,7 @@ def convert(args=args, worker=None):
                 if "lightAlpha" not in token:
                     token["lightAlpha"] = token["light"]["alpha"] if "light" in token else 1
                 if 4 <= mapgrid["type"] <= 5:
-                    tokenOffsetX = round(
-                        ((2 * mapgrid["size"] * 0.75 * token["width"]) + (mapgrid["size"] / 2))
-                        / 2
-                    )
-                    tokenOffsetY = round(
-                        (math.sqrt(3) * mapgrid["size"] * token["height"]) / 2
-                    )
-                    if mapgrid["type"] == 5:
-                        tokenOffsetX += round(mapgrid["size"])
                     token["scale"] /= 0.8
-                elif 2 <= mapgrid["type"] <= 3:
-                    tokenOffsetX = round(
-                        (math.sqrt(3) * mapgrid["size"] * token["width"]) / 2
-                    )
-                    tokenOffsetY = round(
-                        ((2 * mapgrid["size"] * 0.75 * token["height"]) + (mapgrid["size"] / 2))
-                        / 2
-                    )
-                    if mapgrid["type"] == 3:
-                        tokenOffsetX += round(mapgrid["size"])
-                else:
-                    tokenOffsetX = round(token["width"] * (mapgrid["size"] / 2))
-                    tokenOffsetY = round(token["height"] * (mapgrid["size"] / 2))
                 tokenel = ET.SubElement(
                     mapentry,
                     "token",
@@ -1163,15 +1152,10 @@ def convert(args=args, worker=None):
                     },
                 )
                 ET.SubElement(tokenel, "name").text = token["name"]
-                ET.SubElement(tokenel, "x").text = str(
-                    round(((token["x"] - map["offsetX"]) * map["rescale"]))
-                    + tokenOffsetX
-                )
-                ET.SubElement(tokenel, "y").text = str(
-                    round(((token["y"] - map["offsetY"]) * map["rescale"]))
-                    + tokenOffsetY
-                )
-                if "img" in token and os.path.exists(urllib.parse.unquote(token["img"])):
+                ET.SubElement(tokenel, "x").text = tokenX[i]
+                ET.SubElement(tokenel, "y").text = tokenY[i]
+                tokenimg = resolver.resolve(token.get("img"), "token")
+                if tokenimg:
                     tokenasset = ET.SubElement(
                         tokenel,
                         "asset",
@@ -1186,7 +1170,7 @@ def convert(args=args, worker=None):
                     )
                     ET.SubElement(tokenasset, "name").text = token["name"]
                     ET.SubElement(tokenasset, "type").text = "image"
-                    ET.SubElement(tokenasset, "resource").text = urllib.parse.unquote(token["img"])
+                    ET.SubElement(tokenasset, "resource").text = tokenimg
                 ET.SubElement(tokenel, "hidden").text = (
                     "YES" if token["hidden"] else "NO"
                 )
@@ -1248,27 +1232,25 @@ def convert(args=args, worker=None):
                 )
 
                 actorLinked = False
-                for a in actors:
-                    if a["_id"] == token["actorId"]:
-                        ET.SubElement(tokenel, "reference").text = "/monster/{}".format(
+                a = index.get("Actor", token["actorId"])
+                if a:
+                    ET.SubElement(tokenel, "reference").text = "/monster/{}".format(
+                        uuid.uuid5(moduuid, a["_id"])
+                        if args.compendium
+                        else slugify(", ".join(a["name"]) if type(a["name"]) == list else a["name"])
+                    )
+                    actorLinked = True
+                if not actorLinked and args.compendium:
+                    a = index.getByTokenName("Actor", token["name"])
+                    if a:
+                        ET.SubElement(
+                            tokenel, "reference"
+                        ).text = "/monster/{}".format(
                             uuid.uuid5(moduuid, a["_id"])
                             if args.compendium
-                            else slugify(", ".join(a["name"]) if type(a["name"]) == list else a["name"])
+                            else slugify(a["name"])
                         )
                         actorLinked = True
-                        break
-                if not actorLinked and args.compendium:
-                    for a in actors:
-                        if a["token"]["name"] == token["name"]:
-                            ET.SubElement(
-                                tokenel, "reference"
-                            ).text = "/monster/{}".format(
-                                uuid.uuid5(moduuid, a["_id"])
-                                if args.compendium
-                                else slugify(a["name"])
-                            )
-                            actorLinked = True
-                            break
                 if not actorLinked:
                     ET.SubElement(tokenel, "reference").text = "/monster/{}".format(
                         slugify(token["name"])
@@ -1284,6 +1266,11 @@ def convert(args=args, worker=None):
                         color=(0, 0, 0, 0),
                     ) as img:
                         d["fontSize"] = round(d["fontSize"] / 0.75)
+                        archive.need(
+                            os.path.join(
+                                moduletmp, mod["name"], "fonts", d["fontFamily"] + ".ttf"
+                            )
+                        )
                         try:
                             font = PIL.ImageFont.truetype(
                                 os.path.join(
@@ -1301,48 +1288,13 @@ def convert(args=args, worker=None):
                                 )
                             except Exception as e:
                                 try:
-                                    solbera = {
-                                        "bookmania": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Bookinsanity/Bookinsanity.otf",
-                                        "scala sans caps": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Scaly%20Sans%20Caps/Scaly%20Sans%20Caps.otf",
-                                        "modesto condensed": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Nodesto%20Caps%20Condensed/Nodesto%20Caps%20Condensed.otf",
-                                        "mrs eaves small caps": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Mr%20Eaves/Mr%20Eaves%20Small%20Caps.otf",
-                                        "dai vernon misdirect": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Zatanna%20Misdirection/Zatanna%20Misdirection.otf",
-                                        "scala sans": "https://raw.githubusercontent.com/jonathonf/solbera-dnd-fonts/master/Scaly%20Sans/Scaly%20Sans.otf",
-                                    }
-                                    if d["fontFamily"].lower() in solbera.keys():
-                                        urllib.request.urlretrieve(
-                                            solbera[d["fontFamily"].lower()],
-                                            d["fontFamily"] + ".otf",
-                                        )
-                                        font = PIL.ImageFont.truetype(
-                                            d["fontFamily"] + ".otf", size=d["fontSize"]
-                                        )
-                                    else:
-                                        urllib.request.urlretrieve(
-                                            "https://raw.githubusercontent.com/google/fonts/master/ofl/{}/METADATA.pb".format(
-                                                urllib.parse.quote(
-                                                    d["fontFamily"].lower()
-                                                )
-                                            ),
-                                            d["fontFamily"] + ".pb",
-                                        )
-                                        protobuf_file_path = d["fontFamily"] + ".pb"
-                                        protobuf_file = open(protobuf_file_path, "r")
-                                        protobuf = protobuf_file.read()
-                                        font_family = fonts_public_pb2.FamilyProto()
-                                        text_format.Merge(protobuf, font_family)
-                                        urllib.request.urlretrieve(
-                                            "https://raw.githubusercontent.com/google/fonts/master/ofl/{}/{}".format(
-                                                urllib.parse.quote(
-                                                    d["fontFamily"].lower()
-                                                ),
-                                                font_family.fonts[0].filename,
-                                            ),
-                                            d["fontFamily"] + ".ttf",
-                                        )
-                                        font = PIL.ImageFont.truetype(
-                                            d["fontFamily"] + ".ttf", size=d["fontSize"]
-                                        )
+                                    font = PIL.ImageFont.truetype(
+                                        fetcher.get(
+                                            ("font", d["fontFamily"]),
+                                            fontTask(d["fontFamily"]),
+                                        ),
+                                        size=d["fontSize"],
+                                    )
                                 except Exception as e:
                                     print(
                                         '\rUnable to load font for "{}"'.format(
@@ -1370,27 +1322,17 @@ def convert(args=args, worker=None):
                         draw.multiline_text(
                             (0, 0), text, (255, 255, 255), spacing=0, font=font
                         )
-                        img.save(os.path.join(tempdir, "text_" + d["_id"] + ".png"))
-                    tile = ET.SubElement(mapentry, "tile")
-                    ET.SubElement(tile, "x").text = str(
-                        round(
-                            (d["x"] - map["offsetX"] + ((d["width"] if "width" in d else d["shape"]["width"]) / 2))
-                            * map["rescale"]
-                        )
-                    )
-                    ET.SubElement(tile, "y").text = str(
-                        round(
-                            (d["y"] - map["offsetY"] + ((d["height"] if "height" in d else d["shape"]["height"]) / 2))
-                            * map["rescale"]
+                        img.save(
+                            buildcache.wrote(os.path.join(tempdir, "text_" + d["_id"] + ".png"))
                         )
-                    )
+                    tile = ET.SubElement(mapentry, "tile")
+                    width = d["width"] if "width" in d else d["shape"]["width"]
+                    height = d["height"] if "height" in d else d["shape"]["height"]
+                    ET.SubElement(tile, "x").text = rounded(transform.x([d["x"]], width / 2))[0]
+                    ET.SubElement(tile, "y").text = rounded(transform.y([d["y"]], height / 2))[0]
                     ET.SubElement(tile, "zIndex").text = str(d["z"])
-                    ET.SubElement(tile, "width").text = str(
-                        round((d["width"] if "width" in d else d["shape"]["width"]) * map["rescale"])
-                    )
-                    ET.SubElement(tile, "height").text = str(
-                        round((d["height"] if "height" in d else d["shape"]["height"]) * map["rescale"])
-                    )
+                    ET.SubElement(tile, "width").text = rounded([width * map["rescale"]])[0]
+                    ET.SubElement(tile, "height").text = rounded([height * map["rescale"]])[0]
                     ET.SubElement(tile, "opacity").text = "1.0"
                     ET.SubElement(tile, "rotation").text = str(d["rotation"])
                     ET.SubElement(tile, "locked").text = "YES" if d["locked"] else "NO"
@@ -1413,15 +1355,9 @@ def convert(args=args, worker=None):
                     ET.SubElement(drawing, "opacity").text = str(d["strokeAlpha"])
                     ET.SubElement(drawing, "fillColor").text = d["fillColor"]
 
-                    points = []
-                    for p in d["points"]:
-                        points.append(
-                            str((p[0] - map["offsetX"] + d["x"]) * map["rescale"])
-                        )
-                        points.append(
-                            str((p[1] - map["offsetY"] + d["y"]) * map["rescale"])
-                        )
-                    ET.SubElement(drawing, "data").text = ",".join(points)
+                    ET.SubElement(drawing, "data").text = transform.polyline(
+                        d["points"], d["x"], d["y"]
+                    )
                 if "shape" in d and d["shape"]["type"] == "r":
                     drawing = ET.SubElement(
                         mapentry, "drawing", {"id": str(uuid.uuid5(moduuid, d["_id"]))}
@@ -1435,22 +1371,11 @@ def convert(args=args, worker=None):
                     ET.SubElement(drawing, "opacity").text = str(d["strokeAlpha"])
                     ET.SubElement(drawing, "fillColor").text = d["fillColor"]
 
-                    points = []
                     print(d)
                     #'width': 135, 'height': 108, 'radius': None, 'points': []}, 'x': 1688, 'y': 1500,
-                    points.append(
-                            str(((0) - map["offsetX"] + d["x"]) * map["rescale"])
-                            )
-                    points.append(
-                            str(((0) - map["offsetY"] + d["y"]) * map["rescale"])
-                            )
-                    points.append(
-                            str(((d["shape"]["width"]) - map["offsetX"] + d["x"]) * map["rescale"])
-                            )
-                    points.append(
-                            str(((d["shape"]["height"]) - map["offsetY"] + d["y"]) * map["rescale"])
-                            )
-                    ET.SubElement(drawing, "data").text = ",".join(points)
+                    ET.SubElement(drawing, "data").text = transform.polyline(
+                        [0, 0, d["shape"]["width"], d["shape"]["height"]], d["x"], d["y"]
+                    )
         if args.jrnmap:
             for j in sorted(journal, key=lambda j: j["name"] if "name" in j else ""):
                 if j["name"].startswith(map["name"]):
@@ -1481,30 +1406,27 @@ def convert(args=args, worker=None):
                 {"ref": "/page/{}".format(str(uuid.uuid5(moduuid, map["journal"])))},
             )
         if "notes" in map and len(map["notes"]) > 0:
-            for n in map["notes"]:
+            (noteX, noteY) = transform.points(map["notes"])
+            noteX = rounded(noteX)
+            noteY = rounded(noteY)
+            for i in range(len(map["notes"])):
+                n = map["notes"][i]
                 marker = ET.SubElement(mapentry, "marker")
                 def getJournal():
-                    for j in journal:
-                        if j["_id"]==n["entryId"]:
-                            return j
+                    j = index.get("JournalEntry", n["entryId"])
+                    if j:
+                        return j
                     if "text" not in n:
                         print("No text")
                         print(n)
                         return None
-                    for j in journal:
-                        if j["name"]==n["text"]:
-                            return j
-                    return None
+                    return index.getByName("JournalEntry", n["text"])
                 noteLink = getJournal()
                 ET.SubElement(marker, "name").text = n["text"] if "text" in n else noteLink["name"] if noteLink else ""
                 ET.SubElement(marker, "label").text = "📖"
                 ET.SubElement(marker, "shape").text = "circle"
-                ET.SubElement(marker, "x").text = str(
-                    round((n["x"] - map["offsetX"]) * map["rescale"])
-                )
-                ET.SubElement(marker, "y").text = str(
-                    round((n["y"] - map["offsetY"]) * map["rescale"])
-                )
+                ET.SubElement(marker, "x").text = noteX[i]
+                ET.SubElement(marker, "y").text = noteY[i]
                 ET.SubElement(marker, "hidden").text = "YES"
                 ET.SubElement(
                     marker,
@@ -1512,7 +1434,11 @@ def convert(args=args, worker=None):
                     {"ref": "/page/{}".format(str(uuid.uuid5(moduuid, noteLink["_id"] if noteLink else n["entryId"])))},
                 )
         if "sounds" in map and len(map["sounds"]) > 0:
-            for s in map["sounds"]:
+            (soundX, soundY) = transform.points(map["sounds"])
+            soundX = rounded(soundX)
+            soundY = rounded(soundY)
+            for i in range(len(map["sounds"])):
+                s = map["sounds"][i]
                 marker = ET.SubElement(mapentry, "marker")
                 ET.SubElement(
                     marker, "name"
@@ -1521,12 +1447,8 @@ def convert(args=args, worker=None):
                 )
                 ET.SubElement(marker, "label").text = "🔊"
                 ET.SubElement(marker, "shape").text = "circle"
-                ET.SubElement(marker, "x").text = str(
-                    round((s["x"] - map["offsetX"]) * map["rescale"])
-                )
-                ET.SubElement(marker, "y").text = str(
-                    round((s["y"] - map["offsetY"]) * map["rescale"])
-                )
+                ET.SubElement(marker, "x").text = soundX[i]
+                ET.SubElement(marker, "y").text = soundY[i]
                 ET.SubElement(marker, "hidden").text = "YES"
                 ET.SubElement(
                     marker,
@@ -1567,11 +1489,8 @@ def convert(args=args, worker=None):
                     if "name" in s
                     else os.path.splitext(os.path.basename(s["path"]))[0]
                 )
-                if not os.path.exists(s["path"]) and os.path.exists(
-                    os.path.splitext(s["path"])[0] + ".mp4"
-                ):
-                    s["path"] = os.path.splitext(s["path"])[0] + ".mp4"
-                if os.path.exists(s["path"]):
+                s["path"] = resolver.resolve(s["path"], "sound", (".mp4",)) or s["path"]
+                if resolver.exists(s["path"]):
                     if magic.from_file(
                         os.path.join(tempdir, urllib.parse.unquote(s["path"])),
                         mime=True,
@@ -1592,7 +1511,7 @@ def convert(args=args, worker=None):
                                     s["path"],
                                     "-acodec",
                                     "aac",
-                                    os.path.splitext(s["path"])[0] + ".mp4",
+                                    buildcache.wrote(os.path.splitext(s["path"])[0] + ".mp4"),
                                 ],
                                 startupinfo=startupinfo,
                                 stdout=subprocess.DEVNULL,
@@ -1600,7 +1519,7 @@ def convert(args=args, worker=None):
                                 stdin=subprocess.DEVNULL,
                             )
                             ffp.wait()
-                            os.remove(s["path"])
+                            archive.remove(s["path"])
                             s["path"] = os.path.splitext(s["path"])[0] + ".mp4"
                         except Exception:
                             print("Could not convert to MP4")
@@ -1629,6 +1548,36 @@ def convert(args=args, worker=None):
 
         return mapslug
 
+    def createCover(src, dest):
+        unit = buildcache.unit(
+            buildcache.key("cover", sha256(src), os.path.basename(dest)),
+            archive,
+            [os.path.dirname(dest)],
+            prefix="module_cover",
+        )
+        if unit.restore() is not None:
+            return
+        info = imageinfo.get(src)
+        if (
+            info
+            and info.width == info.height <= 1024
+            and os.path.splitext(src)[1].lower() == os.path.splitext(dest)[1].lower()
+        ):
+            with unit:
+                archive.copy(src, dest)
+            return
+        with unit, PIL.Image.open(src) as img:
+            side = min(img.width, img.height)
+            if side > 1024:
+                img = img.resize(
+                    (1024, 1024), box=draft(img, (1024, 1024), (0, 0, side, side))
+                )
+            else:
+                img = img.crop((0, 0, side, side))
+            if args.jpeg == ".jpg" and img.mode in ("RGBA", "P"):
+                img = img.convert("RGB")
+            img.save(dest)
+
     global tempdir
     if not tempdir:
         tempdir = tempfile.mkdtemp(prefix="convertfoundry_")
@@ -1639,123 +1588,65 @@ def convert(args=args, worker=None):
             manifest = json.load(f)
         if "download" in manifest:
 
+            started = time.time()
+
             def progress(block_num, block_size, total_size):
                 pct = "{:.2f}%".format(100.00 * ((block_num * block_size) / total_size)) if total_size > 0 else "{:.2f} mB".format((block_num*block_size)/1024.00/1024.00)
+                rate = (block_num * block_size) / max(time.time() - started, 0.001) / 1024 / 1024
                 print(
-                    "\rDownloading module {}".format(pct), file=sys.stderr, end=""
+                    "\rDownloading module {} ({:.1f} MB/s)".format(pct, rate), file=sys.stderr, end=""
                 )
 
-            urllib.request.urlretrieve(
-                manifest["download"], os.path.join(tempdir, "module.zip"), progress
-            )
+            if args.nocache:
+                RangedDownload(
+                    manifest["download"], os.path.join(tempdir, "module.zip"), args.connections
+                ).run(progress)
+            else:
+                cache = DownloadCache(args.cachedir, args.cachesize * 1024 * 1024)
+                cache.fetch(
+                    args.srcfile, manifest, os.path.join(tempdir, "module.zip"), progress, args.connections
+                )
+                print("\033[K", file=sys.stderr, end="")
+                print("\r" + cache.report(), file=sys.stderr)
             print("\r", file=sys.stderr, end="")
             args.srcfile = os.path.join(tempdir, "module.zip")
+    elif os.path.isdir(args.srcfile):
+        args.srcfile = os.path.abspath(args.srcfile)
 
-    with zipfile.ZipFile(args.srcfile) as z:
+    decoder = nedb.Decoder(1 if args.gui else args.jobs)
+    with openArchive(args.srcfile) as z:
         dirpath = ""
-        journal = []
-        maps = []
-        folders = []
-        actors = []
-        items = []
-        tables = []
-        playlists = []
-        pdfs = []
+        journal = nedb.Collection(decoder)
+        maps = nedb.Collection(decoder)
+        folders = nedb.Collection(decoder)
+        if args.compendium:
+            actors = nedb.Collection(decoder)
+            items = nedb.Collection(decoder)
+        else:
+            actors = nedb.DocumentStore(os.path.join(tempdir, "actors.spool"), decoder)
+            items = nedb.DocumentStore(os.path.join(tempdir, "items.spool"), decoder)
+        tables = nedb.Collection(decoder)
+        playlists = nedb.Collection(decoder)
         mod = None
-        isworld = False
-        for filename in z.namelist():
-            if os.path.basename(filename) == "world.json":
-                dirpath = os.path.dirname(filename)
-                with z.open(filename) as f:
-                    mod = json.load(f)
-                isworld = True
-            elif not mod and os.path.basename(filename) == "module.json":
-                dirpath = os.path.dirname(filename)
-                with z.open(filename) as f:
-                    mod = json.load(f)
-            elif not mod and os.path.basename(filename) == "system.json":
-                dirpath = os.path.dirname(filename)
-                with z.open(filename) as f:
-                    mod = json.load(f)
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "folders.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        folder = json.loads(l)
-                        folders.append(folder)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "journal.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        jrn = json.loads(l)
-                        journal.append(jrn)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "scenes.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        scene = json.loads(l)
-                        maps.append(scene)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "actors.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        actor = json.loads(l)
-                        actors.append(actor)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "items.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        item = json.loads(l)
-                        items.append(item)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "tables.db"
-            ):
-                with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        table = json.loads(l)
-                        tables.append(table)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif (
-                os.path.basename(os.path.dirname(filename)) == "data"
-                and os.path.basename(filename) == "playlists.db"
-            ):
+        zipindex = ZipIndex(z)
+        (modfile, isworld) = zipindex.manifest()
+        if modfile:
+            dirpath = os.path.dirname(modfile)
+            with z.open(modfile) as f:
+                mod = json.load(f)
+        for (dbfile, collection) in (
+            ("folders.db", folders),
+            ("journal.db", journal),
+            ("scenes.db", maps),
+            ("actors.db", actors),
+            ("items.db", items),
+            ("tables.db", tables),
+            ("playlists.db", playlists),
+        ):
+            for filename in zipindex.find(dbfile, "data"):
                 with z.open(filename) as f:
-                    l = f.readline().decode("utf8")
-                    while l:
-                        playlist = json.loads(l)
-                        playlists.append(playlist)
-                        l = f.readline().decode("utf8")
-                    f.close()
-            elif os.path.splitext(filename)[1].lower() == ".pdf":
-                pdfs.append(filename)
+                    collection.load(f)
+        pdfs = zipindex.extension(".pdf")
         if not isworld and mod:
             if "name" not in mod and "id" in mod:
                 mod["name"] = mod["id"]
@@ -1763,6 +1654,31 @@ def convert(args=args, worker=None):
                 args.packdir = mod["EncounterPackDir"]
             if "packs" not in mod:
                 mod["packs"] = []
+            def loadPack(pack, docs):
+                packtype = pack["type"] if "entity" not in pack else pack["entity"]
+                if "label" in pack:
+                    folders.apply({
+                        "_id": slugify(pack["label"]),
+                        "type": packtype,
+                        "name": pack["label"],
+                        "parent": None
+                        })
+                if packtype == "JournalEntry":
+                    def packFolder(jrn):
+                        if "folder" not in jrn and not jrn["folder"]:
+                            jrn["folder"] = slugify(pack["label"])
+                    journal.extend(docs, packFolder)
+                elif packtype == "Scene":
+                    def packFolder(scene):
+                        if "folder" not in scene or not scene["folder"]:
+                            scene["folder"] = slugify(pack["label"])
+                    maps.extend(docs, packFolder)
+                elif packtype == "Actor":
+                    actors.extend(docs)
+                elif packtype == "Item":
+                    items.extend(docs)
+                elif packtype == "Playlist":
+                    playlists.extend(docs)
             for pack in mod["packs"]:
                 if args.system and "system" in pack and pack["system"] != args.system:
                     print("Skipping", pack["name"], pack["system"], "!=", args.system)
@@ -1770,49 +1686,47 @@ def convert(args=args, worker=None):
                 pack["path"] = (
                     pack["path"][1:] if os.path.isabs(pack["path"]) else pack["path"]
                 )
-                if any(x.startswith("{}/".format(mod["name"])) for x in z.namelist()):
+                if zipindex.hasDir(mod["name"]):
                     if pack["path"].startswith("./"):
                         pack["path"] = pack["path"][2:]
                     pack["path"] = mod["name"] + "/" + pack["path"]
-                if dirpath and not pack["path"].startswith("{}/".format(dirpath)) and any(x.startswith("{}/".format(dirpath)) for x in z.namelist()):
+                if dirpath and not pack["path"].startswith("{}/".format(dirpath)) and zipindex.hasDir(dirpath):
                     pack["path"] = dirpath + "/" + pack["path"]
                 if pack["path"].startswith("./") and dirpath:
                     pack["path"] = dirpath + pack["path"][1:]
                 elif pack["path"].startswith("./"):
                     pack["path"] = pack["path"][2:]
                 try:
-                    with z.open(pack["path"]) as f:
-                        packtype = pack["type"] if "entity" not in pack else pack["entity"]
-                        if "label" in pack:
-                            folders.append({
-                                "_id": slugify(pack["label"]),
-                                "type": packtype,
-                                "name": pack["label"],
-                                "parent": None
+                    if zipindex.hasDir(pack["path"]):
+                        packfolders = []
+
+                        def packDocuments(db):
+                            for (collection, doc) in db.documents():
+                                if collection == "folders":
+                                    packfolders.append(doc)
+                                else:
+                                    yield doc
+
+                        docs = packDocuments(
+                            LevelDB(z, pack["path"], zipindex.listdir(pack["path"]))
+                        )
+                        loadPack(pack, docs)
+                        # Packs of types loadPack skips still have their folders
+                        for doc in docs:
+                            pass
+                        for folder in packfolders:
+                            folders.apply({
+                                "_id": folder["_id"],
+                                "type": folder["type"],
+                                "name": folder["name"],
+                                "parent": folder.get("folder") or (
+                                    slugify(pack["label"]) if "label" in pack else None
+                                ),
+                                "sort": folder.get("sort", 0),
                                 })
-                        l = f.readline().decode("utf8")
-                        while l:
-                            if packtype == "JournalEntry":
-                                jrn = json.loads(l)
-                                if "folder" not in jrn and not jrn["folder"]:
-                                    jrn["folder"] = slugify(pack["label"])
-                                journal.append(jrn)
-                            elif packtype == "Scene":
-                                scene = json.loads(l)
-                                if "folder" not in scene or not scene["folder"]:
-                                    scene["folder"] = slugify(pack["label"])
-                                maps.append(scene)
-                            elif packtype == "Actor":
-                                actor = json.loads(l)
-                                actors.append(actor)
-                            elif packtype == "Item":
-                                item = json.loads(l)
-                                items.append(item)
-                            elif packtype == "Playlist":
-                                playlist = json.loads(l)
-                                playlists.append(playlist)
-                            l = f.readline().decode("utf8")
-                        f.close()
+                    else:
+                        with z.open(pack["path"]) as f:
+                            loadPack(pack, decoder.read(f))
                 except Exception as e:
                     import traceback
                     print(traceback.format_exc())
@@ -1837,18 +1751,29 @@ def convert(args=args, worker=None):
         else:
             moduletmp = os.path.join(tempdir, "modules")
         os.mkdir(moduletmp)
-        if not any(x.startswith("{}/".format(mod["name"])) for x in z.namelist()):
+        if not zipindex.hasDir(mod["name"]):
             if dirpath:
-                z.extractall(path=moduletmp)
-                os.rename(os.path.join(moduletmp,dirpath),os.path.join(moduletmp,mod["name"]))
+                archive = ModuleArchive(args.srcfile, moduletmp, dirpath, mod["name"])
             else:
                 os.mkdir(os.path.join(moduletmp, mod["name"]))
-                z.extractall(path=os.path.join(moduletmp, mod["name"]))
+                archive = ModuleArchive(args.srcfile, os.path.join(moduletmp, mod["name"]))
         else:
-            z.extractall(path=moduletmp)
-    if os.path.exists(os.path.join(tempdir, "module.zip")):
-        os.remove(os.path.join(tempdir, "module.zip"))
-        os.remove(os.path.join(tempdir, "manifest.json"))
+            archive = ModuleArchive(args.srcfile, moduletmp)
+        resolver = AssetResolver(archive)
+        imageinfo = ImageIndex(archive)
+        imageinfo.build()
+    decoder.close()
+    print("\033[K", file=sys.stderr, end="")
+    print("\r" + decoder.report(), file=sys.stderr)
+    if args.gui:
+        worker.outputLog(decoder.report())
+    actors = actors.documents()
+    items = items.documents()
+    folders = list(folders.values())
+    journal = [] if args.noj else list(journal.values())
+    maps = list(maps.values())
+    playlists = list(playlists.values())
+    tables = list(tables.values())
     moduuid = uuid.uuid5(nsuuid, mod["name"])
     slugs = []
     if args.packdir:
@@ -1885,11 +1810,76 @@ def convert(args=args, worker=None):
     order = 0
     cwd = os.getcwd()
     os.chdir(tempdir)
+    if args.audit:
+        audit = AssetAudit(resolver, imageinfo, args.jpeg, args.spritesheets, args.p512)
+        for map in maps:
+            if not map.get("$$deleted"):
+                audit.scene(map)
+        for j in journal:
+            audit.journal(j)
+        for p in playlists:
+            audit.playlist(p)
+        if args.compendium:
+            for a in actors:
+                audit.document(a, "Actor")
+            for i in items:
+                audit.document(i, "Item")
+        if args.packdir:
+            audit.pack(args.packdir)
+        for docs in (actors, items):
+            if type(docs) == nedb.DocumentStore:
+                docs.close()
+        archive.close()
+        os.chdir(cwd)
+        print("\033[K", file=sys.stderr, end="")
+        print("\r" + audit.report(ffmpeg_path is not None))
+        if args.gui:
+            worker.outputLog(audit.report(ffmpeg_path is not None))
+        shutil.rmtree(tempdir, ignore_errors=True)
+        tempdir = None
+        return None
+    buildcache = BuildCache(
+        None if args.nocache else os.path.join(args.cachedir or defaultCacheDir(), "build"),
+        tempdir,
+        {
+            "jpeg": args.jpeg,
+            "spritesheets": args.spritesheets,
+            "p512": args.p512,
+            "compendium": args.compendium,
+            "jrnmap": args.jrnmap,
+            "simplifywalls": args.simplifywalls,
+            "code": codeDigest(
+                [
+                    __name__,
+                    "walls",
+                    "transform",
+                    "spritesheet",
+                    "archive",
+                    "resolver",
+                    "mapimages",
+                    "imageindex",
+                    "entityindex",
+                    "nedb",
+                    "leveldb",
+                    "markerocr",
+                ]
+            ),
+        },
+        args.cachesize * 1024 * 1024,
+    )
+    images = ImagePipeline(
+        archive,
+        buildcache,
+        1 if args.gui else args.jobs,
+        imageinfo,
+        args.memory * 1024 * 1024,
+    )
     maxorder = 0
     sort = 0
     if args.packdir:
         packdir = os.path.join(tempdir, "packdir")
         os.mkdir(packdir)
+        archive.needTree(args.packdir)
         packroot = [
             folder
             for folder in os.listdir(args.packdir)
@@ -1902,29 +1892,14 @@ def convert(args=args, worker=None):
                 if args.gui:
                     worker.outputLog("Generating cover image")
                 print("\rGenerating cover image", file=sys.stderr, end="")
-                if not os.path.exists(
-                    urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                ):
-                    if os.path.exists(
-                        os.path.splitext(
-                            urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                        )[0]
-                        + args.jpeg
-                    ):
-                        map["img"] = os.path.splitext(map["img"])[0] + args.jpeg
-                with PIL.Image.open(
-                    urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                ) as img:
-                    if img.width <= img.height:
-                        img = img.crop((0, 0, img.width, img.width))
-                    else:
-                        img = img.crop((0, 0, img.height, img.height))
-                    if img.width > 1024:
-                        img = img.resize((1024, 1024))
-                    if args.jpeg == ".jpg" and img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-                    img.save(os.path.join(packdir, "module_cover" + args.jpeg))
-                modimage.text = "module_cover" + args.jpeg
+                cover = resolver.resolve(
+                    map["img"] or map["tiles"][0]["img"], "cover", (args.jpeg,)
+                )
+                if cover:
+                    if map["img"]:
+                        map["img"] = cover
+                    createCover(cover, os.path.join(packdir, "module_cover" + args.jpeg))
+                    modimage.text = "module_cover" + args.jpeg
         journal.clear()
         maps.clear()
         folders.clear()
@@ -1996,231 +1971,253 @@ def convert(args=args, worker=None):
                 if args.gui:
                     worker.outputLog(" adding " + f)
                     worker.updateProgress((pos / len(packroot)) * 70)
-                if groupid:
-                    asset = ET.SubElement(
-                        module,
-                        "asset",
-                        {
-                            "id": str(
-                                uuid.uuid5(
-                                    moduuid, os.path.relpath(image, start=tempdir)
-                                )
-                            ),
-                            "parent": groupid,
-                        },
-                    )
-                else:
-                    asset = ET.SubElement(
-                        module,
-                        "asset",
-                        {
-                            "id": str(
-                                uuid.uuid5(
-                                    moduuid, os.path.relpath(image, start=tempdir)
+                unit = buildcache.unit(
+                    buildcache.key(
+                        "pack",
+                        os.path.relpath(image, start=tempdir),
+                        archive.fingerprint(image),
+                        groupid,
+                        bool(modimage.text),
+                        sorted(
+                            n
+                            for n in os.listdir(packdir)
+                            if n.startswith(os.path.splitext(f)[0].lower())
+                        ),
+                    ),
+                    archive,
+                    [root, packdir],
+                    module,
+                    prefix=os.path.splitext(f)[0].lower(),
+                )
+                if unit.restore() is not None:
+                    if not modimage.text and unit.data.get("image"):
+                        modimage.text = unit.data["image"]
+                    continue
+                with unit:
+                    if groupid:
+                        asset = ET.SubElement(
+                            module,
+                            "asset",
+                            {
+                                "id": str(
+                                    uuid.uuid5(
+                                        moduuid, os.path.relpath(image, start=tempdir)
+                                    )
+                                ),
+                                "parent": groupid,
+                            },
+                        )
+                    else:
+                        asset = ET.SubElement(
+                            module,
+                            "asset",
+                            {
+                                "id": str(
+                                    uuid.uuid5(
+                                        moduuid, os.path.relpath(image, start=tempdir)
+                                    )
                                 )
-                            )
-                        },
-                    )
-                ET.SubElement(asset, "name").text = os.path.splitext(
-                    os.path.basename(image)
-                )[0]
-                tagsEl = ET.SubElement(asset, "tags")
-                tags = re.search(
-                    r"(.*)_(?:tiny|small|medium|large|huge)(?:plus)?_.*",
-                    os.path.splitext(os.path.basename(image))[0],
-                    re.I,
-                )
-                if tags:
-                    tagsEl.text = (
-                        tags.group(1).replace("_", " ").strip()
-                    )
-                else:
+                            },
+                        )
+                    ET.SubElement(asset, "name").text = os.path.splitext(
+                        os.path.basename(image)
+                    )[0]
+                    tagsEl = ET.SubElement(asset, "tags")
                     tags = re.search(
-                        r"(?:VAM)?((.*?)(?:[0-9]+)|(.*))",
+                        r"(.*)_(?:tiny|small|medium|large|huge)(?:plus)?_.*",
                         os.path.splitext(os.path.basename(image))[0],
                         re.I,
                     )
                     if tags:
-                        tag = tags.group(3) or tags.group(2)
-                        tagsEl.text = tag.replace(
-                            "_", " "
-                        ).strip()
-                if (os.path.basename(os.path.split(image)[0]) not in [mod["name"],os.path.basename(dirpath)]):
-                    tagsEl.text += ","+os.path.basename(os.path.split(image)[0])
-                imgext = os.path.splitext(os.path.basename(image))[1]
-                if imgext == ".webm":
-                    try:
-                        if os.path.exists(image):
-                            probe = ffprobe(image)
-                            if args.spritesheets:
-                                if args.gui:
-                                    worker.outputLog(
-                                        " - Converting webm tile to spritesheet"
-                                    )
-                                (sprites, duration, framewidth, frameheight) = spritesheet(ffmpeg_path, probe, image, worker)
-                                ET.SubElement(asset, 'type').text = "spriteSheet"
-                                ET.SubElement(asset, 'frameWidth').text = str(framewidth)
-                                ET.SubElement(asset, 'frameHeight').text = str(frameheight)
-                                ET.SubElement(asset, 'resource').text = os.path.basename(sprites)
-                                ET.SubElement(asset, 'duration').text = str(duration)
-                                shutil.copy(
-                                    sprites, os.path.join(packdir, os.path.basename(sprites))
-                                )
-                            else:
-                                if args.gui:
-                                    worker.outputLog(
-                                        " - Converting webm tile to animated webp"
-                                    )
-                                duration = int(probe["nb_read_frames"])
-                                if probe["codec_name"] != "vp9":
-                                    ffp = subprocess.Popen(
-                                        [
-                                            ffmpeg_path,
-                                            "-v",
-                                            "error",
-                                            "-vcodec",
-                                            "libvpx",
-                                            "-progress",
-                                            "ffmpeg.log",
-                                            "-i",
-                                            image,
-                                            "-loop",
-                                            "0",
-                                            image + ".webp",
-                                        ],
-                                        startupinfo=startupinfo,
-                                        stdout=subprocess.DEVNULL,
-                                        stderr=subprocess.STDOUT,
-                                        stdin=subprocess.DEVNULL,
+                        tagsEl.text = (
+                            tags.group(1).replace("_", " ").strip()
+                        )
+                    else:
+                        tags = re.search(
+                            r"(?:VAM)?((.*?)(?:[0-9]+)|(.*))",
+                            os.path.splitext(os.path.basename(image))[0],
+                            re.I,
+                        )
+                        if tags:
+                            tag = tags.group(3) or tags.group(2)
+                            tagsEl.text = tag.replace(
+                                "_", " "
+                            ).strip()
+                    if (os.path.basename(os.path.split(image)[0]) not in [mod["name"],os.path.basename(dirpath)]):
+                        tagsEl.text += ","+os.path.basename(os.path.split(image)[0])
+                    imgext = os.path.splitext(os.path.basename(image))[1]
+                    if imgext == ".webm":
+                        try:
+                            if os.path.exists(image):
+                                probe = ffprobe(image)
+                                if args.spritesheets:
+                                    if args.gui:
+                                        worker.outputLog(
+                                            " - Converting webm tile to spritesheet"
+                                        )
+                                    (sprites, duration, framewidth, frameheight) = spritesheet(ffmpeg_path, probe, image, worker)
+                                    ET.SubElement(asset, 'type').text = "spriteSheet"
+                                    ET.SubElement(asset, 'frameWidth').text = str(framewidth)
+                                    ET.SubElement(asset, 'frameHeight').text = str(frameheight)
+                                    ET.SubElement(asset, 'resource').text = os.path.basename(sprites)
+                                    ET.SubElement(asset, 'duration').text = str(duration)
+                                    archive.copy(
+                                        sprites, os.path.join(packdir, os.path.basename(sprites))
                                     )
                                 else:
-                                    ffp = subprocess.Popen(
-                                        [
-                                            ffmpeg_path,
-                                            "-v",
-                                            "error",
-                                            "-vcodec",
-                                            "libvpx-vp9",
-                                            "-progress",
-                                            "ffmpeg.log",
-                                            "-i",
-                                            image,
-                                            "-loop",
-                                            "0",
-                                            image + ".webp",
-                                        ],
-                                        startupinfo=startupinfo,
-                                        stdout=subprocess.DEVNULL,
-                                        stderr=subprocess.STDOUT,
-                                        stdin=subprocess.DEVNULL,
-                                    )
+                                    if args.gui:
+                                        worker.outputLog(
+                                            " - Converting webm tile to animated webp"
+                                        )
+                                    duration = int(probe["nb_read_frames"])
+                                    if probe["codec_name"] != "vp9":
+                                        ffp = subprocess.Popen(
+                                            [
+                                                ffmpeg_path,
+                                                "-v",
+                                                "error",
+                                                "-vcodec",
+                                                "libvpx",
+                                                "-progress",
+                                                "ffmpeg.log",
+                                                "-i",
+                                                image,
+                                                "-loop",
+                                                "0",
+                                                image + ".webp",
+                                            ],
+                                            startupinfo=startupinfo,
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.STDOUT,
+                                            stdin=subprocess.DEVNULL,
+                                        )
+                                    else:
+                                        ffp = subprocess.Popen(
+                                            [
+                                                ffmpeg_path,
+                                                "-v",
+                                                "error",
+                                                "-vcodec",
+                                                "libvpx-vp9",
+                                                "-progress",
+                                                "ffmpeg.log",
+                                                "-i",
+                                                image,
+                                                "-loop",
+                                                "0",
+                                                image + ".webp",
+                                            ],
+                                            startupinfo=startupinfo,
+                                            stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.STDOUT,
+                                            stdin=subprocess.DEVNULL,
+                                        )
 
-                                with open("ffmpeg.log", "a+") as f:
-                                    logged = False
-                                    pct = 0
-                                    while ffp.poll() is None:
-                                        l = f.readline()
-                                        m = re.match(r"(.*?)=(.*)", l)
-                                        if m:
-                                            key = m.group(1)
-                                            val = m.group(2)
-                                            if key == "frame":
-                                                if not logged:
+                                    with open("ffmpeg.log", "a+") as f:
+                                        logged = False
+                                        pct = 0
+                                        while ffp.poll() is None:
+                                            l = f.readline()
+                                            m = re.match(r"(.*?)=(.*)", l)
+                                            if m:
+                                                key = m.group(1)
+                                                val = m.group(2)
+                                                if key == "frame":
+                                                    if not logged:
+                                                        print(
+                                                            " webm->webp:    ",
+                                                            file=sys.stderr,
+                                                            end="",
+                                                        )
+                                                        logged = True
+                                                    elif pct >= 100:
+                                                        print("\b", file=sys.stderr, end="")
+                                                    pos = round(float(val) * 100, 2)
+                                                    pct = round(pos / duration)
                                                     print(
-                                                        " webm->webp:    ",
+                                                        "\b\b\b{:02d}%".format(pct),
                                                         file=sys.stderr,
                                                         end="",
                                                     )
-                                                    logged = True
-                                                elif pct >= 100:
-                                                    print("\b", file=sys.stderr, end="")
-                                                pos = round(float(val) * 100, 2)
-                                                pct = round(pos / duration)
-                                                print(
-                                                    "\b\b\b{:02d}%".format(pct),
-                                                    file=sys.stderr,
-                                                    end="",
-                                                )
-                                                if args.gui:
-                                                    worker.updateProgress(pct)
-                                                sys.stderr.flush()
-                                os.remove("ffmpeg.log")
-                            if os.path.exists(image + ".webp"):
-                                ET.SubElement(asset, "type").text = "animatedImage"
-                                image = image + ".webp"
-                                if os.path.exists(
-                                    os.path.join(packdir, os.path.basename(image).lower())
-                                ):
-                                    exist_count = 1
-                                    image_name, image_ext = os.path.splitext(image)
-                                    while os.path.exists(
-                                        os.path.join(
-                                            packdir,
-                                            os.path.basename(
-                                                "{}{}{}".format(
-                                                    image_name, exist_count, image_ext
-                                                )
-                                            ).lower(),
-                                        )
+                                                    if args.gui:
+                                                        worker.updateProgress(pct)
+                                                    sys.stderr.flush()
+                                    os.remove("ffmpeg.log")
+                                if os.path.exists(image + ".webp"):
+                                    ET.SubElement(asset, "type").text = "animatedImage"
+                                    image = image + ".webp"
+                                    if os.path.exists(
+                                        os.path.join(packdir, os.path.basename(image).lower())
                                     ):
-                                        exist_count += 1
-                                    newimage = "{}{}{}".format(
-                                        image_name, exist_count, image_ext
-                                    ).lower()
-                                else:
-                                    newimage = image.lower()
-                                shutil.copy(
-                                    image, os.path.join(packdir, os.path.basename(newimage))
-                                )
-                                size = re.search(
-                                    r"(([0-9]+) ?ft|([0-9]+)[xX]([0-9]+)(?:x([0-9\.]+))?|(tiny|small|medium|large|huge)(x[0-9\.]+)?)", os.path.splitext(os.path.basename(newimage))[0].lower()
-                                )
-                                if size:
-                                    h = 1
-                                    w = 1
-                                    if size.group(2):
-                                        w = max(int(int(size.group(2))/5),1)
-                                    elif size.group(3) and size.group(4):
-                                        w = int(size.group(3))
-                                        h = int(size.group(4))
-                                        if size.group(5):
-                                            ET.SubElement(asset, "scale").text = str(size.group(5))
-                                    elif size.group(6):
-                                        if size.group(5) == "large":
-                                            w = 2
-                                            h = 2
-                                        elif size.group(5) == "huge":
-                                            w = 3
-                                            h = 3
-                                        if size.group(7):
-                                            ET.SubElement(asset, "scale").text = str(size.group(7)) 
-                                    with PIL.Image.open(os.path.join(packdir, os.path.basename(newimage))) as img:
-                                        if img.width == w and img.height == h:
+                                        exist_count = 1
+                                        image_name, image_ext = os.path.splitext(image)
+                                        while os.path.exists(
+                                            os.path.join(
+                                                packdir,
+                                                os.path.basename(
+                                                    "{}{}{}".format(
+                                                        image_name, exist_count, image_ext
+                                                    )
+                                                ).lower(),
+                                            )
+                                        ):
+                                            exist_count += 1
+                                        newimage = "{}{}{}".format(
+                                            image_name, exist_count, image_ext
+                                        ).lower()
+                                    else:
+                                        newimage = image.lower()
+                                    archive.copy(
+                                        image, os.path.join(packdir, os.path.basename(newimage))
+                                    )
+                                    size = re.search(
+                                        r"(([0-9]+) ?ft|([0-9]+)[xX]([0-9]+)(?:x([0-9\.]+))?|(tiny|small|medium|large|huge)(x[0-9\.]+)?)", os.path.splitext(os.path.basename(newimage))[0].lower()
+                                    )
+                                    if size:
+                                        h = 1
+                                        w = 1
+                                        if size.group(2):
+                                            w = max(int(int(size.group(2))/5),1)
+                                        elif size.group(3) and size.group(4):
+                                            w = int(size.group(3))
+                                            h = int(size.group(4))
+                                            if size.group(5):
+                                                ET.SubElement(asset, "scale").text = str(size.group(5))
+                                        elif size.group(6):
+                                            if size.group(5) == "large":
+                                                w = 2
+                                                h = 2
+                                            elif size.group(5) == "huge":
+                                                w = 3
+                                                h = 3
+                                            if size.group(7):
+                                                ET.SubElement(asset, "scale").text = str(size.group(7)) 
+                                        if imageinfo.size(os.path.join(packdir, os.path.basename(newimage))) == (w, h):
                                             w = max(int(w/100),1)
                                             h = max(int(h/100),1)
-                                    ET.SubElement(asset, "size").text = "{}x{}".format(w,h)
-                                ET.SubElement(asset, "resource").text = os.path.basename(
-                                    newimage
-                                )
-                        continue
-                    except Exception:
-                        import traceback
+                                        ET.SubElement(asset, "size").text = "{}x{}".format(w,h)
+                                    ET.SubElement(asset, "resource").text = os.path.basename(
+                                        newimage
+                                    )
+                            continue
+                        except Exception:
+                            import traceback
 
-                        print(traceback.format_exc())
-                        if args.gui:
-                            worker.outputLog(
-                                " - webm tiles are not supported, consider converting to an animated image or a spritesheet: "
-                                + image
+                            print(traceback.format_exc())
+                            if args.gui:
+                                worker.outputLog(
+                                    " - webm tiles are not supported, consider converting to an animated image or a spritesheet: "
+                                    + image
+                                )
+                            print(
+                                " - webm tiles are not supported, consider converting to an animated image or a spritesheet:",
+                                image,
+                                file=sys.stderr,
+                                end="",
                             )
-                        print(
-                            " - webm tiles are not supported, consider converting to an animated image or a spritesheet:",
-                            image,
-                            file=sys.stderr,
-                            end="",
-                        )
-                    continue
-                with PIL.Image.open(image) as img:
-                    if getattr(img, "is_animated", False):
+                        continue
+                    info = imageinfo.require(image)
+                    if info.animated:
                         ET.SubElement(asset, "type").text = "animatedImage"
                     else:
                         ET.SubElement(asset, "type").text = "image"
@@ -2237,7 +2234,7 @@ def convert(args=args, worker=None):
                             h = int(size.group(4))
                             if size.group(5):
                                 ET.SubElement(asset, "scale").text = str(size.group(5))
-                        if img.width == w and img.height == h:
+                        if info.width == w and info.height == h:
                             w = max(int(w/100),1)
                             h = max(int(h/100),1)
                         elif size.group(6):
@@ -2250,118 +2247,106 @@ def convert(args=args, worker=None):
                             if size.group(7):
                                 ET.SubElement(asset, "scale").text = str(size.group(7)) 
                         ET.SubElement(asset, "size").text = "{}x{}".format(w,h)
+                    size = (info.width, info.height)
+                    if info.width > 4096 or info.height > 4096:
+                        size = fit(info.width, info.height, 4095)
                     if imgext == ".webp" and args.jpeg != ".webp":
-                        if img.width > 4096 or img.height > 4096:
-                            scale = (
-                                4095 / img.width
-                                if img.width >= img.height
-                                else 4095 / img.height
-                            )
-                            img = img.resize(
-                                (round(img.width * scale), round(img.height * scale))
-                            )
                         if args.gui:
                             worker.outputLog(" - Converting tile from webp to png")
-                        img.save(
-                            os.path.join(tempdir, os.path.splitext(image)[0] + ".png")
+                        render(
+                            {"src": image, "steps": [("resize", size)]},
+                            os.path.join(tempdir, os.path.splitext(image)[0] + ".png"),
                         )
-                        os.remove(image)
+                        archive.remove(image)
                         image = os.path.join(
                             tempdir, os.path.splitext(image)[0] + ".png"
                         )
                     else:
-                        if img.width > 4096 or img.height > 4096:
-                            scale = (
-                                4095 / img.width
-                                if img.width >= img.height
-                                else 4095 / img.height
-                            )
-                            img = img.resize(
-                                (round(img.width * scale), round(img.height * scale))
-                            )
-                            img.save(os.path.join(tempdir, image))
-                        if (img.width > 512 or img.height > 512) and args.p512:
-                            scale = (
-                                512 / img.width
-                                if img.width >= img.height
-                                else 512 / img.height
+                        if args.p512:
+                            size = fit(size[0], size[1], 512)
+                        if size != (info.width, info.height):
+                            render(
+                                {"src": image, "steps": [("resize", size)]},
+                                os.path.join(tempdir, image),
                             )
-                            img = img.resize(
-                                (round(img.width * scale), round(img.height * scale))
-                            )
-                            img.save(os.path.join(tempdir, image))
-                if os.path.exists(
-                    os.path.join(packdir, os.path.basename(image).lower())
-                ):
-                    exist_count = 1
-                    image_name, image_ext = os.path.splitext(image)
-                    while os.path.exists(
-                        os.path.join(
-                            packdir,
-                            os.path.basename(
-                                "{}{}{}".format(image_name, exist_count, image_ext)
-                            ).lower(),
-                        )
+                    if os.path.exists(
+                        os.path.join(packdir, os.path.basename(image).lower())
                     ):
-                        exist_count += 1
-                    newimage = "{}{}{}".format(
-                        image_name, exist_count, image_ext
-                    ).lower()
-                else:
-                    newimage = image.lower()
-                shutil.copy(image, os.path.join(packdir, os.path.basename(newimage)))
-                ET.SubElement(asset, "resource").text = os.path.basename(newimage)
-                if not modimage.text and "preview" in f.lower():
-                    modimage.text = os.path.basename(newimage)
-    actors = list(
-        filter(
-            lambda actor: actor["_id"]
-            not in [a["_id"] for a in actors if "$$deleted" in a and a["$$deleted"]],
-            actors,
-        )
-    )
-    items = list(
-        filter(
-            lambda item: item["_id"]
-            not in [a["_id"] for a in items if "$$deleted" in a and a["$$deleted"]],
-            items,
-        )
-    )
-    folders = list(
-        filter(
-            lambda folder: folder["_id"]
-            not in [a["_id"] for a in folders if "$$deleted" in a and a["$$deleted"]],
-            folders,
-        )
-    )
-    journal = [] if args.noj else list(
-        filter(
-            lambda j: j["_id"]
-            not in [a["_id"] for a in journal if "$$deleted" in a and a["$$deleted"]],
-            journal,
-        )
-    )
-    maps = list(
-        filter(
-            lambda map: map["_id"]
-            not in [a["_id"] for a in maps if "$$deleted" in a and a["$$deleted"]],
-            maps,
-        )
-    )
-    playlists = list(
-        filter(
-            lambda playlist: playlist["_id"]
-            not in [a["_id"] for a in playlists if "$$deleted" in a and a["$$deleted"]],
-            playlists,
-        )
-    )
-    tables = list(
-        filter(
-            lambda table: table["_id"]
-            not in [a["_id"] for a in tables if "$$deleted" in a and a["$$deleted"]],
-            tables,
-        )
+                        exist_count = 1
+                        image_name, image_ext = os.path.splitext(image)
+                        while os.path.exists(
+                            os.path.join(
+                                packdir,
+                                os.path.basename(
+                                    "{}{}{}".format(image_name, exist_count, image_ext)
+                                ).lower(),
+                            )
+                        ):
+                            exist_count += 1
+                        newimage = "{}{}{}".format(
+                            image_name, exist_count, image_ext
+                        ).lower()
+                    else:
+                        newimage = image.lower()
+                    archive.copy(image, os.path.join(packdir, os.path.basename(newimage)))
+                    ET.SubElement(asset, "resource").text = os.path.basename(newimage)
+                    if not modimage.text and "preview" in f.lower():
+                        modimage.text = os.path.basename(newimage)
+                        unit.data["image"] = modimage.text
+    archive.scan([actors, items, journal, maps, playlists, tables])
+    for pdf in pdfs:
+        archive.referenceMember(pdf)
+    index = EntityIndex()
+    index.add("Actor", actors.stubs() if type(actors) == nedb.DocumentStore else actors)
+    index.add("Item", items.stubs() if type(items) == nedb.DocumentStore else items)
+    index.add("JournalEntry", journal)
+    index.add("Scene", maps)
+    index.add("RollTable", tables)
+
+    def fontTask(family):
+        def task():
+            if family.lower() in solberafonts:
+                return fetcher.fetch(solberafonts[family.lower()])
+            base = "https://raw.githubusercontent.com/google/fonts/master/ofl/{}/".format(
+                urllib.parse.quote(family.lower())
+            )
+            font_family = fonts_public_pb2.FamilyProto()
+            with open(fetcher.fetch(base + "METADATA.pb")) as f:
+                text_format.Merge(f.read(), font_family)
+            return fetcher.fetch(base + font_family.fonts[0].filename)
+
+        return task
+
+    def localFont(family):
+        if archive.member(os.path.join(moduletmp, mod["name"], "fonts", family + ".ttf")):
+            return True
+        try:
+            PIL.ImageFont.truetype(family + ".ttf")
+            return True
+        except Exception:
+            return False
+
+    # Started after the ImagePipeline, whose workers must be forked before
+    # any thread is running
+    fetcher = RemoteFetcher(
+        None if args.nocache else os.path.join(args.cachedir or defaultCacheDir(), "assets"),
+        args.connections,
     )
+    for map in maps:
+        for image in map.get("tiles") or []:
+            if type(image.get("img")) == str and image["img"].startswith("http"):
+                fetcher.prefetch(image["img"])
+        for d in map.get("drawings") or []:
+            if (
+                (d.get("type") == "t" or "text" in d)
+                and d.get("fontFamily")
+                and not localFont(d["fontFamily"])
+            ):
+                fetcher.prefetch(("font", d["fontFamily"]), fontTask(d["fontFamily"]))
+    for media in mod.get("media") or []:
+        url = media.get("url") or media.get("link")
+        if media.get("type") == "cover" and url and urllib.parse.urlparse(url).scheme:
+            fetcher.prefetch(url)
     sort = 1
     for f in sorted(folders, key=lambda f: f["name"] if "name" in f else ""):
         f["sort"] = sort if "sort" not in f or not f["sort"] else f["sort"]
@@ -2396,20 +2381,20 @@ def convert(args=args, worker=None):
                 m.group(5),
             )
         if m.group(2) == "Actor":
-            for a in actors:
-                if a["_id"] == m.group(4):
-                    return '<a href="/monster/{}" {} {} {}>'.format(
-                        slugify(a["name"]), m.group(1), m.group(3), m.group(5)
-                    )
+            a = index.get("Actor", m.group(4))
+            if a:
+                return '<a href="/monster/{}" {} {} {}>'.format(
+                    slugify(a["name"]), m.group(1), m.group(3), m.group(5)
+                )
         return m.group(0)
 
     def fixFTag(m):
         if m.group(1) == "JournalEntry":
-            for j in journal:
-                if j["_id"] == m.group(2) or j["name"] == m.group(2):
-                    return '<a href="/page/{}">{}</a>'.format(
-                        str(uuid.uuid5(moduuid, j["_id"])), m.group(3) or j["name"]
-                    )
+            j = index.find("JournalEntry", m.group(2))
+            if j:
+                return '<a href="/page/{}">{}</a>'.format(
+                    str(uuid.uuid5(moduuid, j["_id"])), m.group(3) or j["name"]
+                )
             return '<a href="/page/{}">{}</a>'.format(
                 str(uuid.uuid5(moduuid, m.group(2))), m.group(3) or "Journal Entry"
             )
@@ -2418,24 +2403,24 @@ def convert(args=args, worker=None):
                 str(uuid.uuid5(moduuid, m.group(2))), m.group(3) or "Roll Table"
             )
         if m.group(1) == "Scene":
-            for map in maps:
-                if map["_id"] == m.group(2) or map["name"] == m.group(2):
-                    return '<a href="/map/{}">{}</a>'.format(
-                        str(uuid.uuid5(moduuid, map["_id"])), m.group(3) or map["name"]
-                    )
+            map = index.find("Scene", m.group(2))
+            if map:
+                return '<a href="/map/{}">{}</a>'.format(
+                    str(uuid.uuid5(moduuid, map["_id"])), m.group(3) or map["name"]
+                )
             return '<a href="/map/{}">{}</a>'.format(
                 str(uuid.uuid5(moduuid, m.group(2))), m.group(3) or "Map"
             )
         if m.group(1) == "Actor":
-            for a in actors:
-                if a["_id"] == m.group(2) or a["name"] == m.group(2):
-                    return '<a href="/monster/{}">{}</a>'.format(
-                        uuid.uuid5(moduuid, a["_id"])
-                        if args.compendium
-                        else slugify(", ".join(a["name"]) if type(a["name"]) == list else a["name"]),
-                        m.group(3) or a["name"],
-                        m.group(3),
-                    )
+            a = index.find("Actor", m.group(2))
+            if a:
+                return '<a href="/monster/{}">{}</a>'.format(
+                    uuid.uuid5(moduuid, a["_id"])
+                    if args.compendium
+                    else slugify(", ".join(a["name"]) if type(a["name"]) == list else a["name"]),
+                    m.group(3) or a["name"],
+                    m.group(3),
+                )
         if m.group(1) == "Compendium" and m.group(3):
             (system, entrytype, idnum) = m.group(2).split(".", 2)
             if args.compendium:
@@ -2449,20 +2434,20 @@ def convert(args=args, worker=None):
                         entrytype = "monster"
                     elif p["name"] == entrytype and p["entity"] == "Item":
                         entrytype = "item"
-                        for i in items:
-                            if i["_id"] == idnum and i["type"].lower() == "spell":
-                                entrytype = "spell"
+                        i = index.get("Item", idnum)
+                        if i and i["type"].lower() == "spell":
+                            entrytype = "spell"
 
             return '<a href="/{}/{}">{}</a>'.format(entrytype, slug, m.group(3))
         if m.group(1) == "Item":
-            for i in items:
-                if i["_id"] == m.group(2) or i["name"] == m.group(2):
-                    return '<a href="/item/{}">{}</a>'.format(
-                        uuid.uuid5(moduuid, i["_id"])
-                        if args.compendium
-                        else slugify(i["name"]),
-                        m.group(3) or i["name"],
-                    )
+            i = index.find("Item", m.group(2))
+            if i:
+                return '<a href="/item/{}">{}</a>'.format(
+                    uuid.uuid5(moduuid, i["_id"])
+                    if args.compendium
+                    else slugify(i["name"]),
+                    m.group(3) or i["name"],
+                )
         if m.group(1) == "Macro":
             if m.group(3):
                 return "<details><summary>{}</summary>This was a Foundry Macro, which cannot be converted.</details>".format(
@@ -2616,11 +2601,8 @@ def convert(args=args, worker=None):
             content.text += "<tr>"
             content.text += "<td><figure>"
             content.text += "<figcaption>{}</figcaption>".format(s["name"])
-            if not os.path.exists(s["path"]) and os.path.exists(
-                os.path.splitext(s["path"])[0] + ".mp4"
-            ):
-                s["path"] = os.path.splitext(s["path"])[0] + ".mp4"
-            if os.path.exists(s["path"]):
+            s["path"] = resolver.resolve(s["path"], "sound", (".mp4",)) or s["path"]
+            if resolver.exists(s["path"]):
                 if magic.from_file(
                     os.path.join(tempdir, urllib.parse.unquote(s["path"])), mime=True
                 ) not in [
@@ -2732,26 +2714,27 @@ def convert(args=args, worker=None):
                     )
                     linkMade = True
                 elif r["collection"] == "Actor":
-                    for a in actors:
-                        if a["_id"] == r["resultId"]:
-                            content.text += '<a href="/monster/{}">{}</a>'.format(
-                                slugify(a["name"]), r["text"]
-                            )
-                            linkMade = True
+                    a = index.get("Actor", r["resultId"])
+                    if a:
+                        content.text += '<a href="/monster/{}">{}</a>'.format(
+                            slugify(a["name"]), r["text"]
+                        )
+                        linkMade = True
                 elif r["collection"] == "Item":
-                    for i in items:
-                        if i["_id"] == r["resultId"]:
-                            content.text += '<a href="/item/{}">{}</a>'.format(
-                                slugify(i["name"]), r["text"]
-                            )
-                            linkMade = True
+                    i = index.get("Item", r["resultId"])
+                    if i:
+                        content.text += '<a href="/item/{}">{}</a>'.format(
+                            slugify(i["name"]), r["text"]
+                        )
+                        linkMade = True
             if not linkMade:
                 content.text += "{}".format(r["text"] if r["text"] else "&nbsp;")
             content.text += "</td>"
-            if "img" in r and os.path.exists(r["img"]):
+            tableimg = resolver.resolve(r.get("img"), "image")
+            if tableimg:
                 content.text += (
                     '<td style="width:50px;height:50px;"><img src="{}"></td>'.format(
-                        r["img"]
+                        tableimg
                     )
                 )
             else:
@@ -2777,15 +2760,16 @@ def convert(args=args, worker=None):
                         end="",
                     )
                 if urllib.parse.urlparse(media['url']).scheme:
-                    urllib.request.urlretrieve(
+                    fetcher.place(
                         media["url"],
                         os.path.join(tempdir, os.path.basename(media["url"]).lower()),
                         progress,
                     )
                 else:
-                    shutil.copy(os.path.join(os.path.join(moduletmp, mod["name"]),media["url"]),os.path.join(tempdir,os.path.basename(media["url"]).lower()))
+                    archive.need(os.path.join(moduletmp, mod["name"], media["url"]))
+                    archive.copy(os.path.join(os.path.join(moduletmp, mod["name"]),media["url"]),os.path.join(tempdir,os.path.basename(media["url"]).lower()))
                 if args.packdir:
-                    shutil.copy(os.path.join(tempdir,os.path.basename(media["url"].lower())),os.path.join(packdir,os.path.basename(media["url"]).lower()))
+                    archive.copy(os.path.join(tempdir,os.path.basename(media["url"].lower())),os.path.join(packdir,os.path.basename(media["url"]).lower()))
                 modimage.text = os.path.basename(media["url"]).lower()
     mapcount = 0
     if len(maps) > 0:
@@ -2804,6 +2788,36 @@ def convert(args=args, worker=None):
             ET.SubElement(group, "slug").text = mapsslug
         else:
             mapgroup = None
+
+        def sceneLinks(map):
+            """Fingerprints the actors and journal entries the tokens and
+            notes of map link to."""
+            tokens = map.get("tokens") or []
+            notes = map.get("notes") or []
+            links = [
+                index.fingerprint(
+                    "Actor",
+                    [t.get("actorId") for t in tokens],
+                    tokenNames=[t.get("name") for t in tokens] if args.compendium else (),
+                ),
+                index.fingerprint(
+                    "JournalEntry",
+                    [n.get("entryId") for n in notes],
+                    [n.get("text") for n in notes],
+                ),
+            ]
+            if args.jrnmap:
+                j = next(
+                    (
+                        j
+                        for j in sorted(journal, key=lambda j: j["name"] if "name" in j else "")
+                        if j["name"].startswith(map["name"])
+                    ),
+                    None,
+                )
+                links.append(j["_id"] if j else None)
+            return links
+
         for map in maps:
             if "$$deleted" in map and map["$$deleted"]:
                 continue
@@ -2811,29 +2825,14 @@ def convert(args=args, worker=None):
                 if args.gui:
                     worker.outputLog("Generating cover image")
                 print("\rGenerating cover image", file=sys.stderr, end="")
-                if not os.path.exists(
-                    urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                ):
-                    if os.path.exists(
-                        os.path.splitext(
-                            urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                        )[0]
-                        + args.jpeg
-                    ):
-                        map["img"] = os.path.splitext(map["img"])[0] + args.jpeg
-                with PIL.Image.open(
-                    urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                ) as img:
-                    if img.width <= img.height:
-                        img = img.crop((0, 0, img.width, img.width))
-                    else:
-                        img = img.crop((0, 0, img.height, img.height))
-                    if img.width > 1024:
-                        img = img.resize((1024, 1024))
-                    if args.jpeg == ".jpg" and img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-                    img.save(os.path.join(tempdir, "module_cover" + args.jpeg))
-                modimage.text = "module_cover" + args.jpeg
+                cover = resolver.resolve(
+                    map["img"] or map["tiles"][0]["img"], "cover", (args.jpeg,)
+                )
+                if cover:
+                    if map["img"]:
+                        map["img"] = cover
+                    createCover(cover, os.path.join(tempdir, "module_cover" + args.jpeg))
+                    modimage.text = "module_cover" + args.jpeg
             if "background" not in map and not map["img"] and len(map["tiles"]) == 0:
                 continue
             mapcount += 1
@@ -2847,7 +2846,29 @@ def convert(args=args, worker=None):
                 file=sys.stderr,
                 end="",
             )
-            createMap(map, mapgroup)
+            unit = buildcache.unit(
+                buildcache.key(
+                    "scene",
+                    map,
+                    mapgroup,
+                    len([i for i in slugs if slugify(map["name"]) in i]),
+                    str(moduuid),
+                    sceneLinks(map),
+                ),
+                archive,
+                None,
+                module,
+            )
+            if unit.restore() is None:
+                count = len(slugs)
+                with unit:
+                    createMap(map, mapgroup)
+                    unit.data = {"map": map, "slugs": slugs[count:]}
+            else:
+                map.clear()
+                map.update(unit.data["map"])
+                slugs.extend(unit.data["slugs"])
+        images.finish()
     while True:
         removed = False
         for g in module.iter("group"):
@@ -2874,39 +2895,17 @@ def convert(args=args, worker=None):
             map = random.choice(maps)
             while "$$deleted" in map and mapcount > 0:
                 map = random.choice(maps)
-            if not os.path.exists(
-                urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-            ):
-                if os.path.exists(
-                    os.path.splitext(
-                        urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                    )[0]
-                    + args.jpeg
-                ):
-                    map["img"] = os.path.splitext(map["img"])[0] + args.jpeg
-                elif os.path.exists(
-                    os.path.splitext(
-                        urllib.parse.unquote(map["img"] or map["tiles"][0]["img"])
-                    )[0]
-                    + ".jpg"
-                ):
-                    map["img"] = os.path.splitext(map["img"])[0] + ".jpg"
-            if os.path.exists(map["img"]):
+            cover = resolver.resolve(
+                map["img"] or map["tiles"][0]["img"], None, (args.jpeg, ".jpg")
+            )
+            if cover and map["img"]:
+                map["img"] = cover
                 randomok = True
         if args.gui:
             worker.outputLog("Generating cover image")
         print("\rGenerating cover image", file=sys.stderr, end="")
         if randomok:
-            with PIL.Image.open(map["img"] or map["tiles"][0]["img"]) as img:
-                if img.width <= img.height:
-                    img = img.crop((0, 0, img.width, img.width))
-                else:
-                    img = img.crop((0, 0, img.height, img.height))
-                if img.width > 1024:
-                    img = img.resize((1024, 1024))
-                if args.jpeg == ".jpg" and img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                img.save(os.path.join(tempdir, "module_cover" + args.jpeg))
+            createCover(map["img"], os.path.join(tempdir, "module_cover" + args.jpeg))
             modimage.text = "module_cover" + args.jpeg
     if len(pdfs) > 0:
         for pdf in pdfs:
@@ -2914,6 +2913,25 @@ def convert(args=args, worker=None):
             ET.SubElement(pdfref,"name").text = os.path.splitext(os.path.basename(pdf))[0]
             ET.SubElement(pdfref,"slug").text = slugify(os.path.splitext(os.path.basename(pdf))[0])
             ET.SubElement(pdfref,"reference").text = urllib.parse.quote(os.path.relpath(os.path.join(moduletmp,mod["name"],pdf),tempdir))
+    print("\033[K", file=sys.stderr, end="")
+    print("\r" + index.report(), file=sys.stderr)
+    if args.gui:
+        worker.outputLog(index.report())
+    if fetcher.futures:
+        print("\r" + fetcher.report(), file=sys.stderr)
+    fetcher.close()
+    if buildcache.hits or buildcache.misses:
+        print("\r" + buildcache.report(), file=sys.stderr)
+        if args.gui:
+            worker.outputLog(buildcache.report())
+    buildcache.close()
+    archive.extractReferenced()
+    print(
+        "\rExtracted {} of {} archive members".format(
+            len(archive.extracted), len(archive.members)
+        ),
+        file=sys.stderr,
+    )
     # write to file
     print("\033[K", file=sys.stderr, end="")
     if args.gui:
@@ -2938,7 +2956,9 @@ def convert(args=args, worker=None):
             os.mkdir(os.path.join(tempdir, "assets"))
         if not os.path.exists(os.path.join(tempdir, "assets", "css")):
             os.mkdir(os.path.join(tempdir, "assets", "css"))
+        archive.needTree(os.path.join(moduletmp, mod["name"], "fonts"))
         for style in mod["styles"]:
+            archive.need(os.path.join(moduletmp, mod["name"], style))
             if os.path.exists(os.path.join(moduletmp, mod["name"], style)):
                 with open(
                     os.path.join(tempdir, "assets", "css", "custom.css"), "a"
@@ -3178,12 +3198,12 @@ def convert(args=args, worker=None):
                 print("Dont know item type", i["type"])
             ET.SubElement(item, "text").text = fixHTMLContent(d["description"]["value"] or "")
             if i["img"]:
-                i["img"] = urllib.parse.unquote(i["img"])
-            if i["img"] and os.path.exists(i["img"]):
+                i["img"] = resolver.resolve(i["img"], "image") or urllib.parse.unquote(i["img"])
+            if i["img"] and resolver.exists(i["img"]):
                 ET.SubElement(item, "image").text = (
                     slugify(i["name"]) + "_" + os.path.basename(i["img"])
                 )
-                shutil.copy(
+                archive.copy(
                     i["img"],
                     os.path.join(
                         tempdir,
@@ -3367,8 +3387,8 @@ def convert(args=args, worker=None):
                     "environment"
                 ]
             if a["img"]:
-                a["img"] = urllib.parse.unquote(a["img"])
-            if a["img"] and os.path.exists(a["img"]):
+                a["img"] = resolver.resolve(a["img"], "image") or urllib.parse.unquote(a["img"])
+            if a["img"] and resolver.exists(a["img"]):
                 if os.path.splitext(a["img"])[1] == ".webp" and args.jpeg != ".webp":
                     PIL.Image.open(a["img"]).save(
                         os.path.join(
@@ -3380,7 +3400,7 @@ def convert(args=args, worker=None):
                             + args.jpeg,
                         )
                     )
-                    os.remove(a["img"])
+                    archive.remove(a["img"])
                     ET.SubElement(monster, "image").text = (
                         slugify(a["name"])
                         + "_"
@@ -3391,7 +3411,7 @@ def convert(args=args, worker=None):
                     ET.SubElement(monster, "image").text = (
                         slugify(a["name"]) + "_" + os.path.basename(a["img"])
                     )
-                    shutil.copy(
+                    archive.copy(
                         a["img"],
                         os.path.join(
                             tempdir,
@@ -3400,8 +3420,8 @@ def convert(args=args, worker=None):
                         ),
                     )
             if a["token"]["img"]:
-                a["token"]["img"] = urllib.parse.unquote(a["token"]["img"])
-            if a["token"]["img"] and os.path.exists(a["token"]["img"]):
+                a["token"]["img"] = resolver.resolve(a["token"]["img"], "token") or urllib.parse.unquote(a["token"]["img"])
+            if a["token"]["img"] and resolver.exists(a["token"]["img"]):
                 if (
                     os.path.splitext(a["token"]["img"])[1] == ".webp"
                     and args.jpeg != ".webp"
@@ -3417,7 +3437,7 @@ def convert(args=args, worker=None):
                             + ".png",
                         )
                     )
-                    os.remove(a["token"]["img"])
+                    archive.remove(a["token"]["img"])
                     ET.SubElement(monster, "token").text = (
                         "token_"
                         + slugify(a["name"])
@@ -3432,7 +3452,7 @@ def convert(args=args, worker=None):
                         + "_"
                         + os.path.basename(a["token"]["img"])
                     )
-                    shutil.copy(
+                    archive.copy(
                         a["token"]["img"],
                         os.path.join(
                             tempdir,
@@ -3485,6 +3505,10 @@ def convert(args=args, worker=None):
             short_empty_elements=False,
             encoding="utf-8",
         )
+    print("\033[K", file=sys.stderr, end="")
+    print("\r" + resolver.report(), file=sys.stderr)
+    if args.gui:
+        worker.outputLog(resolver.report())
     os.chdir(cwd)
     if args.gui:
         worker.updateProgress(90)
@@ -3496,7 +3520,11 @@ def convert(args=args, worker=None):
     # zipfile = shutil.make_archive("module","zip",tempdir)
     if args.output:
         zipfilename = args.output
+    for docs in (actors, items):
+        if type(docs) == nedb.DocumentStore:
+            docs.close()
     zippos = 0
+    passthrough = 0
     with zipfile.ZipFile(
         zipfilename, "w", compression=zipfile.ZIP_DEFLATED
     ) as zipObj:
@@ -3515,12 +3543,28 @@ def convert(args=args, worker=None):
                 # create complete filepath of file in directory
                 filePath = os.path.join(folderName, filename)
                 # Add file to zip
+                if filePath in (
+                    os.path.join(tempdir, "module.zip"),
+                    os.path.join(tempdir, "manifest.json"),
+                ):
+                    continue
                 print("\033[K", file=sys.stderr, end="")
                 print("\rAdding: {}".format(filename), file=sys.stderr, end="")
-                zipObj.write(
+                if archive.write(
+                    zipObj,
                     filePath,
                     filename if args.packdir else os.path.relpath(filePath, tempdir),
-                )
+                ):
+                    passthrough += 1
+    archive.close()
+    if os.path.exists(os.path.join(tempdir, "module.zip")):
+        os.remove(os.path.join(tempdir, "module.zip"))
+        os.remove(os.path.join(tempdir, "manifest.json"))
+    if passthrough:
+        print(
+            "\rCopied {} unchanged assets without recompressing".format(passthrough),
+            file=sys.stderr,
+        )
     print("\033[K", file=sys.stderr, end="")
     print("\rDeleteing temporary files", file=sys.stderr, end="")
     # shutil.rmtree(tempdir)
@@ -3530,6 +3574,46 @@ def convert(args=args, worker=None):
     if args.gui:
         worker.updateProgress(100)
         worker.outputLog("Finished.")
+    return zipfilename
+
+
+def watch(args=args):
+    """Converts the source folder, then converts it again each time its files
+    change. Scenes and assets whose inputs did not change are taken from the
+    build cache, so only the edited ones are converted again."""
+    global tempdir
+    watcher = SourceWatcher(args.srcfile, ignore=[args.output] if args.output else [])
+    cwd = os.getcwd()
+    while True:
+        started = time.time()
+        tempdir = tempfile.mkdtemp(prefix="convertfoundry_")
+        workdir = tempdir
+        try:
+            output = convert(argparse.Namespace(**vars(args)))
+            if output:
+                watcher.ignore.add(os.path.abspath(output))
+        except Exception:
+            import traceback
+
+            print(traceback.format_exc(), file=sys.stderr)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(workdir, ignore_errors=True)
+            tempdir = None
+        print(
+            "\r{} in {:.1f}s, watching {} for changes".format(
+                "Checked" if args.audit else "Converted", time.time() - started, args.srcfile
+            ),
+            file=sys.stderr,
+        )
+        changed = watcher.wait()
+        print(
+            "\rChanged: {}{}".format(
+                ", ".join(changed[:5]),
+                " and {} more".format(len(changed) - 5) if len(changed) > 5 else "",
+            ),
+            file=sys.stderr,
+        )
 
 
 if args.gui:
@@ -3571,7 +3655,8 @@ if args.gui:
 
         def run(self):
             try:
-                convert(args, self)
+                if not convert(args, self):
+                    self.message.emit("No module was written.")
             except Exception:
                 import traceback
 
@@ -3616,13 +3701,33 @@ if args.gui:
                     manifest = json.load(f)
                 self.sendMessage("Downloading: {}".format(manifest["title"]))
 
+                started = time.time()
+                reported = [started]
+
                 def progress(block_num, block_size, total_size):
                     pct = 100.00 * ((block_num * block_size) / total_size)
                     self.updateProgress(pct)
+                    if time.time() - reported[0] >= 1:
+                        reported[0] = time.time()
+                        rate = (block_num * block_size) / (reported[0] - started) / 1024 / 1024
+                        self.sendMessage(
+                            "Downloading: {} ({:.1f} MB/s)".format(manifest["title"], rate)
+                        )
 
-                urllib.request.urlretrieve(
-                    manifest["download"], os.path.join(tempdir, "module.zip"), progress
-                )
+                if args.nocache:
+                    RangedDownload(
+                        manifest["download"],
+                        os.path.join(tempdir, "module.zip"),
+                        args.connections,
+                    ).run(progress)
+                else:
+                    DownloadCache(args.cachedir, args.cachesize * 1024 * 1024).fetch(
+                        self.manifesturl,
+                        manifest,
+                        os.path.join(tempdir, "module.zip"),
+                        progress,
+                        args.connections,
+                    )
                 self.sendMessage("DONE")
             except Exception as e:
                 self.sendMessage("An error occurred downloading the manifest:" + str(e))
@@ -3838,16 +3943,11 @@ if args.gui:
             self.settings.setValue("last_path", os.path.split(fileName[0])[0])
             self.settings.sync()
             with zipfile.ZipFile(fileName[0]) as z:
-                isworld = False
                 mod = None
-                for filename in z.namelist():
-                    if os.path.basename(filename) == "world.json":
-                        with z.open(filename) as f:
-                            mod = json.load(f)
-                        isworld = True
-                    elif not mod and os.path.basename(filename) == "module.json":
-                        with z.open(filename) as f:
-                            mod = json.load(f)
+                (modfile, isworld) = ZipIndex(z).manifest(("module.json",))
+                if modfile:
+                    with z.open(modfile) as f:
+                        mod = json.load(f)
             if mod:
                 if "name" not in mod and "id" in mod:
                     mod["name"] = mod["id"]
@@ -3903,14 +4003,10 @@ if args.gui:
         def selectPack(self):
             paths = []
             with zipfile.ZipFile(self.foundryFile) as z:
-                dirpath = ""
-                for filename in z.namelist():
-                    if os.path.basename(filename) == "world.json":
-                        dirpath = os.path.dirname(filename)
-                    elif os.path.basename(filename) == "module.json":
-                        dirpath = os.path.dirname(filename)
-                for filename in z.namelist():
-                    parent, f = os.path.split(filename)
+                zipindex = ZipIndex(z)
+                (modfile, isworld) = zipindex.manifest(("module.json",))
+                dirpath = os.path.dirname(modfile) if modfile else ""
+                for parent in zipindex.directories():
                     if parent.startswith(dirpath):
                         parent = parent[len(dirpath):]
                         if parent.startswith("/"):
@@ -3944,19 +4040,11 @@ if args.gui:
             elif message == "DONE":
                 self.progress.setVisible(False)
                 with zipfile.ZipFile(os.path.join(tempdir, "module.zip")) as z:
-                    isworld = False
                     mod = None
-                    for filename in z.namelist():
-                        if os.path.basename(filename) == "world.json":
-                            with z.open(filename) as f:
-                                mod = json.load(f)
-                            isworld = True
-                        elif not mod and os.path.basename(filename) == "module.json":
-                            with z.open(filename) as f:
-                                mod = json.load(f)
-                        elif not mod and os.path.basename(filename) == "system.json":
-                            with z.open(filename) as f:
-                                mod = json.load(f)
+                    (modfile, isworld) = ZipIndex(z).manifest()
+                    if modfile:
+                        with z.open(modfile) as f:
+                            mod = json.load(f)
                 if mod:
                     if "name" not in mod and "id" in mod:
                         mod["name"] = mod["id"]
@@ -4062,4 +4150,10 @@ if args.gui:
     gui = GUI()
     app.exec_()
 elif __name__ == '__main__':
-    convert()
+    if args.watch:
+        try:
+            watch()
+        except KeyboardInterrupt:
+            print("", file=sys.stderr)
+    else:
+        convert()
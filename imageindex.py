@@ -0,0 +1,96 @@
+import collections
+import concurrent.futures
+import os
+
+import PIL.Image
+
+from archive import IMAGE_EXTENSIONS
+
+ImageInfo = collections.namedtuple(
+    "ImageInfo", ["width", "height", "mode", "alpha", "animated", "format"]
+)
+
+
+def readInfo(f):
+    """Reads an ImageInfo from the header of an open image file."""
+    with PIL.Image.open(f) as img:
+        return ImageInfo(
+            img.width,
+            img.height,
+            img.mode,
+            img.mode in ("RGBA", "LA", "PA", "RGBa", "La")
+            or "transparency" in img.info,
+            bool(getattr(img, "is_animated", False)),
+            img.format,
+        )
+
+
+class ImageIndex:
+    """Header metadata of the images in a ModuleArchive.
+
+    build() reads the headers of every image member straight out of the
+    archive on a pool of threads, without extracting anything or decoding
+    pixels. get() answers from the index while the member is unchanged on
+    disk, and reads the header of anything else, like converter output or a
+    member rewritten in place, from disk, keyed by its size and mtime.
+    """
+
+    def __init__(self, archive, threads=8):
+        self.archive = archive
+        self.threads = threads
+        self.members = {}
+        self.files = {}
+
+    def read(self, local):
+        try:
+            with self.archive.open(local) as f:
+                return readInfo(f)
+        except Exception:
+            return None
+
+    def build(self):
+        locals = [
+            local
+            for local in self.archive.members
+            if os.path.splitext(local)[1].lower() in IMAGE_EXTENSIONS
+            and local not in self.members
+        ]
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+            for (local, info) in zip(locals, pool.map(self.read, locals)):
+                self.members[local] = info
+        return len(locals)
+
+    def get(self, path):
+        """Returns the ImageInfo of the image at path, or None when it is
+        missing or isn't an image."""
+        local = os.path.normpath(os.path.abspath(path))
+        if local in self.archive.members and local not in self.archive.removed:
+            if local not in self.archive.extracted or self.archive.unchanged(local):
+                if local not in self.members:
+                    self.members[local] = self.read(local)
+                return self.members[local]
+        try:
+            st = os.stat(local)
+        except OSError:
+            return None
+        stamp = (st.st_size, st.st_mtime_ns)
+        if local not in self.files or self.files[local][0] != stamp:
+            try:
+                with open(local, "rb") as f:
+                    self.files[local] = (stamp, readInfo(f))
+            except Exception:
+                self.files[local] = (stamp, None)
+        return self.files[local][1]
+
+    def require(self, path):
+        """Returns the ImageInfo of the image at path, raising the error
+        opening it with PIL would when there is none."""
+        info = self.get(path)
+        if not info:
+            with PIL.Image.open(path):
+                pass
+        return info
+
+    def size(self, path):
+        info = self.require(path)
+        return (info.width, info.height)
@@ -0,0 +1,387 @@
+import heapq
+import io
+import json
+import posixpath
+import re
+import shutil
+import struct
+import tempfile
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+BLOCK_SIZE = 32768
+TABLE_MAGIC = 0xDB4775248B80FB57
+TYPE_DELETION = 0
+TYPE_VALUE = 1
+
+
+def varint(data, pos):
+    result = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return (result, pos)
+        shift += 7
+
+
+def lengthPrefixed(data, pos):
+    (length, pos) = varint(data, pos)
+    return (bytes(data[pos:pos + length]), pos + length)
+
+
+def uncompress(data):
+    """Snappy raw block decompression."""
+    if snappy:
+        return snappy.uncompress(bytes(data))
+    (length, pos) = varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            n = tag >> 2
+            if n >= 60:
+                extra = n - 59
+                n = int.from_bytes(data[pos:pos + extra], "little")
+                pos += extra
+            n += 1
+            out += data[pos:pos + n]
+            pos += n
+            continue
+        if kind == 1:
+            n = ((tag >> 2) & 7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 2], "little")
+            pos += 2
+        else:
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos + 4], "little")
+            pos += 4
+        if offset == 0 or offset > len(out):
+            raise ValueError("Corrupt snappy block")
+        start = len(out) - offset
+        if offset >= n:
+            out += out[start:start + n]
+        else:
+            out += (out[start:] * (n // offset + 1))[:n]
+    if len(out) != length:
+        raise ValueError("Corrupt snappy block")
+    return bytes(out)
+
+
+def logRecords(f):
+    """Reassembles the records of a LevelDB log or MANIFEST file, reading it
+    one block at a time."""
+    record = bytearray()
+    data = f.read(BLOCK_SIZE)
+    while data:
+        pos = 0
+        while pos + 7 <= len(data):
+            (length, kind) = struct.unpack_from("<HB", data, pos + 4)
+            if kind == 0 and length == 0:
+                break
+            fragment = data[pos + 7:pos + 7 + length]
+            pos += 7 + length
+            if len(fragment) < length:
+                return
+            if kind == 1:
+                yield bytes(fragment)
+                record = bytearray()
+            elif kind == 2:
+                record = bytearray(fragment)
+            elif kind == 3:
+                record += fragment
+            elif kind == 4:
+                record += fragment
+                yield bytes(record)
+                record = bytearray()
+        data = f.read(BLOCK_SIZE)
+
+
+def batchEntries(batch):
+    """Yields (key, sequence, type, value) from a WriteBatch."""
+    (sequence, count) = struct.unpack_from("<QI", batch, 0)
+    pos = 12
+    for i in range(count):
+        kind = batch[pos]
+        pos += 1
+        (key, pos) = lengthPrefixed(batch, pos)
+        value = None
+        if kind == TYPE_VALUE:
+            (value, pos) = lengthPrefixed(batch, pos)
+        yield (key, sequence + i, kind, value)
+
+
+def blockEntries(block):
+    """Yields (key, value) from a table block with its prefix compression
+    undone."""
+    (restarts,) = struct.unpack_from("<I", block, len(block) - 4)
+    end = len(block) - 4 - 4 * restarts
+    pos = 0
+    key = b""
+    while pos < end:
+        (shared, pos) = varint(block, pos)
+        (unshared, pos) = varint(block, pos)
+        (length, pos) = varint(block, pos)
+        key = key[:shared] + bytes(block[pos:pos + unshared])
+        pos += unshared
+        yield (key, block[pos:pos + length])
+        pos += length
+
+
+def tableEntries(f, start=b""):
+    """Yields (key, sequence, type, value) from an SSTable in key order,
+    reading one data block at a time and skipping the blocks whose keys all
+    sort before start."""
+    size = f.seek(0, 2)
+    f.seek(size - 48)
+    footer = f.read(48)
+    if struct.unpack_from("<Q", footer, 40)[0] != TABLE_MAGIC:
+        raise ValueError("Not an SSTable")
+    (offset, pos) = varint(footer, 0)
+    (size, pos) = varint(footer, pos)
+    (offset, pos) = varint(footer, pos)
+    (size, pos) = varint(footer, pos)
+    handles = [
+        bytes(handle)
+        for (separator, handle) in blockEntries(readBlock(f, offset, size))
+        if separator[:-8] >= start
+    ]
+    for handle in handles:
+        (blockOffset, pos) = varint(handle, 0)
+        (blockSize, pos) = varint(handle, pos)
+        for (key, value) in blockEntries(readBlock(f, blockOffset, blockSize)):
+            (tag,) = struct.unpack_from("<Q", key, len(key) - 8)
+            yield (key[:-8], tag >> 8, tag & 0xFF, bytes(value))
+
+
+def readBlock(f, offset, size):
+    f.seek(offset)
+    data = f.read(size + 1)
+    if len(data) < size + 1:
+        raise ValueError("Truncated SSTable block")
+    compression = data[size]
+    if compression == 0:
+        return memoryview(data)[:size]
+    if compression == 1:
+        return memoryview(uncompress(memoryview(data)[:size]))
+    raise ValueError("Unsupported block compression {}".format(compression))
+
+
+def order(entry):
+    """Sorts (key, sequence, ...) entries like LevelDB's internal keys: by
+    key, then newest first."""
+    return (entry[0], -entry[1])
+
+
+def splitKey(key):
+    """Splits a Foundry key like !journal.pages!<journal>.<page> into its
+    collection and ids, or returns None for keys of another shape."""
+    m = re.match(r"^!([^!]+)!(.+)$", key.decode("utf8"))
+    if not m:
+        return None
+    return (tuple(m.group(1).split(".")), tuple(m.group(2).split(".")))
+
+
+class Sublevel:
+    """Cursor over the embedded documents of one sublevel, like
+    !journal.pages!, handing them out by parent.
+
+    Keys sort by the ids of the parent first, so as long as the parents are
+    visited in key order each embedded document is read once, and only the
+    children of the current parent are held in memory.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.current = self.advance()
+        self.exists = self.current is not None
+
+    def advance(self):
+        for (key, value) in self.items:
+            split = splitKey(key)
+            if split:
+                return (".".join(split[1][:-1]), split[1][-1], value)
+        return None
+
+    def children(self, ids):
+        """Returns the embedded documents under the parent with ids, by id,
+        skipping any whose parent sorts before it."""
+        parent = ".".join(ids)
+        found = {}
+        while self.current and self.current[0] <= parent:
+            if self.current[0] == parent:
+                found[self.current[1]] = json.loads(self.current[2])
+            self.current = self.advance()
+        return found
+
+
+class LevelDB:
+    """Read-only view of a LevelDB database stored in a directory of a zip.
+
+    Tables and logs are read straight from the archive. When CURRENT and its
+    MANIFEST are present only the live files are used, otherwise every table
+    and log in the directory is merged by sequence number. Members of a zip
+    are decompressed once into temporary files, since the merge seeks around
+    in every table, until close().
+    """
+
+    def __init__(self, z, path, names=None):
+        self.z = z
+        self.path = path.rstrip("/")
+        if names is None:
+            names = [
+                posixpath.basename(n)
+                for n in z.namelist()
+                if posixpath.dirname(n) == self.path
+            ]
+        self.names = set(names)
+        self.files = {}
+
+    def open(self, name):
+        """Returns a seekable file for name, positioned at its start."""
+        if name not in self.files:
+            f = self.z.open(self.path + "/" + name)
+            if not isinstance(f, io.BufferedReader):
+                spool = tempfile.TemporaryFile(prefix="convertfoundry_leveldb_")
+                with f:
+                    shutil.copyfileobj(f, spool, 1024 * 1024)
+                f = spool
+            self.files[name] = f
+        self.files[name].seek(0)
+        return self.files[name]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def liveFiles(self):
+        tables = [n for n in self.names if re.match(r"^\d+\.(ldb|sst)$", n)]
+        logs = [n for n in self.names if re.match(r"^\d+\.log$", n)]
+        if "CURRENT" not in self.names:
+            return (tables, logs)
+        manifest = self.open("CURRENT").read().decode("utf8").strip()
+        if manifest not in self.names:
+            return (tables, logs)
+        live = set()
+        logNumber = prevLogNumber = 0
+        for edit in logRecords(self.open(manifest)):
+            pos = 0
+            while pos < len(edit):
+                (tag, pos) = varint(edit, pos)
+                if tag == 1:
+                    (comparator, pos) = lengthPrefixed(edit, pos)
+                elif tag == 2:
+                    (logNumber, pos) = varint(edit, pos)
+                elif tag in (3, 4):
+                    (number, pos) = varint(edit, pos)
+                elif tag == 5:
+                    (level, pos) = varint(edit, pos)
+                    (key, pos) = lengthPrefixed(edit, pos)
+                elif tag == 6:
+                    (level, pos) = varint(edit, pos)
+                    (number, pos) = varint(edit, pos)
+                    live.discard(number)
+                elif tag == 7:
+                    (level, pos) = varint(edit, pos)
+                    (number, pos) = varint(edit, pos)
+                    (size, pos) = varint(edit, pos)
+                    (smallest, pos) = lengthPrefixed(edit, pos)
+                    (largest, pos) = lengthPrefixed(edit, pos)
+                    live.add(number)
+                elif tag == 9:
+                    (prevLogNumber, pos) = varint(edit, pos)
+                else:
+                    raise ValueError("Unknown MANIFEST tag {}".format(tag))
+        return (
+            [n for n in tables if int(n.split(".")[0]) in live],
+            [
+                n
+                for n in logs
+                if int(n.split(".")[0]) >= logNumber
+                or int(n.split(".")[0]) == prevLogNumber
+            ],
+        )
+
+    def table(self, name, start):
+        yield from tableEntries(self.open(name), start)
+
+    def items(self, prefix=b""):
+        """Yields the newest value of every live key starting with prefix, in
+        key order.
+
+        The tables, each already sorted, are merged a block at a time. Only
+        the log, which LevelDB keeps to a few megabytes before writing it out
+        as a table, is collected and sorted in memory.
+        """
+        (tables, logs) = self.liveFiles()
+        pending = []
+        for name in sorted(logs):
+            for batch in logRecords(self.open(name)):
+                pending.extend(
+                    e for e in batchEntries(batch) if e[0].startswith(prefix)
+                )
+        pending.sort(key=order)
+        streams = [self.table(name, prefix) for name in sorted(tables)]
+        previous = None
+        for (key, sequence, kind, value) in heapq.merge(
+            iter(pending), *streams, key=order
+        ):
+            if not key.startswith(prefix):
+                if key > prefix:
+                    break
+                continue
+            if key == previous:
+                continue
+            previous = key
+            if kind == TYPE_VALUE:
+                yield (key, value)
+
+    def documents(self):
+        """Yields (collection, document) for each top level Foundry document.
+
+        Foundry stores embedded documents under keys like
+        !journal.pages!<journal>.<page> and keeps only their ids in the parent,
+        so those are put back in place of the ids. Top level documents are
+        read in key order, each sublevel is read alongside them by a Sublevel
+        cursor, and every document is yielded as soon as it is complete.
+        """
+        cursors = {}
+        try:
+            for (key, value) in self.items():
+                split = splitKey(key)
+                if split and len(split[0]) == 1:
+                    yield (
+                        split[0][0],
+                        self.embed(cursors, split[0], split[1], json.loads(value)),
+                    )
+        finally:
+            self.close()
+
+    def embed(self, cursors, collection, ids, doc):
+        for field in doc:
+            if type(doc[field]) != list or not doc[field]:
+                continue
+            sublevel = collection + (field,)
+            if sublevel not in cursors:
+                cursors[sublevel] = Sublevel(
+                    self.items("!{}!".format(".".join(sublevel)).encode("utf8"))
+                )
+            if not cursors[sublevel].exists:
+                continue
+            children = cursors[sublevel].children(ids)
+            for (childId, child) in children.items():
+                self.embed(cursors, sublevel, ids + (childId,), child)
+            doc[field] = [children.get(v, v) if type(v) == str else v for v in doc[field]]
+            doc[field] = [v for v in doc[field] if type(v) == dict]
+        return doc
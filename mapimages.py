@@ -0,0 +1,375 @@
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import PIL.Image
+
+
+def fit(width, height, limit):
+    """Returns width x height scaled down so neither side is over limit."""
+    if width > limit or height > limit:
+        scale = limit / width if width >= height else limit / height
+        return (round(width * scale), round(height * scale))
+    return (width, height)
+
+
+class MapPlan:
+    """Plans how a map image becomes the background of a scene.
+
+    From the size in the image header and the scene's width and height it
+    works out the final size, stretching the image to the scene's aspect
+    ratio and fitting it within limit, so the pixels are resampled once. It
+    also works out the scale and rescale the rest of the scene is converted
+    with.
+    """
+
+    def __init__(self, source, width, height, rescale=1.0, limit=8192):
+        self.source = tuple(source)
+        self.stretched = width / height != self.source[0] / self.source[1]
+        size = (width, height) if self.stretched else self.source
+        self.size = fit(size[0], size[1], limit)
+        self.fitted = self.size != size
+        self.scale = 1.0
+        self.rescale = rescale
+        if self.size != (width, height):
+            self.scale = max(width / self.size[0], height / self.size[1])
+            if self.scale > 1.25:
+                self.scale = 1.0
+                self.rescale = max(self.size[0] / width, self.size[1] / height)
+
+    def steps(self):
+        return [("resize", self.size)] if self.size != self.source else []
+
+
+# Bytes of intermediate buffers a resample may use for each strip of output.
+STRIP = 32 * 1024 * 1024
+
+
+def fold(steps, size):
+    """Folds resize and crop steps on an image of size into one resample.
+    Returns the output size and the box of the source it covers, or None
+    when a crop reaches outside the image."""
+    box = (0.0, 0.0, float(size[0]), float(size[1]))
+    for (op, arg) in steps:
+        if op == "resize":
+            size = tuple(arg)
+            continue
+        sx = (box[2] - box[0]) / size[0]
+        sy = (box[3] - box[1]) / size[1]
+        if arg[0] < 0 or arg[1] < 0 or arg[2] > size[0] or arg[3] > size[1]:
+            return None
+        box = (
+            box[0] + arg[0] * sx,
+            box[1] + arg[1] * sy,
+            box[0] + arg[2] * sx,
+            box[1] + arg[3] * sy,
+        )
+        size = (arg[2] - arg[0], arg[3] - arg[1])
+    return (size, box)
+
+
+def draft(img, size, box=None):
+    """Lets a JPEG skip the detail a resample of box to size would throw
+    away, by decoding it at the smallest power of two scale that still
+    leaves box at least size. Call it before the image is loaded. Returns
+    box, or the whole image, in the coordinates of the decoded image."""
+    (w, h) = img.size
+    box = box or (0, 0, w, h)
+    if img.format != "JPEG" or img.mode not in ("L", "RGB", "CMYK"):
+        return box
+    img.draft(
+        img.mode,
+        (
+            math.ceil(size[0] * w / (box[2] - box[0])),
+            math.ceil(size[1] * h / (box[3] - box[1])),
+        ),
+    )
+    (sx, sy) = (img.width / w, img.height / h)
+    return (box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy)
+
+
+def resample(img, size, box, out=None, position=(0, 0), limit=STRIP):
+    """Resizes box of img to size in horizontal strips and pastes them into
+    out at position, or into a new image. Each strip is resized from a crop
+    of the rows under it, with enough margin for the filter, so apart from
+    the decoded source and the output only about limit bytes are used."""
+    if img.mode in ("1", "P"):
+        part = img.resize(size, box=box)
+        if out is None:
+            return part
+        out.paste(part, position)
+        return out
+    if out is None:
+        out = PIL.Image.new(img.mode, size)
+    (w, h) = size
+    sx = (box[2] - box[0]) / w
+    sy = (box[3] - box[1]) / h
+    marginX = math.ceil(2 * max(sx, 1.0)) + 1
+    marginY = math.ceil(2 * max(sy, 1.0)) + 1
+    rowBytes = 4 * ((box[2] - box[0] + 2 * marginX) * 2 + w) * max(sy, 1.0) + 4 * w
+    rows = max(1, int(limit // rowBytes))
+    x0 = max(0, math.floor(box[0]) - marginX)
+    x1 = min(img.width, math.ceil(box[2]) + marginX)
+    for y in range(0, h, rows):
+        n = min(rows, h - y)
+        top = box[1] + y * sy
+        bottom = box[1] + (y + n) * sy
+        y0 = max(0, math.floor(top) - marginY)
+        y1 = min(img.height, math.ceil(bottom) + marginY)
+        with img.crop((x0, y0, x1, y1)) as part:
+            strip = part.resize((w, n), box=(box[0] - x0, top - y0, box[2] - x0, bottom - y0))
+        out.paste(strip, (position[0], position[1] + y))
+        strip.close()
+    return out
+
+
+def load(job, out=None, position=(0, 0)):
+    """Builds the image a job describes. A job is a dict with either src, the
+    absolute path of an image, or mode, size and color for a blank canvas,
+    then steps, a list of ("resize", size) and ("crop", box) applied in
+    order, and layers, a list of (job, position) pasted on top. The steps
+    are done as one resample, pasted straight into out when it is given."""
+    if job.get("src"):
+        img = PIL.Image.open(job["src"])
+    else:
+        img = PIL.Image.new(job["mode"], tuple(job["size"]), color=job.get("color", 0))
+    steps = job.get("steps", ())
+    folded = fold(steps, img.size) if steps else None
+    if folded and (folded[0] != img.size or folded[1] != (0, 0) + img.size):
+        box = draft(img, folded[0], folded[1])
+        with img:
+            img = resample(img, folded[0], box, out, position)
+    else:
+        if not folded:
+            for (op, arg) in steps:
+                img = getattr(img, op)(tuple(arg))
+        if out is not None:
+            with img:
+                out.paste(img, tuple(position))
+            img = out
+    for (layer, position) in job.get("layers", ()):
+        load(layer, img, tuple(position))
+    return img
+
+
+def render(job, dest):
+    with load(job) as img:
+        img.save(dest)
+    return dest
+
+
+def absolute(job):
+    job = dict(job)
+    if job.get("src"):
+        job["src"] = os.path.abspath(job["src"])
+    job["layers"] = [(absolute(l), p) for (l, p) in job.get("layers", ())]
+    return job
+
+
+class ImagePipeline:
+    """Renders map images in worker processes while scenes are converted.
+
+    The converter works out the final size of each image from its header
+    and submits the resize, crop and format conversion as a job, so the XML
+    for a scene doesn't wait for the pixels. Jobs write to a staging folder
+    outside the work directory. finish() moves the results into place,
+    removes the sources they replace, and completes the build cache units
+    that submitted them. With one job, or where fork isn't available, the
+    images are rendered in this process. The workers are forked when the
+    pipeline is created, so create it before starting any threads: a child
+    forked while another thread holds a lock can hang on that lock. Sizes
+    of existing images come from index, an ImageIndex, when one is given.
+    Worker jobs are started only while the memory they are estimated to
+    need, their decoded sources and output, stays within budget bytes,
+    though a job larger than the budget still runs once nothing else does.
+    """
+
+    def __init__(self, archive, cache=None, jobs=1, index=None, budget=None):
+        if jobs > 1 and (
+            sys.platform == "darwin"
+            or "fork" not in multiprocessing.get_all_start_methods()
+        ):
+            jobs = 1
+        self.archive = archive
+        self.cache = cache
+        self.jobs = jobs
+        self.index = index
+        self.budget = budget
+        self.running = {}
+        self.pool = None
+        if jobs > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context=multiprocessing.get_context("fork")
+            )
+            # Fork the workers now rather than on the first job
+            self.pool.submit(int).result()
+        self.staging = None
+        self.queue = []
+        self.submitted = 0
+        self.outputs = {}
+        self.units = []
+
+    def submit(self, job, dest, size, remove=None):
+        """Queues job to be saved to dest, which is size once rendered.
+        remove is a source file to delete when dest is in place."""
+        dest = os.path.abspath(dest)
+        remove = os.path.abspath(remove) if remove else None
+        for path in list(self.sources(job)) + [dest]:
+            if path in self.outputs:
+                self.wait(path)
+        if not self.staging:
+            self.staging = tempfile.mkdtemp(prefix="convertfoundry_images_")
+        staged = os.path.join(
+            self.staging, "{}{}".format(self.submitted, os.path.splitext(dest)[1])
+        )
+        self.submitted += 1
+        if self.pool:
+            need = self.estimate(job, size)
+            self.reserve(need)
+            future = self.pool.submit(render, absolute(job), staged)
+            self.running[future] = need
+        else:
+            future = concurrent.futures.Future()
+            future.set_result(render(absolute(job), staged))
+        unit = self.cache.recording if self.cache else None
+        if unit:
+            unit.defer()
+            if unit not in self.units:
+                self.units.append(unit)
+        self.queue.append((future, dest, remove, unit))
+        self.outputs[dest] = tuple(size)
+
+    def estimate(self, job, size):
+        need = 4 * size[0] * size[1] + STRIP
+        for src in self.sources(job):
+            (w, h) = self.size(src)
+            need += 4 * w * h
+        for (layer, position) in job.get("layers", ()):
+            if not layer.get("src"):
+                need += 4 * layer["size"][0] * layer["size"][1]
+        return need
+
+    def reserve(self, need):
+        """Waits for running jobs until need more bytes fit in the budget."""
+        while self.budget and self.running:
+            for future in [f for f in self.running if f.done()]:
+                del self.running[future]
+            if not self.running or sum(self.running.values()) + need <= self.budget:
+                return
+            concurrent.futures.wait(
+                list(self.running), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+    def sources(self, job):
+        if job.get("src"):
+            yield os.path.abspath(job["src"])
+        for (layer, position) in job.get("layers", ()):
+            yield from self.sources(layer)
+
+    def pending(self, path):
+        return path is not None and os.path.abspath(path) in self.outputs
+
+    def size(self, path):
+        """Returns the size path will have once its job is done, or reads it
+        from the header of an existing image."""
+        if self.pending(path):
+            return self.outputs[os.path.abspath(path)]
+        if self.index:
+            return self.index.size(path)
+        with PIL.Image.open(path) as img:
+            return img.size
+
+    def place(self, job):
+        (future, dest, remove, unit) = job
+        staged = future.result()
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(staged, dest)
+        if remove and os.path.exists(remove):
+            self.archive.remove(remove)
+        if unit:
+            unit.placed(dest, remove)
+        del self.outputs[dest]
+
+    def wait(self, path):
+        path = os.path.abspath(path)
+        for job in list(self.queue):
+            if job[1] == path:
+                self.queue.remove(job)
+                self.place(job)
+
+    def finish(self):
+        try:
+            while self.queue:
+                self.place(self.queue.pop(0))
+            for unit in self.units:
+                unit.complete()
+        finally:
+            self.close()
+        self.units = []
+
+    def close(self):
+        self.running = {}
+        if self.pool:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        if self.staging:
+            shutil.rmtree(self.staging, ignore_errors=True)
+            self.staging = None
+
+
+def syntheticMap(width, height):
+    """Returns a smooth RGB image with some grain, like a painted map."""
+    return PIL.Image.merge(
+        "RGB",
+        (
+            PIL.Image.linear_gradient("L").resize((width, height)),
+            PIL.Image.radial_gradient("L").resize((width, height)),
+            PIL.Image.effect_noise((width, height), 24),
+        ),
+    )
+
+
+def benchmark(sizes=((6000, 4500), (12000, 9000))):
+    """Times the cover, p512 pack, 4096 tile and 8192 map reductions of
+    JPEG maps of each size, decoding them whole and with draft()."""
+    PIL.Image.MAX_IMAGE_PIXELS = None
+    folder = tempfile.mkdtemp(prefix="convertfoundry_benchmark_")
+    try:
+        for (width, height) in sizes:
+            src = os.path.join(folder, "map.jpg")
+            with syntheticMap(width, height) as img:
+                img.save(src, quality=90)
+            side = min(width, height)
+            for (name, size, box) in (
+                ("cover", (1024, 1024), (0, 0, side, side)),
+                ("p512", fit(width, height, 512), None),
+                ("4096", fit(width, height, 4096), None),
+                ("8192", fit(width, height, 8192), None),
+            ):
+                timings = []
+                for reduced in (False, True):
+                    start = time.perf_counter()
+                    with PIL.Image.open(src) as img:
+                        scaled = draft(img, size, box) if reduced else box
+                        decoded = img.size
+                        img.resize(size, box=scaled).close()
+                    timings.append(time.perf_counter() - start)
+                print(
+                    "{}x{} {:>5}: full decode {:.2f}s, draft {:.2f}s decoding {}x{}".format(
+                        width, height, name, timings[0], timings[1], *decoded
+                    )
+                )
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    benchmark(
+        [tuple(int(n) for n in a.split("x")) for a in sys.argv[1:]]
+        or ((6000, 4500), (12000, 9000))
+    )
@@ -0,0 +1,291 @@
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class Collection(dict):
+    """Live documents of NeDB datafiles, keyed by source and _id.
+
+    NeDB persists an append-only log: a later line with the same _id replaces
+    the earlier document and a line with $$deleted removes it, so applying
+    lines as they are read keeps only the live documents in memory. Each
+    call to extend() or load() is a separate datafile, so documents from
+    different files that share an _id, like a world document and the pack
+    it was imported from, are all kept, in the order they were loaded. A
+    document applied on its own is a source of its own. Datafiles are read
+    with decoder, a Decoder.
+    """
+
+    def __init__(self, decoder=None):
+        super().__init__()
+        self.decoder = decoder or Decoder()
+        self.sources = 0
+
+    def source(self):
+        self.sources += 1
+        return self.sources
+
+    def apply(self, doc, source=None):
+        if "_id" not in doc:
+            return None
+        key = (self.source() if source is None else source, doc["_id"])
+        if doc.get("$$deleted"):
+            self.pop(key, None)
+            return None
+        self[key] = doc
+        return doc
+
+    def extend(self, docs, prepare=None):
+        source = self.source()
+        for doc in docs:
+            if prepare and "_id" in doc and not doc.get("$$deleted"):
+                prepare(doc)
+            self.apply(doc, source)
+        return self
+
+    def load(self, f, prepare=None):
+        return self.extend(self.decoder.read(f), prepare)
+
+    def documents(self):
+        return list(self.values())
+
+
+class DocumentStore:
+    """Live documents of NeDB datafiles, kept on disk until needed.
+
+    The first pass writes each live line to a spool file and keeps only its
+    offset and a stub with the fields lookups use (_id, name, type and the
+    token name). Full documents are decoded again from the spool when they
+    are iterated, so huge actor and item packs are never held in memory all
+    at once. Once updated and deleted documents take up more than half of
+    the spool it is rewritten with only the live ones. As in a Collection,
+    updates and deletions only apply within the datafile they were read
+    from. Datafiles are read with decoder, a Decoder.
+    """
+
+    def __init__(self, path, decoder=None):
+        self.path = path
+        self.decoder = decoder or Decoder()
+        self.offsets = {}
+        self.stubbed = {}
+        self.size = 0
+        self.live = 0
+        self.spool = None
+        self.sources = 0
+        open(self.path, "wb").close()
+
+    def stub(self, doc):
+        stub = {"_id": doc["_id"]}
+        for field in ("name", "type"):
+            if field in doc:
+                stub[field] = doc[field]
+        token = doc.get("token") or doc.get("prototypeToken")
+        if type(token) == dict and "name" in token:
+            stub["token"] = {"name": token["name"]}
+        return stub
+
+    def source(self):
+        self.sources += 1
+        return self.sources
+
+    def apply(self, doc, source, line=None):
+        if "_id" not in doc:
+            return None
+        key = (source, doc["_id"])
+        if key in self.offsets:
+            self.live -= self.offsets[key][1] + 1
+        if doc.get("$$deleted"):
+            self.offsets.pop(key, None)
+            self.stubbed.pop(key, None)
+            return None
+        if line is None:
+            line = json.dumps(doc).encode("utf8")
+        line = line.rstrip()
+        self.spool.write(line + b"\n")
+        self.offsets[key] = (self.size, len(line))
+        self.size += len(line) + 1
+        self.live += len(line) + 1
+        self.stubbed[key] = self.stub(doc)
+        if self.size > 2 * self.live + CHUNK_SIZE:
+            self.compact()
+        return doc
+
+    def compact(self):
+        """Rewrites the spool with only the live documents."""
+        self.spool.close()
+        with open(self.path, "rb") as old, open(self.path + ".tmp", "wb") as new:
+            for (key, (offset, length)) in self.offsets.items():
+                old.seek(offset)
+                self.offsets[key] = (new.tell(), length)
+                new.write(old.read(length) + b"\n")
+        os.replace(self.path + ".tmp", self.path)
+        self.size = self.live
+        self.spool = open(self.path, "ab")
+
+    def extend(self, docs, prepare=None):
+        source = self.source()
+        self.spool = open(self.path, "ab")
+        try:
+            for doc in docs:
+                if prepare and "_id" in doc and not doc.get("$$deleted"):
+                    prepare(doc)
+                self.apply(doc, source)
+        finally:
+            self.spool.close()
+            self.spool = None
+        return self
+
+    def load(self, f, prepare=None):
+        source = self.source()
+        self.spool = open(self.path, "ab")
+        try:
+            for (l, doc) in self.decoder.pairs(f):
+                if prepare and "_id" in doc and not doc.get("$$deleted"):
+                    prepare(doc)
+                    l = None
+                self.apply(doc, source, l)
+        finally:
+            self.spool.close()
+            self.spool = None
+        return self
+
+    def stubs(self):
+        return list(self.stubbed.values())
+
+    def documents(self):
+        return self
+
+    def clear(self):
+        self.offsets.clear()
+        self.stubbed.clear()
+        self.live = 0
+
+    def close(self):
+        self.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        with open(self.path, "rb") as spool:
+            for (offset, length) in list(self.offsets.values()):
+                spool.seek(offset)
+                yield loads(spool.read(length))
+
+
+def loads(line):
+    if orjson:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(line)
+
+
+def decodeBatch(batch):
+    return [loads(l) for l in batch]
+
+
+def batches(f, size=CHUNK_SIZE):
+    """Reads f in large chunks and yields the non-blank lines of each."""
+    rest = b""
+    chunk = f.read(size)
+    while chunk:
+        if type(chunk) == str:
+            chunk = chunk.encode("utf8")
+        chunk = rest + chunk
+        batch = chunk.split(b"\n")
+        rest = batch.pop()
+        batch = [l for l in batch if l.strip()]
+        if batch:
+            yield batch
+        chunk = f.read(size)
+    if rest.strip():
+        yield [rest]
+
+
+class Decoder:
+    """Decodes NeDB lines in batches and keeps load statistics.
+
+    With more than one job, batches are handed to a pool of forked worker
+    processes, a few batches ahead of the reader, and decoded documents come
+    back in file order. The workers are forked when the decoder is created,
+    before the converter starts any threads. Where fork isn't available
+    everything is decoded in this process.
+    """
+
+    def __init__(self, jobs=1):
+        if jobs > 1 and (
+            sys.platform == "darwin"
+            or "fork" not in multiprocessing.get_all_start_methods()
+        ):
+            jobs = 1
+        self.jobs = jobs
+        self.pool = None
+        if jobs > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context=multiprocessing.get_context("fork")
+            )
+            # Fork the workers now rather than on the first job
+            self.pool.submit(int).result()
+        self.docs = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def pairs(self, f):
+        """Yields (line, document) for every non-blank line of f."""
+        start = time.perf_counter()
+        pending = collections.deque()
+        for batch in batches(f):
+            self.bytes += sum(len(l) + 1 for l in batch)
+            if self.pool:
+                pending.append((batch, self.pool.submit(decodeBatch, batch)))
+                if len(pending) <= self.jobs * 2:
+                    continue
+                (batch, future) = pending.popleft()
+                docs = future.result()
+            else:
+                docs = decodeBatch(batch)
+            self.docs += len(docs)
+            self.seconds += time.perf_counter() - start
+            yield from zip(batch, docs)
+            start = time.perf_counter()
+        while pending:
+            (batch, future) = pending.popleft()
+            docs = future.result()
+            self.docs += len(docs)
+            self.seconds += time.perf_counter() - start
+            yield from zip(batch, docs)
+            start = time.perf_counter()
+
+    def read(self, f):
+        for (line, doc) in self.pairs(f):
+            yield doc
+
+    def report(self):
+        return "Decoded {} documents ({:.1f} MB) in {:.2f}s, {:.0f} docs/sec{}".format(
+            self.docs,
+            self.bytes / 1024 / 1024,
+            self.seconds,
+            self.docs / self.seconds if self.seconds else 0,
+            " using orjson" if orjson else "",
+        )
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+
@@ -0,0 +1,96 @@
+import concurrent.futures
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+
+from downloadcache import download
+
+
+class RemoteFetcher:
+    """Downloads remote assets ahead of the converters that use them.
+
+    prefetch() queues a URL, or a task that fetches several URLs, on a pool
+    limited to a fixed number of connections. Files are cached on disk by
+    the sha256 of their URL, so get() returns a local path at once when the
+    asset was prefetched or fetched by an earlier run, and downloads it
+    itself otherwise.
+    """
+
+    def __init__(self, root=None, connections=4):
+        self.temporary = root is None
+        self.root = root or tempfile.mkdtemp(prefix="convertfoundry_remote_")
+        os.makedirs(self.root, exist_ok=True)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max(1, connections))
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.downloaded = 0
+        self.cached = 0
+
+    def cachePath(self, url):
+        ext = os.path.splitext(urllib.parse.urlparse(url).path)[1]
+        return os.path.join(
+            self.root, hashlib.sha256(url.encode("utf8")).hexdigest() + ext.lower()
+        )
+
+    def fetch(self, url, progress=None):
+        path = self.cachePath(url)
+        if os.path.exists(path):
+            with self.lock:
+                self.cached += 1
+            return path
+        (fd, tmp) = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response, os.fdopen(
+                fd, "wb"
+            ) as f:
+                download(response, f, progress)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        with self.lock:
+            self.downloaded += 1
+        return path
+
+    def prefetch(self, key, task=None):
+        with self.lock:
+            if key not in self.futures:
+                self.futures[key] = self.pool.submit(
+                    task if task else lambda: self.fetch(key)
+                )
+
+    def get(self, key, task=None, progress=None):
+        with self.lock:
+            future = self.futures.get(key)
+        if future:
+            return future.result()
+        if task:
+            return task()
+        return self.fetch(key, progress)
+
+    def place(self, url, dest, progress=None):
+        """Copies the asset at url to dest. It is never linked, since the
+        converters resize and re-encode images in place, which would change
+        the cached copy too."""
+        src = self.get(url, progress=progress)
+        if os.path.exists(dest):
+            os.remove(dest)
+        shutil.copyfile(src, dest)
+        return dest
+
+    def report(self):
+        concurrent.futures.wait(list(self.futures.values()))
+        failed = sum(1 for f in self.futures.values() if f.exception())
+        return "Prefetched {} remote assets ({} downloaded, {} cached, {} failed)".format(
+            len(self.futures), self.downloaded, self.cached, failed
+        )
+
+    def close(self):
+        self.pool.shutdown()
+        if self.temporary:
+            shutil.rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,83 @@
+import os
+
+
+class AssetResolver:
+    """Resolves asset paths from Foundry documents against a ModuleArchive.
+
+    Members are looked up by their normalized path from memory, falling back
+    to a case-insensitive match since Foundry is usually run on
+    case-insensitive filesystems. A member exists until a converter removes
+    it through the archive, so only paths the archive doesn't contain, like
+    converter output, are checked on disk. Failed resolutions are counted
+    per category.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.folded = {}
+        for local in archive.members:
+            self.folded.setdefault(local.lower(), local)
+        self.resolved = 0
+        self.failed = {}
+
+    def local(self, path):
+        local = self.archive.member(path)
+        if local:
+            return local
+        local = self.archive.localPath(path)
+        return self.folded.get(local.lower(), local)
+
+    def exists(self, path):
+        """Returns whether path exists, extracting it if it is a member."""
+        local = self.local(path)
+        if local in self.archive.members:
+            self.archive.need(local)
+            return local not in self.archive.removed
+        return os.path.exists(local)
+
+    def locate(self, path, fallbacks=()):
+        """Returns the local path of the first of path and path with one of
+        the fallback extensions that exists, without extracting it."""
+        if not path or path.startswith(("http:", "https:")):
+            return None
+        candidates = [path]
+        for ext in fallbacks:
+            candidates.append(
+                os.path.splitext(self.archive.localPath(path))[0] + ext
+            )
+        for candidate in candidates:
+            local = self.local(candidate)
+            if self.archive.log is not None:
+                self.archive.log.append(local)
+            if local in self.archive.members:
+                if local not in self.archive.removed:
+                    return local
+            elif os.path.exists(local):
+                return local
+        return None
+
+    def resolve(self, path, category=None, fallbacks=()):
+        """Returns the existing file for path, or for path with one of the
+        fallback extensions, relative to the working directory. Returns None
+        and counts a failure for category when there is none."""
+        local = self.locate(path, fallbacks)
+        if local:
+            if local in self.archive.members:
+                self.archive.need(local)
+            self.resolved += 1
+            return os.path.relpath(local)
+        if category and path and not path.startswith(("http:", "https:")):
+            self.failed[category] = self.failed.get(category, 0) + 1
+        return None
+
+    def report(self):
+        if not self.failed:
+            return "Resolved {} assets".format(self.resolved)
+        return "Resolved {} assets, {} missing ({})".format(
+            self.resolved,
+            sum(self.failed.values()),
+            ", ".join(
+                "{} {}".format(count, category)
+                for (category, count) in sorted(self.failed.items())
+            ),
+        )
@@ -0,0 +1,117 @@
+import http.server
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloadcache import DownloadCache
+
+
+class ArchiveServer(http.server.ThreadingHTTPServer):
+    """Serves files from a dict of path to (body, etag) with Range support,
+    counting the requests that download more than the first byte."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), ArchiveHandler)
+        self.files = {}
+        self.downloads = {}
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server_address[1], path)
+
+
+class ArchiveHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path not in self.server.files:
+            self.send_error(404)
+            return
+        (body, etag) = self.server.files[self.path]
+        m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if m and self.headers.get("If-Range") in (None, etag):
+            (start, end) = (int(m.group(1)), min(int(m.group(2)), len(body) - 1))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, end, len(body))
+            )
+        else:
+            (start, end) = (0, len(body) - 1)
+            self.send_response(200)
+        if end > start:
+            self.server.downloads[self.path] = self.server.downloads.get(self.path, 0) + 1
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        self.wfile.write(body[start : end + 1])
+
+
+class DownloadCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ArchiveServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.root = tempfile.mkdtemp(prefix="convertfoundry_test_")
+        self.dest = os.path.join(self.root, "module.zip")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def publish(self, path, body, etag):
+        self.server.files[path] = (body, etag)
+        return {"download": self.server.url(path), "version": "1.0"}
+
+    def fetch(self, cache, manifest, name="module"):
+        hit = cache.fetch(self.server.url("/" + name + ".json"), manifest, self.dest)
+        with open(self.dest, "rb") as f:
+            self.assertEqual(f.read(), self.server.files[self.path(manifest)][0])
+        return hit
+
+    def path(self, manifest):
+        return manifest["download"][len(self.server.url("")) :]
+
+    def testSecondFetchIsAHit(self):
+        manifest = self.publish("/module.zip", b"PK" * 5000, '"a"')
+        cache = DownloadCache(os.path.join(self.root, "cache"))
+        self.assertFalse(self.fetch(cache, manifest))
+        self.assertTrue(self.fetch(cache, manifest))
+        self.assertTrue(self.fetch(DownloadCache(cache.root), manifest))
+        self.assertEqual(self.server.downloads["/module.zip"], 1)
+
+    def testVersionOrEtagChangeFetchesAgain(self):
+        manifest = self.publish("/module.zip", b"PK" * 5000, '"a"')
+        cache = DownloadCache(os.path.join(self.root, "cache"))
+        self.assertFalse(self.fetch(cache, manifest))
+        manifest["version"] = "1.1"
+        self.assertFalse(self.fetch(cache, manifest))
+        self.assertTrue(self.fetch(cache, manifest))
+        self.publish("/module.zip", b"PK" * 5001, '"b"')
+        self.assertFalse(self.fetch(cache, manifest))
+        self.assertEqual(self.server.downloads["/module.zip"], 3)
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        manifests = [
+            self.publish("/{}.zip".format(n), bytes([n]) * 4000, '"{}"'.format(n))
+            for n in range(3)
+        ]
+        cache = DownloadCache(os.path.join(self.root, "cache"), maxSize=10000)
+        self.fetch(cache, manifests[0], "0")
+        self.fetch(cache, manifests[1], "1")
+        self.assertTrue(self.fetch(cache, manifests[0], "0"))
+        self.fetch(cache, manifests[2], "2")
+        self.assertEqual(len(os.listdir(os.path.join(cache.root, "objects"))), 2)
+        self.assertTrue(self.fetch(cache, manifests[0], "0"))
+        self.assertTrue(self.fetch(cache, manifests[2], "2"))
+        self.assertFalse(self.fetch(cache, manifests[1], "1"))
+        self.assertEqual(self.server.downloads["/1.zip"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import math
+import numpy
+
+
+class SceneTransform:
+    """Maps Foundry scene coordinates onto the converted map.
+
+    Each object class in a scene is gathered into arrays so the offset,
+    rescale and token alignment math runs once per class instead of once per
+    value, and results are formatted in bulk.
+    """
+
+    def __init__(self, offsetX, offsetY, rescale):
+        self.offsetX = offsetX
+        self.offsetY = offsetY
+        self.rescale = rescale
+
+    def column(self, objects, getter):
+        return numpy.array([getter(o) for o in objects], dtype=float)
+
+    def x(self, values, shift=0.0):
+        return (numpy.asarray(values, dtype=float) - self.offsetX + shift) * self.rescale
+
+    def y(self, values, shift=0.0):
+        return (numpy.asarray(values, dtype=float) - self.offsetY + shift) * self.rescale
+
+    def points(self, objects, shiftX=None, shiftY=None):
+        xs = self.x(self.column(objects, lambda o: o["x"]), 0.0 if shiftX is None else shiftX)
+        ys = self.y(self.column(objects, lambda o: o["y"]), 0.0 if shiftY is None else shiftY)
+        return (xs, ys)
+
+    def walls(self, walls):
+        c = numpy.array([w["c"][:4] for w in walls], dtype=float).reshape(-1, 4)
+        c[:, 0::2] = (c[:, 0::2] - self.offsetX) * self.rescale
+        c[:, 1::2] = (c[:, 1::2] - self.offsetY) * self.rescale
+        return c.tolist()
+
+    def polyline(self, points, x, y):
+        p = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        p[:, 0] = (p[:, 0] - self.offsetX + x) * self.rescale
+        p[:, 1] = (p[:, 1] - self.offsetY + y) * self.rescale
+        return ",".join(str(v) for v in p.ravel().tolist())
+
+    def tokenOffsets(self, widths, heights, gridSize, gridType):
+        w = numpy.asarray(widths, dtype=float)
+        h = numpy.asarray(heights, dtype=float)
+        if 4 <= gridType <= 5:
+            ox = numpy.round(((2 * gridSize * 0.75 * w) + (gridSize / 2)) / 2)
+            oy = numpy.round((math.sqrt(3) * gridSize * h) / 2)
+            if gridType == 5:
+                ox += round(gridSize)
+        elif 2 <= gridType <= 3:
+            ox = numpy.round((math.sqrt(3) * gridSize * w) / 2)
+            oy = numpy.round(((2 * gridSize * 0.75 * h) + (gridSize / 2)) / 2)
+            if gridType == 3:
+                ox += round(gridSize)
+        else:
+            ox = numpy.round(w * (gridSize / 2))
+            oy = numpy.round(h * (gridSize / 2))
+        return (ox, oy)
+
+
+def rounded(values, offsets=None):
+    r = numpy.round(values)
+    if offsets is not None:
+        r = r + offsets
+    return [str(v) for v in r.astype(numpy.int64).tolist()]
@@ -0,0 +1,303 @@
+import collections
+import math
+import random
+import sys
+import time
+import numpy
+
+
+class WallChain:
+    def __init__(self, wallId, key, wall, order=0):
+        self.id = wallId
+        self.order = order
+        self.key = key
+        self.wall = wall
+        self.points = collections.deque()
+
+    @property
+    def head(self):
+        return self.points[0]
+
+    @property
+    def tail(self):
+        return self.points[-1]
+
+    def data(self):
+        return ",".join(x + "," + y for (x, y) in self.points)
+
+    def simplify(self, tolerance):
+        keep = simplify(numpy.array(self.points, dtype=float), tolerance)
+        self.points = collections.deque(p for (p, k) in zip(self.points, keep) if k)
+
+
+class WallStitcher:
+    """Joins wall segments into polylines.
+
+    Open chains are indexed by (key, endpoint) where key holds the wall
+    properties that must match for two segments to share a polyline, so each
+    segment is appended, prepended or used to join two chains in constant
+    time instead of searching every wall emitted so far.
+    """
+
+    def __init__(self, precision="{:.1f}"):
+        self.precision = precision
+        self.chains = []
+        self.heads = {}
+        self.tails = {}
+        self.segments = 0
+
+    def point(self, x, y):
+        return (self.precision.format(x), self.precision.format(y))
+
+    def _link(self, index, key, pt, chain):
+        index.setdefault((key, pt), []).append(chain)
+
+    def _unlink(self, index, key, pt, chain):
+        chains = index.get((key, pt))
+        if chains:
+            chains.remove(chain)
+            if not chains:
+                del index[(key, pt)]
+
+    def _find(self, index, key, pt):
+        chains = index.get((key, pt))
+        return chains[-1] if chains else None
+
+    def _close(self, chain):
+        self._unlink(self.heads, chain.key, chain.head, chain)
+        self._unlink(self.tails, chain.key, chain.tail, chain)
+
+    def _stitch(self, key, a, b):
+        before = self._find(self.tails, key, a)
+        after = self._find(self.heads, key, b)
+        if before and after and before is not after:
+            self._close(before)
+            self._close(after)
+            if len(after.points) < len(before.points):
+                before.points.extend(after.points)
+                chain, merged = before, after
+            else:
+                after.points.extendleft(reversed(before.points))
+                chain, merged = after, before
+            if merged.order < chain.order:
+                chain.id, chain.wall, chain.order = merged.id, merged.wall, merged.order
+            merged.points = None
+        elif before:
+            self._close(before)
+            before.points.append(b)
+            chain = before
+        elif after:
+            self._close(after)
+            after.points.appendleft(a)
+            chain = after
+        else:
+            return None
+        if chain.head != chain.tail:
+            self._link(self.heads, key, chain.head, chain)
+            self._link(self.tails, key, chain.tail, chain)
+        return chain
+
+    def add(self, wallId, key, path, wall=None, reversible=True):
+        self.segments += 1
+        a = self.point(path[0], path[1])
+        b = self.point(path[2], path[3])
+        chain = self._stitch(key, a, b)
+        if chain is None and reversible:
+            chain = self._stitch(key, b, a)
+        if chain is None:
+            chain = WallChain(wallId, key, wall, len(self.chains))
+            chain.points.extend((a, b))
+            self.chains.append(chain)
+            if a != b:
+                self._link(self.heads, key, a, chain)
+                self._link(self.tails, key, b, chain)
+        return chain
+
+    def simplify(self, tolerance):
+        before = after = 0
+        for chain in self.chains:
+            if not chain.points:
+                continue
+            before += len(chain.points)
+            chain.simplify(tolerance)
+            after += len(chain.points)
+        return (before, after)
+
+    def __iter__(self):
+        return iter(sorted((c for c in self.chains if c.points), key=lambda c: c.order))
+
+    def __len__(self):
+        return sum(1 for c in self.chains if c.points)
+
+
+class WallGrid:
+    def __init__(self, cell=64.0):
+        self.cell = cell
+        self.cells = {}
+
+    def cellsOf(self, path):
+        (x1, y1, x2, y2) = path
+        steps = max(1, int(math.hypot(x2 - x1, y2 - y1) / (self.cell / 2)))
+        return {
+            (
+                math.floor((x1 + (x2 - x1) * i / steps) / self.cell),
+                math.floor((y1 + (y2 - y1) * i / steps) / self.cell),
+            )
+            for i in range(steps + 1)
+        }
+
+    def insert(self, path, value):
+        for cell in self.cellsOf(path):
+            self.cells.setdefault(cell, []).append(value)
+
+    def near(self, path):
+        found = set()
+        for (cx, cy) in self.cellsOf(path):
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    found.update(self.cells.get((cx + dx, cy + dy), ()))
+        return found
+
+
+def removeOverlaps(segments, tolerance=0.5, cell=64.0, extendable=None):
+    """Drops wall segments covered by another segment with the same key.
+
+    segments are lists of [wallId, key, path, wall, reversible] as passed to
+    WallStitcher.add. Longer segments are placed in a spatial grid first;
+    a segment that lies on one of them is dropped, and a partially overlapping
+    segment extends the longer one when extendable(key) allows it. Returns the remaining segments in
+    their original order along with the number dropped.
+    """
+    order = sorted(
+        range(len(segments)),
+        key=lambda i: -math.hypot(
+            segments[i][2][2] - segments[i][2][0], segments[i][2][3] - segments[i][2][1]
+        ),
+    )
+    grid = WallGrid(cell)
+    dropped = set()
+    for i in order:
+        (wallId, key, path, wall, reversible) = segments[i]
+        (px, py, qx, qy) = path
+        if math.hypot(qx - px, qy - py) <= tolerance:
+            dropped.add(i)
+            continue
+        for j in grid.near(path):
+            other = segments[j]
+            if other[1] != key:
+                continue
+            (ax, ay, bx, by) = other[2]
+            (dx, dy) = (bx - ax, by - ay)
+            length = math.hypot(dx, dy)
+            if (
+                abs(dx * (py - ay) - dy * (px - ax)) / length > tolerance
+                or abs(dx * (qy - ay) - dy * (qx - ax)) / length > tolerance
+            ):
+                continue
+            if not reversible and (qx - px) * dx + (qy - py) * dy <= 0:
+                continue
+            tp = ((px - ax) * dx + (py - ay) * dy) / (length * length)
+            tq = ((qx - ax) * dx + (qy - ay) * dy) / (length * length)
+            slack = tolerance / length
+            if min(tp, tq) >= -slack and max(tp, tq) <= 1 + slack:
+                dropped.add(i)
+                break
+            if extendable and not extendable(key):
+                continue
+            if min(1.0, max(tp, tq)) - max(0.0, min(tp, tq)) > slack:
+                start = min(0.0, tp, tq)
+                end = max(1.0, tp, tq)
+                other[2] = [ax + dx * start, ay + dy * start, ax + dx * end, ay + dy * end]
+                grid.insert(other[2], j)
+                dropped.add(i)
+                break
+        if i not in dropped:
+            segments[i] = [wallId, key, list(path), wall, reversible]
+            grid.insert(path, i)
+    return ([s for (i, s) in enumerate(segments) if i not in dropped], len(dropped))
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker over an (n, 2) array, returns a mask of kept vertices.
+
+    Distances are measured to the segment rather than the infinite line so a
+    wall that doubles back on itself keeps its turning point.
+    """
+    keep = numpy.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        (first, last) = stack.pop()
+        if last - first < 2:
+            continue
+        a = points[first]
+        d = points[last] - a
+        rel = points[first + 1:last] - a
+        length = d.dot(d)
+        if length > 0:
+            t = numpy.clip(rel.dot(d) / length, 0.0, 1.0)
+            rel = rel - numpy.outer(t, d)
+        dist = numpy.hypot(rel[:, 0], rel[:, 1])
+        i = int(dist.argmax())
+        if dist[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def naiveStitch(segments):
+    walls = []
+    for (wallId, key, path) in segments:
+        data = ",".join("{:.1f}".format(x) for x in path)
+        start = ",{:.1f},{:.1f}".format(path[0], path[1])
+        for w in walls:
+            if w[1] == key and w[2].endswith(start):
+                w[2] += "," + data
+                break
+        else:
+            walls.append([wallId, key, data])
+    return walls
+
+
+def syntheticWalls(count, seed=0):
+    rnd = random.Random(seed)
+    keys = [("normal", None, None), ("door", "open", None), ("normal", None, "left")]
+    segments = []
+    x = y = 0.0
+    for i in range(count):
+        if i % 25 == 0:
+            x = rnd.randrange(0, 8000, 50)
+            y = rnd.randrange(0, 8000, 50)
+            key = keys[0] if rnd.random() < 0.9 else rnd.choice(keys)
+        nx = x + rnd.choice((50, 0, -50))
+        ny = y + (50 if nx == x else 0)
+        segments.append(("w{}".format(i), key, [x, y, nx, ny]))
+        x, y = nx, ny
+    rnd.shuffle(segments)
+    return segments
+
+
+def benchmark(counts=(1000, 5000, 10000)):
+    for count in counts:
+        segments = syntheticWalls(count)
+        start = time.perf_counter()
+        stitcher = WallStitcher()
+        for (wallId, key, path) in segments:
+            stitcher.add(wallId, key, path, reversible=key[2] is None)
+        hashed = time.perf_counter() - start
+        start = time.perf_counter()
+        naive = naiveStitch(segments)
+        linear = time.perf_counter() - start
+        print(
+            "{:6d} walls: hashed {:.3f}s -> {} chains, string match {:.3f}s -> {} chains".format(
+                count, hashed, len(stitcher), linear, len(naive)
+            )
+        )
+
+
+if __name__ == "__main__":
+    benchmark([int(c) for c in sys.argv[1:]] or (1000, 5000, 10000))
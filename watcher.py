@@ -0,0 +1,66 @@
+import os
+import time
+
+# Written by LevelDB whenever Foundry opens a compendium, not by edits.
+IGNORED = {"LOCK", "LOG", "LOG.old"}
+
+
+class SourceWatcher:
+    """Polls an unpacked module or world folder for changes.
+
+    The size and mtime of every file is kept in an index, so each poll is a
+    single walk of the folder with no reads. Dot folders are skipped like
+    DirectoryArchive does, along with the bookkeeping files LevelDB touches
+    without changing any documents, and any paths given in ignore.
+    """
+
+    def __init__(self, path, interval=1.0, settle=1.0, ignore=()):
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self.settle = settle
+        self.ignore = {os.path.abspath(p) for p in ignore}
+        self.index = self.scan()
+
+    def scan(self):
+        files = {}
+        for root, dirs, names in os.walk(self.path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for name in names:
+                path = os.path.join(root, name)
+                if name in IGNORED or path in self.ignore:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, self.path).replace(os.sep, "/")] = (
+                    st.st_size,
+                    st.st_mtime_ns,
+                )
+        return files
+
+    def changes(self, files):
+        return sorted(
+            {n for n in files if self.index.get(n) != files[n]}
+            | {n for n in self.index if n not in files}
+        )
+
+    def wait(self):
+        """Blocks until files change and then stay unchanged for the settle
+        time, since Foundry saves a compendium as several writes. Returns the
+        changed paths and updates the index."""
+        while True:
+            time.sleep(self.interval)
+            files = self.scan()
+            if not self.changes(files):
+                continue
+            while True:
+                time.sleep(self.settle)
+                latest = self.scan()
+                if latest == files:
+                    break
+                files = latest
+            changed = self.changes(files)
+            self.index = files
+            if changed:
+                return changed
@@ -0,0 +1,62 @@
+import posixpath
+
+
+class ZipIndex:
+    """Directory, basename and extension index over the members of a zip.
+
+    The central directory is walked once and each name is split once, so
+    resolving packs and manifests doesn't rescan namelist() for every lookup.
+    """
+
+    def __init__(self, z):
+        self.order = {}
+        self.files = {}
+        self.dirs = {""}
+        self.byName = {}
+        self.byExt = {}
+        for name in z.namelist():
+            self.add(name)
+
+    def add(self, name):
+        self.order[name] = len(self.order)
+        (parent, base) = posixpath.split(name)
+        self.files.setdefault(parent, [])
+        if base:
+            self.files[parent].append(base)
+            self.byName.setdefault(base, []).append(name)
+            ext = posixpath.splitext(base)[1].lower()
+            self.byExt.setdefault(ext, []).append(name)
+        while parent not in self.dirs:
+            self.dirs.add(parent)
+            parent = posixpath.dirname(parent)
+
+    def hasDir(self, path):
+        return path.rstrip("/") in self.dirs
+
+    def find(self, basename, parent=None):
+        names = self.byName.get(basename, [])
+        if parent is None:
+            return list(names)
+        return [
+            n for n in names if posixpath.basename(posixpath.dirname(n)) == parent
+        ]
+
+    def extension(self, ext):
+        return list(self.byExt.get(ext.lower(), []))
+
+    def listdir(self, path):
+        return list(self.files.get(path.rstrip("/"), []))
+
+    def directories(self):
+        return list(self.files)
+
+    def manifest(self, names=("module.json", "system.json")):
+        """Returns the world.json, module.json or system.json that describes
+        the archive and whether it is a world."""
+        worlds = self.find("world.json")
+        if worlds:
+            return (worlds[-1], True)
+        found = [n for b in names for n in self.find(b)]
+        if found:
+            return (min(found, key=self.order.get), False)
+        return (None, False)